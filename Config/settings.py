@@ -267,6 +267,217 @@ CELERY_RESULT_SERIALIZER = 'json'
 CELERY_TIMEZONE = 'UTC'
 
 
+# ---------------------------------------------------------------------------
+# CACHES
+# local  → in-process memory for everything
+# production → Redis for caches shared between the web and Celery containers
+# ---------------------------------------------------------------------------
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+}
+
+if IS_LOCAL or not os.getenv('REDIS_URL'):
+    CACHES['extraction'] = {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'extraction',
+    }
+else:
+    CACHES['extraction'] = {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': os.getenv('REDIS_URL'),
+        'KEY_PREFIX': 'socratic',
+    }
+
+# Extracted-text cache keyed by the SHA-256 of the uploaded file (Socratic.utils.extraction_cache).
+# Entries only expire (TIMEOUT) or are evicted by Redis (maxmemory-policy allkeys-lru).
+EXTRACTION_CACHE = {
+    'ENABLED': os.getenv('EXTRACTION_CACHE_ENABLED', 'true').lower() == 'true',
+    'ALIAS': 'extraction',
+    'MAX_ENTRY_BYTES': int(os.getenv('EXTRACTION_CACHE_MAX_ENTRY_BYTES', 32 * 1024 * 1024)),  # larger texts are not cached
+    'TIMEOUT': 60 * 60 * 24 * 30,  # 30 days
+}
+
+# Map-reduce summaries for documents beyond the prompt budget (Socratic.utils.map_reduce)
+SUMMARY_MAP_REDUCE = {
+    'CHUNK_PAGES': int(os.getenv('SUMMARY_CHUNK_PAGES', 40)),
+    'CHUNK_CHARS': int(os.getenv('SUMMARY_CHUNK_CHARS', 120_000)),  # non-PDF files
+    'CONCURRENCY': int(os.getenv('SUMMARY_MAP_CONCURRENCY', 4)),
+    'CACHE_ALIAS': 'extraction',
+    'CACHE_TIMEOUT': 60 * 60 * 24 * 7,  # 7 days
+}
+
+# Gemini response cache (Socratic.utils.llm_cache): in-process LRU in front of the shared cache.
+# Shared entries only expire (TIMEOUT) or are evicted by Redis (maxmemory-policy allkeys-lru).
+LLM_CACHE = {
+    'ENABLED': os.getenv('LLM_CACHE_ENABLED', 'true').lower() == 'true',
+    'ALIAS': 'extraction',
+    'MAX_ENTRY_BYTES': int(os.getenv('LLM_CACHE_MAX_ENTRY_BYTES', 1024 * 1024)),  # larger answers are not shared
+    'TIMEOUT': 60 * 60 * 24 * 7,  # 7 days
+    'MEMORY_MAX_ENTRIES': int(os.getenv('LLM_CACHE_MEMORY_ENTRIES', 256)),
+    'MEMORY_MAX_BYTES': 32 * 1024 * 1024,
+}
+
+# Shared Gemini client (Socratic.utils.gemini_client): requests in flight per worker process
+GEMINI_CLIENT = {
+    'TRANSPORT': os.getenv('GEMINI_TRANSPORT') or None,  # None: gRPC (grpc_asyncio for the async client)
+    'MAX_IN_FLIGHT': int(os.getenv('GEMINI_MAX_IN_FLIGHT', 8)),
+    'MODEL_MAX_IN_FLIGHT': {},  # e.g. {'models/gemini-2.5-pro': 2}
+}
+
+# Model per call type and prompt size (GeminiConfig.route). The first rule whose MAX_TOKENS
+# the prompt fits (no MAX_TOKENS: any size) gives the models in fallback order; the next one is
+# tried on a rate limit, overload or timeout. Calls in a Gemini context session stay on its model.
+_FLASH = os.getenv('GEMINI_MODEL', 'gemini-2.5-flash')
+_FLASH_LITE = os.getenv('GEMINI_LITE_MODEL', 'gemini-2.5-flash-lite')
+MODEL_ROUTING = {
+    # Off locally: every call uses the processor's own model (and tests can swap it)
+    'ENABLED': os.getenv('MODEL_ROUTING_ENABLED', 'false' if IS_LOCAL else 'true').lower() == 'true',
+    'DEFAULT': [_FLASH, _FLASH_LITE],
+    'ROUTES': {
+        'summary': [{'MODELS': [_FLASH, _FLASH_LITE]}],
+        'summary_chunk': [{'MODELS': [_FLASH, _FLASH_LITE]}],
+        'qa': [{'MODELS': [_FLASH, _FLASH_LITE]}],
+        'study_pack': [{'MODELS': [_FLASH, _FLASH_LITE]}],
+        'flashcards': [{'MAX_TOKENS': 8_000, 'MODELS': [_FLASH_LITE, _FLASH]}, {'MODELS': [_FLASH, _FLASH_LITE]}],
+        'quiz_batch': [{'MAX_TOKENS': 6_000, 'MODELS': [_FLASH_LITE, _FLASH]}, {'MODELS': [_FLASH, _FLASH_LITE]}],
+        'answer': [{'MODELS': [_FLASH_LITE, _FLASH]}],
+        'distractors': [{'MODELS': [_FLASH_LITE, _FLASH]}],
+        'explanation': [{'MODELS': [_FLASH_LITE, _FLASH]}],
+    },
+}
+
+# Requests/tokens-per-minute quota per Gemini model (Socratic.utils.rate_limiter), shared by all
+# workers through Redis; calls wait for quota instead of failing with 429s. Keys: model names.
+GEMINI_RATE_LIMITS = {
+    # Off locally: the fake backend has no quota
+    'ENABLED': os.getenv('GEMINI_RATE_LIMIT_ENABLED', 'false' if IS_LOCAL else 'true').lower() == 'true',
+    'REDIS_URL': None if IS_LOCAL else os.getenv('REDIS_URL'),  # None: per-process buckets
+    'KEY_PREFIX': 'socratic:quota',
+    'DEFAULT': {'RPM': int(os.getenv('GEMINI_RPM', 1000)), 'TPM': int(os.getenv('GEMINI_TPM', 1_000_000))},
+    'MODELS': {
+        _FLASH_LITE: {'RPM': int(os.getenv('GEMINI_LITE_RPM', 4000)), 'TPM': int(os.getenv('GEMINI_LITE_TPM', 4_000_000))},
+    },
+    'OUTPUT_TOKENS': 1024,  # reserved per call until the response reports its usage
+    'MAX_WAIT': int(os.getenv('GEMINI_RATE_LIMIT_MAX_WAIT', 120)),  # seconds, then ResourceExhausted
+}
+
+# Per-call LLM accounting (Socratic.utils.llm_metrics), appended to logs.LLMCall in batches
+LLM_METRICS = {
+    # Off locally: nothing is written from tests and dev runs
+    'ENABLED': os.getenv('LLM_METRICS_ENABLED', 'false' if IS_LOCAL else 'true').lower() == 'true',
+    'FLUSH_SIZE': int(os.getenv('LLM_METRICS_FLUSH_SIZE', 50)),
+    'FLUSH_INTERVAL': int(os.getenv('LLM_METRICS_FLUSH_INTERVAL', 30)),  # seconds
+}
+
+# Prompt budgets in (estimated) tokens per tier (Socratic.utils.token_budget); whole sections are packed
+PROMPT_TOKEN_BUDGETS = {
+    'CALIBRATION': float(os.getenv('PROMPT_TOKEN_BUDGET_CALIBRATION', 1.0)),  # TokenEstimator.calibrate()
+    'free': {
+        'STUDY': int(os.getenv('FREE_STUDY_TOKENS', 12_500)),
+        'QA_STUDY': int(os.getenv('FREE_QA_STUDY_TOKENS', 10_000)),
+        'CONTEXT': int(os.getenv('FREE_CONTEXT_TOKENS', 2_500)),
+        'EXTRACT': int(os.getenv('FREE_EXTRACT_TOKENS', 4_000)),  # extractive pre-summary of the notes
+    },
+    'premium': {
+        'STUDY': int(os.getenv('PREMIUM_STUDY_TOKENS', 50_000)),
+        'QA_STUDY': int(os.getenv('PREMIUM_QA_STUDY_TOKENS', 50_000)),
+        'CONTEXT': int(os.getenv('PREMIUM_CONTEXT_TOKENS', 12_500)),
+        'EXTRACT': int(os.getenv('PREMIUM_EXTRACT_TOKENS', 25_000)),  # extractive pre-summary of the notes
+    },
+    'quiz': {
+        'CONTEXT': int(os.getenv('QUIZ_CONTEXT_TOKENS', 3_750)),
+    },
+}
+
+# Extractive pre-summary (Socratic.utils.extractive_summary): ranks paragraphs locally and keeps
+# the best PROMPT_TOKEN_BUDGETS[tier]['EXTRACT'] tokens of the whole document, in document order
+EXTRACTIVE_SUMMARY = {
+    'ENABLED': os.getenv('EXTRACTIVE_SUMMARY_ENABLED', 'true').lower() == 'true',
+    'METHOD': os.getenv('EXTRACTIVE_SUMMARY_METHOD', 'textrank'),  # textrank | tfidf (centroid similarity)
+    'MAX_FEATURES': 4096,  # TF-IDF terms, the ones shared by most paragraphs
+    'DAMPING': 0.85,
+    'ITERATIONS': 50,
+    'REDUNDANCY': 0.85,  # skip paragraphs at least this similar (cosine) to one already kept
+    'PRIORITY_BOOST': 1.0,  # paragraphs matching past questions score up to (1 + boost) times higher
+}
+
+# BM25 retrieval for quiz prompts (Socratic.utils.passage_index): when a summary exceeds the
+# quiz CONTEXT budget, each prompt gets the TOP_K passages about its questions instead
+QUIZ_RETRIEVAL = {
+    'ENABLED': os.getenv('QUIZ_RETRIEVAL_ENABLED', 'true').lower() == 'true',
+    'TOP_K': int(os.getenv('QUIZ_RETRIEVAL_TOP_K', 4)),  # passages per question
+    'PASSAGE_TOKENS': 300,  # summary sections larger than this are split into paragraphs
+    'K1': 1.2,
+    'B': 0.75,
+    'CACHE_ALIAS': 'extraction',
+    'CACHE_TIMEOUT': 60 * 60 * 24 * 7,  # 7 days
+}
+
+# Live summary deltas for the status SSE stream (Socratic.utils.summary_stream)
+SUMMARY_STREAM = {
+    'ENABLED': os.getenv('SUMMARY_STREAM_ENABLED', 'true').lower() == 'true',
+    'CACHE_ALIAS': 'extraction',
+    'TIMEOUT': 60 * 60,
+    'PUBLISH_INTERVAL': 0.25,  # seconds between cache writes while streaming
+}
+
+# Study context shared by all prompts about one document (Socratic.utils.context_session)
+# gemini → uploaded once as Gemini CachedContent; inline → sent with every prompt
+CONTEXT_SESSIONS = {
+    'BACKEND': os.getenv('CONTEXT_SESSION_BACKEND', 'inline' if IS_LOCAL else 'gemini').strip().lower(),
+    'MIN_TOKENS': int(os.getenv('CONTEXT_SESSION_MIN_TOKENS', 1024)),  # provider minimum for a context cache
+    'TTL': int(os.getenv('CONTEXT_SESSION_TTL', 15 * 60)),  # seconds; the session deletes it earlier
+}
+
+
+# ---------------------------------------------------------------------------
+# OCR (image uploads)
+# ocrspace  → hosted OCR.space API (needs OCR_API_KEY)
+# tesseract → local Tesseract (needs the tesseract binary on the worker)
+# fake      → offline stand-in for load tests (see FAKE_BACKENDS)
+# ---------------------------------------------------------------------------
+OCR_CONFIG = {
+    'BACKEND': os.getenv('OCR_BACKEND', 'ocrspace'),
+    'LANGUAGE': os.getenv('OCR_LANGUAGE', 'eng'),
+    'TIMEOUT': int(os.getenv('OCR_TIMEOUT', 30)),  # seconds, OCR.space request
+    'TARGET_DPI': int(os.getenv('OCR_TARGET_DPI', 300)),
+    'TILE_HEIGHT': int(os.getenv('OCR_TILE_HEIGHT', 2400)),  # rows per tile after downscaling
+    'WORKERS': int(os.getenv('OCR_WORKERS', os.cpu_count() or 1)),
+}
+
+# Text to speech for audio summaries: gtts → Google Translate TTS; fake → silent MP3 (load tests)
+TTS_CONFIG = {
+    'BACKEND': os.getenv('TTS_BACKEND', 'gtts'),
+}
+
+
+# ---------------------------------------------------------------------------
+# LOAD TESTING (bench_pipeline.py)
+# LLM_BACKEND: gemini → real API; fake → deterministic local responses;
+#   record → real API, every response saved to a cassette; replay → cassette responses only
+# OCR_BACKEND=fake and TTS_BACKEND=fake take OCR.space and gTTS out of the loop as well
+# ---------------------------------------------------------------------------
+LLM_BACKEND = {
+    'BACKEND': os.getenv('LLM_BACKEND', 'gemini').strip().lower(),
+    'CASSETTE_DIR': os.getenv('LLM_CASSETTE_DIR', str(BASE_DIR / 'cassettes')),
+}
+
+# Simulated service behaviour of the fake backends (Socratic.utils.fake_backends); replay uses the llm latency
+FAKE_BACKENDS = {
+    'LATENCY': {  # mean seconds per call
+        'llm': float(os.getenv('FAKE_LLM_LATENCY', 2.0)),
+        'ocr': float(os.getenv('FAKE_OCR_LATENCY', 1.0)),
+        'tts': float(os.getenv('FAKE_TTS_LATENCY', 1.5)),
+    },
+    'JITTER': float(os.getenv('FAKE_LATENCY_JITTER', 0.25)),  # ± fraction of the mean
+    'ERROR_RATE': float(os.getenv('FAKE_ERROR_RATE', 0.0)),  # probability that a call fails
+    'SEED': int(os.getenv('FAKE_BACKEND_SEED', 0)),
+    'STREAM_CHUNK_CHARS': 200,
+}
+
+
 # ---------------------------------------------------------------------------
 # SECURITY
 # local  → relaxed (no HTTPS enforcement)
@@ -1,6 +1,7 @@
 import os
 import subprocess
 from celery import shared_task
+from django.conf import settings
 from django.contrib.auth import get_user_model
 from django.utils import timezone
 from logs.models import LogEntry 
@@ -12,41 +13,70 @@ from .utils.text_to_speech import TextToSpeech
 from .utils.pdf_generator import AdvancedPDFGenerator
 from .utils.quiz_generator import AdvancedQuizGenerator, AIPoweredQuizGenerator
 from .utils.file_helpers import _cleanup_uploaded_file
+from .utils.extraction_cache import ExtractionCache
+from .utils.llm_metrics import LLMMetrics
+from .utils.map_reduce import MapReduceSummarizer
+from .utils.summary_stream import SummaryStream
 from django.core.files.storage import default_storage
+import hashlib
+import io
 import tempfile
 import time
 
 User = get_user_model()
 
-def _download_from_storage(storage_path):
+# Uploads up to this size are extracted straight from memory; larger ones spill to an anonymous temp file
+STORAGE_SPOOL_MAX_BYTES = int(os.getenv('STORAGE_SPOOL_MAX_BYTES', 64 * 1024 * 1024))
+STORAGE_CHUNK_SIZE = 1024 * 1024
+
+def _read_from_storage(storage_path):
     """
-    Download file from R2 storage to a temporary local file.
-    Returns the temp file path.
+    Stream a file from R2 storage in chunks into an in-memory buffer, spilling to an
+    unnamed temp file past STORAGE_SPOOL_MAX_BYTES. The SHA-256 is computed on the way.
+    Returns (buffer, sha256_hex, size); the buffer is passed to DocumentProcessor as-is.
     """
     if not storage_path or not default_storage.exists(storage_path):
         raise Exception(f"File not found in storage: {storage_path}")
     
-    # Get file extension
-    file_extension = os.path.splitext(storage_path)[1]
-    
-    # Create temp file
-    fd, temp_path = tempfile.mkstemp(suffix=file_extension)
+    buffer = io.BytesIO()
+    digest = hashlib.sha256()
+    size = 0
     
     try:
-        os.close(fd)
-        
-        # Download from R2 to temp file
         with default_storage.open(storage_path, 'rb') as source_file:
-            with open(temp_path, 'wb') as dest_file:
-                dest_file.write(source_file.read())
+            for chunk in source_file.chunks(STORAGE_CHUNK_SIZE):
+                digest.update(chunk)
+                size += len(chunk)
+                
+                # Spill to disk once the in-memory copy would grow past the limit
+                if isinstance(buffer, io.BytesIO) and size > STORAGE_SPOOL_MAX_BYTES:
+                    spilled = tempfile.TemporaryFile(suffix=os.path.splitext(storage_path)[1])
+                    spilled.write(buffer.getbuffer())
+                    buffer.close()
+                    buffer = spilled
+                
+                buffer.write(chunk)
         
-        print(f"Downloaded from R2: {storage_path} -> {temp_path}")
-        return temp_path
+        buffer.seek(0)
+        location = 'memory' if isinstance(buffer, io.BytesIO) else 'spooled temp file'
+        print(f"Read from R2: {storage_path} ({size} bytes, {location})")
+        return buffer, digest.hexdigest(), size
         
     except Exception as e:
-        if os.path.exists(temp_path):
-            os.unlink(temp_path)
-        raise Exception(f"Failed to download from storage: {str(e)}")
+        buffer.close()
+        raise Exception(f"Failed to read from storage: {str(e)}")
+
+def _chunk_study_material(buffer, file_type):
+    """
+    Split the whole study file for a map-reduce summary: PDFs by page range,
+    other files by packing streamed sections up to CHUNK_CHARS.
+    """
+    config = settings.SUMMARY_MAP_REDUCE
+    if file_type == 'PDF':
+        return DocumentProcessor.extract_text_from_pdf_chunked(buffer, chunk_size=config['CHUNK_PAGES'])
+    return MapReduceSummarizer.group_sections(
+        DocumentProcessor.iter_sections(buffer, file_type), config['CHUNK_CHARS']
+    )
 
 @shared_task(bind=True)
 def process_document_task(self, result_id, user_id, study_storage_path, past_questions_storage_path, 
@@ -58,8 +88,9 @@ def process_document_task(self, result_id, user_id, study_storage_path, past_que
     start_time = time.time()
     audio_path = None 
     result = None
-    study_temp_path = None
-    past_questions_temp_path = None 
+    study_buffer = None
+    past_questions_buffer = None 
+    study_chunks = None
 
     try:
         user = User.objects.get(id=user_id)
@@ -82,23 +113,42 @@ def process_document_task(self, result_id, user_id, study_storage_path, past_que
             
             result.update_stage('extracting_text', progress=15, message='Downloading study material from storage...')
             
-            # Download from R2 storage to temp file
-            study_temp_path = _download_from_storage(study_storage_path)
+            # Stream from R2 storage into memory (no temp file for typical uploads)
+            study_buffer, study_digest, file_size = _read_from_storage(study_storage_path)
             
             result.update_stage('extracting_text', progress=20, message=f'Extracting from {study_file_type} file...')
             
-            file_size = os.path.getsize(study_temp_path)
             print(f"Study material file size: {file_size} bytes")
             
             if file_size == 0:
-                raise Exception("Study material temp file is empty")
+                raise Exception("Study material file is empty")
+            
+            # Identical uploads (same bytes, same tier budget) reuse the cached extraction
+            study_tier = 'premium' if result.is_premium_generation else 'free'
+            study_cache_key = ExtractionCache.make_key(study_digest, study_file_type, variant=study_tier)
+            study_text = ExtractionCache.get(study_cache_key)
             
-            study_text = DocumentProcessor.extract_text(study_temp_path, study_file_type)
+            if study_text is not None:
+                print(f"Extraction cache hit for study material: {study_cache_key}")
+            else:
+                # Stream sections and stop once the tier's prompt budget is filled
+                ai_processor = PremiumAIProcessor if result.is_premium_generation else AIProcessor
+                study_text = ai_processor.collect_study_text(
+                    DocumentProcessor.iter_sections(study_buffer, study_file_type)
+                )
             print(f"Extracted study text: {len(study_text)} characters")
             
             if not study_text or len(study_text.strip()) < 50:
                 raise Exception("Insufficient text extracted from study material")
             
+            ExtractionCache.set(study_cache_key, study_text)
+            
+            # Premium documents longer than the prompt budget are summarised chunk by chunk
+            if result.is_premium_generation and PremiumAIProcessor.exceeds_prompt_budget(study_text):
+                result.update_stage('extracting_text', progress=30, message='Splitting long document into chunks...')
+                study_chunks = _chunk_study_material(study_buffer, study_file_type)
+                print(f"Study material split into {len(study_chunks)} chunks for map-reduce summary")
+            
             result.update_stage('extracting_text', progress=35, message=f'Extracted {len(study_text)} characters')
             
             LogEntry.objects.create(
@@ -122,24 +172,30 @@ def process_document_task(self, result_id, user_id, study_storage_path, past_que
             try:
                 result.update_stage('extracting_text', progress=40, message='Downloading past questions...')
                 
-                # Download from R2 storage
-                past_questions_temp_path = _download_from_storage(past_questions_storage_path)
+                # Stream from R2 storage
+                past_questions_buffer, past_questions_digest, file_size = _read_from_storage(past_questions_storage_path)
                 
                 result.update_stage('extracting_text', progress=45, message='Processing past questions...')
                 
-                past_questions_file_type = DocumentProcessor.get_file_type(past_questions_temp_path)
+                past_questions_file_type = DocumentProcessor.get_file_type(past_questions_storage_path)
                 print(f"Processing past questions, type: {past_questions_file_type}")
                 
-                file_size = os.path.getsize(past_questions_temp_path)
                 print(f"Past questions file size: {file_size} bytes")
                 
                 if file_size == 0:
-                    raise Exception("Past questions temp file is empty")
+                    raise Exception("Past questions file is empty")
+                
+                past_questions_cache_key = ExtractionCache.make_key(past_questions_digest, past_questions_file_type)
+                past_questions_text = ExtractionCache.get(past_questions_cache_key)
                 
-                past_questions_text = DocumentProcessor.extract_text(past_questions_temp_path, past_questions_file_type)
+                if past_questions_text is not None:
+                    print(f"Extraction cache hit for past questions: {past_questions_cache_key}")
+                else:
+                    past_questions_text = DocumentProcessor.extract_text(past_questions_buffer, past_questions_file_type)
                 print(f"Extracted past questions: {len(past_questions_text)} characters")
                 
                 if past_questions_text and len(past_questions_text.strip()) > 20:
+                    ExtractionCache.set(past_questions_cache_key, past_questions_text)
                     result.update_stage('extracting_text', progress=50, message='Past questions extracted successfully')
                     LogEntry.objects.create(
                         user=user, timestamp=timezone.now(), level='Normal', status_code='200',
@@ -162,19 +218,32 @@ def process_document_task(self, result_id, user_id, study_storage_path, past_que
         try:
             result.update_stage('generating_summary', progress=55, message='Analyzing content with AI...')
             
-            if result.is_premium_generation:
-                summary, qa_data = PremiumAIProcessor.generate_enhanced_content(study_text, past_questions_text)
-                
-                result.update_stage('generating_summary', progress=60, message='Generating flashcards...')
-                flashcards = PremiumAIProcessor.generate_flashcards(study_text)
-                result.flashcards = flashcards
-            else:
-                summary, qa_data = AIProcessor.generate_enhanced_content(study_text, past_questions_text)
+            # Summary text is published as it streams, for the status SSE stream
+            summary_stream = SummaryStream.publisher(result.id) if SummaryStream.enabled() else None
             
-            result.past_questions_context = past_questions_text
-            result.summary = summary
-            result.questions_answers = qa_data
-            result.save()
+            summary = None
+            try:
+                # Model calls are recorded against this document and user (logs.LLMCall)
+                with LLMMetrics.attribute(result.id, user.id):
+                    if result.is_premium_generation:
+                        # Summary, Q&A and flashcards are generated concurrently
+                        summary, qa_data, flashcards = PremiumAIProcessor.generate_study_pack(
+                            study_text, past_questions_text, chunks=study_chunks, on_summary_delta=summary_stream
+                        )
+                        result.flashcards = flashcards
+                    else:
+                        summary, qa_data = AIProcessor.generate_enhanced_content(
+                            study_text, past_questions_text, on_summary_delta=summary_stream
+                        )
+
+                result.past_questions_context = past_questions_text
+                result.summary = summary
+                result.questions_answers = qa_data
+                result.save()
+            finally:
+                # Also on failure, so the SSE stream stops waiting; on success the stored summary replaces the streamed text
+                if summary_stream:
+                    summary_stream.close(final_text=summary)
             
             result.update_stage('generating_summary', progress=65, message='AI analysis completed')
             
@@ -255,10 +324,11 @@ def process_document_task(self, result_id, user_id, study_storage_path, past_que
         try:
             result.update_stage('creating_quiz', progress=90, message='Generating practice quiz...')
             
-            if result.is_premium_generation:
-                AdvancedQuizGenerator.generate_enhanced_quiz(result)
-            else:
-                AIPoweredQuizGenerator.generate_quiz_from_processing_result(result)
+            with LLMMetrics.attribute(result.id, user.id):
+                if result.is_premium_generation:
+                    AdvancedQuizGenerator.generate_enhanced_quiz(result)
+                else:
+                    AIPoweredQuizGenerator.generate_quiz_from_processing_result(result)
             
             result.update_stage('creating_quiz', progress=95, message='Quiz generated successfully')
             
@@ -310,16 +380,14 @@ def process_document_task(self, result_id, user_id, study_storage_path, past_que
         raise self.retry(exc=e, countdown=60, max_retries=3)
         
     finally:
-        # Cleanup temp files (downloaded from R2)
+        # Release buffers read from R2 (spilled temp files are deleted on close)
         try:
-            if study_temp_path and os.path.exists(study_temp_path):
-                os.unlink(study_temp_path)
-                print(f"Cleaned up temp file: {study_temp_path}")
-            if past_questions_temp_path and os.path.exists(past_questions_temp_path):
-                os.unlink(past_questions_temp_path)
-                print(f"Cleaned up temp file: {past_questions_temp_path}")
+            if study_buffer:
+                study_buffer.close()
+            if past_questions_buffer:
+                past_questions_buffer.close()
         except Exception as cleanup_error:
-            print(f"Temp file cleanup error: {cleanup_error}")
+            print(f"Buffer cleanup error: {cleanup_error}")
         
         # Cleanup R2 uploaded files (original uploads)
         try:
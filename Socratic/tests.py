@@ -1,3 +1,1692 @@
-from django.test import TestCase
+import asyncio
+import io
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from itertools import islice
+from unittest import mock, skipUnless
 
-# Create your tests here.
+import fitz
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+from docx import Document
+from docx.enum.text import WD_BREAK
+from docx.oxml import parse_xml
+from docx.oxml.ns import nsdecls
+from PIL import Image, ImageDraw
+
+from .utils.ai_processor import PremiumAIProcessor
+from .utils.document_processor import DocumentProcessor
+from .utils.context_session import ContextSession, ContextSessions
+from .utils.docx_stream import DocxStream, UnsupportedDocx
+from .utils.extraction_benchmark import BenchmarkCorpus, ExtractionBenchmark
+from .utils.extraction_cache import ExtractionCache
+from .utils.extractive_summary import ExtractiveSummarizer
+from .utils.fake_backends import (
+    FakeCalls, FakeGenerativeModel, FakeResponse, FakeResponses, prompt_text, simulated_response, simulated_response_async,
+)
+from .utils.free_ai_processor import AIProcessor
+from .utils.gemini_client import GeminiClient
+from .utils.gemini_config import GeminiConfig
+from .utils.llm_cache import CachedModel, LLMResponseCache
+from .utils.llm_metrics import LLMMetrics
+from .utils.llm_cassettes import Cassette, CassetteMiss, CassetteModel
+from .utils.map_reduce import ChunkSummaryError, MapReduceSummarizer
+from .utils.ocr_backends import OCRSpaceBackend, TesseractBackend, get_ocr_backend
+from .utils.parallel_generation import ParallelGeneration
+from .utils.passage_index import PassageIndex
+from .utils.pipeline_benchmark import PipelineLoadTest
+from .utils.quiz_generator import _DEFAULT_EXPLANATION, AIPoweredQuizGenerator
+from .utils.rate_limiter import RateLimitedModel, RateLimiter
+from .utils.response_parser import FlashcardStreamParser, QAStreamParser
+from .utils.summary_stream import SummaryStream
+from .utils.token_budget import PromptPacker, TokenEstimator
+
+
+def _build_pdf(path, pages=90):
+    """Write a multi-page PDF whose paragraphs and hyphenated words cross page boundaries"""
+    doc = fitz.open()
+    for page_num in range(pages):
+        page = doc.new_page()
+        lines = [
+            f"{page_num % 9 + 1}.{page_num % 4 + 1} Cloud Service Models",
+            "Elasticity lets a provider scale resources up and down with demand,",
+            "so tenants only pay for the capacity they actually use each month.",
+            "Multitenancy shares the same infra-" if page_num % 3 else "Virtual machines isolate workloads.",
+        ]
+        for offset, line in enumerate(lines):
+            page.insert_text((72, 72 + offset * 14), line)
+    doc.save(path)
+    doc.close()
+
+
+# Original per-line regex filter, kept as the reference for the compiled classifier
+_LEGACY_HEADER_PATTERNS = [
+    r'^UNIT\s+\d+', r'^Unit\s+\d+', r'^CHAPTER\s+\d+', r'^Chapter\s+\d+', r'^CH\.?\s*\d+',
+    r'^\d+\.\d+(\.\d+)*\s+[A-Za-z]', r'^\d+\.\s+[A-Za-z]', r'^\d+\s+[A-Za-z]',
+    r'^(I|II|III|IV|V|VI|VII|VIII|IX|X|XI|XII)\.?\s+[A-Za-z]',
+    r'^(i|ii|iii|iv|v|vi|vii|viii|ix|x|xi|xii)\.?\s+[A-Za-z]',
+    r'^[A-Z]\.\s+[A-Za-z]', r'^[a-z]\.\s+[A-Za-z]',
+    r'^[A-Z][A-Za-z]+(\s+[A-Za-z]+){2,}.*$', r'^[A-Z][A-Z\s]{10,}$',
+]
+_LEGACY_NON_CONTENT_PATTERNS = [
+    r'^\.\.\.\s*\d+$', r'^\d+\s*$', r'^page\s+\d+', r'^pg\.?\s*\d+',
+    r'^copyright', r'^confidential', r'^\d+/\d+/\d+', r'^version\s+\d',
+    r'^=====', r'^\*\*\*\*\*', r'^------', r'^–––––',
+    r'^figure\s+\d+', r'^table\s+\d+', r'^fig\.\s*\d+',
+]
+_LEGACY_TOC_PATTERNS = [r'\.\.\.\s*\d+$', r'^\d+\.\d*\s', r'^\s*\w+\s+\.\.\.\s*\d+', r'^page\s+\d+', r'^\d+\s*$']
+_LEGACY_REFERENCE_PATTERNS = [r'^(Figure|Table|Fig\.|Table|Equation)\s+\d+', r'^\[\d+\]', r'^References?$', r'^Bibliography$']
+
+
+def _legacy_meaningful_sections(text):
+    def is_toc(line):
+        return any(re.search(p, line, re.IGNORECASE) for p in _LEGACY_TOC_PATTERNS)
+
+    def is_meaningful(line):
+        if len(line) < 5:
+            return False
+        if sum(1 for c in line if c.isalpha()) / len(line) < 0.3:
+            return False
+        return not any(re.search(p, line, re.IGNORECASE) for p in _LEGACY_REFERENCE_PATTERNS)
+
+    sections, current_section, current_header, in_toc = [], [], None, False
+
+    def flush():
+        if current_section and DocumentProcessor._is_meaningful_section(current_section):
+            body = ''.join(current_section)
+            sections.append(f"{current_header}\n{body}" if current_header else body)
+
+    for line in text.split('\n'):
+        line = line.strip()
+        if not line:
+            continue
+        if re.search(r'contents?|table of contents?|index', line, re.IGNORECASE):
+            in_toc = True
+            continue
+        if in_toc:
+            if is_toc(line) or len(line) <= 50:
+                continue
+            in_toc = False
+        if any(re.search(p, line, re.IGNORECASE) for p in _LEGACY_NON_CONTENT_PATTERNS):
+            continue
+        if any(re.search(p, line) for p in _LEGACY_HEADER_PATTERNS):
+            flush()
+            current_header, current_section = line, []
+        elif is_meaningful(line):
+            current_section.append(line + " ")
+    flush()
+    return '\n\n'.join(sections)
+
+
+_FILTER_CORPUS = [
+    "Table of Contents\n1.1 Introduction ... 3\n1.2 Scope ... 7\npage 4\n"
+    "UNIT 1 Cloud Foundations\n"
+    "Elasticity lets a provider scale resources up and down with demand, so tenants only pay for use.\n"
+    "Figure 3 shows the elastic scaling curve\n[12] Armbrust et al.\n"
+    "1.2 Service Models\nSoftware as a service delivers complete applications over the network to many users.\n"
+    "12\ncopyright 2024 Example University\n=====\n",
+    "CHAPTER 2\nII. Virtualisation\nA hypervisor multiplexes hardware between several isolated virtual machines today.\n"
+    "1234 5678 !!!! ????\nReferences\nIntroduction To Distributed Storage Systems\n"
+    "Replication keeps several copies of each block on different nodes to survive failures gracefully.\n",
+    "Index\nshort\nThis long line is not a table of contents entry and should end the TOC skipping mode.\n"
+    "a. first point about networks\nTHE NETWORK LAYER\nRouting protocols exchange reachability so packets find a path across the internet.\n",
+]
+
+
+class LineClassifierTestCase(SimpleTestCase):
+    """The compiled classifier must reproduce the original filter byte for byte"""
+
+    def test_matches_legacy_filter(self):
+        for text in _FILTER_CORPUS:
+            with self.subTest(text=text[:30]):
+                self.assertEqual(DocumentProcessor._extract_meaningful_sections(text), _legacy_meaningful_sections(text))
+
+    def test_classify_line(self):
+        self.assertEqual(DocumentProcessor._classify_line("Table of Contents"), 'toc_start')
+        self.assertEqual(DocumentProcessor._classify_line("1.1 Introduction ... 3", in_toc=True), 'toc')
+        self.assertEqual(DocumentProcessor._classify_line("copyright 2024"), 'noise')
+        self.assertEqual(DocumentProcessor._classify_line("UNIT 1 Cloud Foundations"), 'header')
+        self.assertEqual(DocumentProcessor._classify_line("replication keeps copies of data."), 'content')
+
+
+class ParallelPDFExtractionTestCase(SimpleTestCase):
+    """Sharded PDF extraction must produce exactly the serial output"""
+
+    def setUp(self):
+        fd, self.pdf_path = tempfile.mkstemp(suffix='.pdf')
+        os.close(fd)
+        _build_pdf(self.pdf_path)
+
+    def tearDown(self):
+        os.unlink(self.pdf_path)
+
+    def _serial_paragraphs(self):
+        doc = fitz.open(self.pdf_path)
+        full_text = ""
+        for page in doc:
+            page_text = page.get_text("text")
+            if page_text:
+                full_text += page_text + "\n"
+        doc.close()
+        return DocumentProcessor._reconstruct_paragraphs(full_text)
+
+    def test_parallel_matches_serial(self):
+        expected = self._serial_paragraphs()
+        for shard_size in (1, 7, 40):
+            with self.subTest(shard_size=shard_size):
+                self.assertEqual(
+                    DocumentProcessor._read_pdf_paragraphs(self.pdf_path, workers=3, shard_size=shard_size),
+                    expected,
+                )
+
+    def test_merge_rebuilds_shards_without_paragraph_break(self):
+        raw_parts = ["Multitenancy shares the same infra-\n", "structure.\n", "\n", "Next point.\n\n", "tail\n"]
+        shards = [
+            {
+                'raw': raw,
+                'text': DocumentProcessor._reconstruct_paragraphs(raw),
+                'clean_tail': DocumentProcessor._ends_with_paragraph_break(raw),
+            }
+            for raw in raw_parts
+        ]
+        self.assertEqual(
+            DocumentProcessor._merge_pdf_shards(shards),
+            DocumentProcessor._reconstruct_paragraphs(''.join(raw_parts)),
+        )
+
+    def test_pool_workers_read_in_memory_documents(self):
+        with open(self.pdf_path, 'rb') as f:
+            buffer = io.BytesIO(f.read())
+        with DocumentProcessor._pdf_source(buffer) as pdf_source, \
+                mock.patch('Socratic.utils.document_processor.logger') as logger:
+            shards = DocumentProcessor._extract_pdf_shards_parallel(pdf_source, 90, workers=2, shard_size=45)
+        self.assertFalse(logger.exception.called)  # not the serial fallback
+        self.assertEqual(DocumentProcessor._merge_pdf_shards(shards), self._serial_paragraphs())
+
+    def test_iter_sections_matches_extract_text(self):
+        sections = list(DocumentProcessor.iter_sections(self.pdf_path, 'PDF'))
+        self.assertEqual(
+            '\n\n'.join(section['text'] for section in sections),
+            DocumentProcessor.extract_text(self.pdf_path, 'PDF').replace(' \n\n', '\n\n'),
+        )
+        self.assertEqual(sections[0]['page_range'].split('-')[0], '1')
+
+    def test_buffer_source_matches_path(self):
+        with open(self.pdf_path, 'rb') as f:
+            buffer = io.BytesIO(f.read())
+        expected = DocumentProcessor.extract_text(self.pdf_path, 'PDF')
+        self.assertEqual(DocumentProcessor.extract_text(buffer, 'PDF'), expected)
+        self.assertEqual(DocumentProcessor._read_pdf_paragraphs(buffer, workers=3, shard_size=7),
+                         self._serial_paragraphs())
+        self.assertEqual(DocumentProcessor.extract_text_from_pdf_chunked(buffer, chunk_size=30),
+                         DocumentProcessor.extract_text_from_pdf_chunked(self.pdf_path, chunk_size=30))
+        buffer.close()
+
+    def test_iter_sections_stops_early(self):
+        sections = DocumentProcessor.iter_sections(self.pdf_path, 'PDF')
+        first = next(sections)
+        sections.close()
+        self.assertTrue(first['text'])
+
+    def test_collect_sections_stops_at_the_usable_limit(self):
+        usable = "Replicas copy every write from the leader so that reads survive a failed machine."
+        sections = iter([{'text': "Title"}, {'text': usable}, {'text': usable}, {'text': "never read"}])
+        self.assertEqual(DocumentProcessor.collect_sections(sections, len(usable) + 1), f"Title\n\n{usable}\n\n{usable}")
+        self.assertEqual(next(sections)['text'], "never read")
+
+
+@override_settings(
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache', 'LOCATION': 'socratic-tests'}},
+    FAKE_BACKENDS={'LATENCY': {}, 'JITTER': 0.0, 'ERROR_RATE': 0.0, 'SEED': 0},
+)
+class _StubTestCase(SimpleTestCase):
+    """Tests on a private in-memory default cache, emptied before each test, and fake backends without latency"""
+
+    def setUp(self):
+        from django.core.cache import caches
+        caches['default'].clear()
+
+
+class _StubModel(FakeGenerativeModel):
+    """
+    FakeGenerativeModel that counts calls and records their prompts, request options and
+    overlap. answer(prompt) replaces FakeResponses and may raise to inject a failure; delay
+    (seconds, or a function of the prompt) is how long each call takes; whole responses
+    report tokens as their usage_metadata.total_token_count when it is given.
+    """
+
+    def __init__(self, model_name='fake', answer=None, delay=0.0, tokens=None):
+        super().__init__(model_name)
+        self.answer = answer or FakeResponses.respond
+        self.delay = delay
+        self.tokens = tokens
+        self.calls = 0
+        self.prompts = []
+        self.request_options = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.lock = threading.Lock()
+
+    @classmethod
+    def numbered(cls, model_name='fake'):
+        """A stub whose nth call answers "answer n", so tests can tell which calls reached it"""
+        model = cls(model_name)
+        model.answer = lambda prompt: f"answer {model.calls}"
+        return model
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        prompt = self._started(contents, kwargs)
+        try:
+            time.sleep(self._delay(prompt))
+            return self._metered(simulated_response(self.answer(prompt), stream))
+        finally:
+            self._finished()
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        prompt = self._started(contents, kwargs)
+        try:
+            await asyncio.sleep(self._delay(prompt))
+            return self._metered(await simulated_response_async(self.answer(prompt), stream))
+        finally:
+            self._finished()
+
+    def _metered(self, response):
+        if self.tokens is not None and isinstance(response, FakeResponse):
+            response.usage_metadata = mock.Mock(total_token_count=self.tokens)
+        return response
+
+    def _delay(self, prompt):
+        return self.delay(prompt) if callable(self.delay) else self.delay
+
+    def _started(self, contents, kwargs):
+        prompt = prompt_text(contents)
+        with self.lock:
+            self.calls += 1
+            self.prompts.append(prompt)
+            self.request_options.append(kwargs.get('request_options'))
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        return prompt
+
+    def _finished(self):
+        with self.lock:
+            self.in_flight -= 1
+
+
+@override_settings(EXTRACTION_CACHE={'ENABLED': True, 'ALIAS': 'default', 'MAX_ENTRY_BYTES': 1000, 'TIMEOUT': None})
+class ExtractionCacheTestCase(_StubTestCase):
+    """Content-addressed extraction cache: hits, misses and oversized texts"""
+
+    def test_hit_and_miss_counters(self):
+        key = ExtractionCache.make_key('abc', 'pdf', variant='free')
+        self.assertIsNone(ExtractionCache.get(key))
+        ExtractionCache.set(key, 'cleaned text')
+        self.assertEqual(ExtractionCache.get(key), 'cleaned text')
+        stats = ExtractionCache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+    def test_one_get_or_set_per_call_and_oversized_texts_skipped(self):
+        from django.core.cache import caches
+        cache = caches['default']
+        key = ExtractionCache.make_key('a', 'PDF')
+        with mock.patch.object(cache, 'set', wraps=cache.set) as cache_set, \
+                mock.patch.object(cache, 'get', wraps=cache.get) as cache_get:
+            ExtractionCache.set(key, 'x' * 400)
+            ExtractionCache.set(ExtractionCache.make_key('b', 'PDF'), 'y' * 1001)
+            self.assertEqual(ExtractionCache.get(key), 'x' * 400)
+        self.assertEqual([c.args[0] for c in cache_set.call_args_list], [key])
+        self.assertEqual([c.args[0] for c in cache_get.call_args_list], [key])
+        self.assertIsNone(ExtractionCache.get(ExtractionCache.make_key('b', 'PDF')))
+
+
+_OCR_TEST_CONFIG = {
+    'BACKEND': 'tesseract', 'LANGUAGE': 'eng', 'TIMEOUT': 5,
+    'TARGET_DPI': 300, 'TILE_HEIGHT': 400, 'WORKERS': 1,
+}
+
+
+def _build_scan(lines=40, skew=0.0):
+    """White page with dark bars standing in for lines of text"""
+    image = Image.new('L', (900, lines * 30 + 60), 255)
+    draw = ImageDraw.Draw(image)
+    for line in range(lines):
+        top = 40 + line * 30
+        draw.rectangle((60, top, 840, top + 14), fill=0)
+    return image.rotate(skew, resample=Image.BICUBIC, expand=True, fillcolor=255) if skew else image
+
+
+@override_settings(OCR_CONFIG=_OCR_TEST_CONFIG)
+class OCRBackendTestCase(SimpleTestCase):
+    """Backend selection, Tesseract preprocessing/tiling and the OCR.space timeout"""
+
+    def test_backend_selection(self):
+        self.assertIsInstance(get_ocr_backend(), TesseractBackend)
+        self.assertIsInstance(get_ocr_backend('OCRSPACE'), OCRSpaceBackend)
+        with self.assertRaises(Exception):
+            get_ocr_backend('abbyy')
+
+    def test_deskew_recovers_rotation(self):
+        backend = get_ocr_backend()
+        self.assertAlmostEqual(backend.estimate_skew(_build_scan(skew=3.0)), -3.0, delta=0.5)
+        self.assertEqual(backend.estimate_skew(_build_scan()), 0.0)
+
+    def test_preprocess_downscales_to_target_dpi(self):
+        scan = _build_scan().convert('RGB')
+        scan.info['dpi'] = (600, 600)
+        prepared = get_ocr_backend().preprocess(scan)
+        self.assertEqual(prepared.mode, 'L')
+        self.assertEqual(prepared.width, scan.width // 2)
+
+    def test_tiles_cut_between_lines(self):
+        scan = _build_scan()
+        bounds = get_ocr_backend().tile_bounds(scan)
+        self.assertGreater(len(bounds), 1)
+        self.assertEqual((bounds[0][0], bounds[-1][1]), (0, scan.height))
+        for _, cut in bounds[:-1]:
+            self.assertEqual(scan.getpixel((450, cut)), 255)
+
+    def test_tiles_recognised_in_order(self):
+        buffer = io.BytesIO()
+        _build_scan().save(buffer, format='PNG')
+        with mock.patch('pytesseract.image_to_string', side_effect=lambda tile, lang: f"rows {tile.height}\n"):
+            text = get_ocr_backend().recognize(buffer, 'PNG')
+        self.assertEqual(len(text.split('\n')), len(get_ocr_backend().tile_bounds(_build_scan())))
+
+    def test_ocrspace_uses_timeout_and_keeps_buffer_open(self):
+        buffer = io.BytesIO(b'png bytes')
+        response = mock.Mock(json=lambda: {'ParsedResults': [{'ParsedText': 'hello'}]})
+        with mock.patch.dict(os.environ, {'OCR_API_KEY': 'key'}), \
+                mock.patch('requests.post', return_value=response) as post:
+            self.assertEqual(get_ocr_backend('ocrspace').recognize(buffer, 'PNG'), 'hello')
+        self.assertEqual(post.call_args.kwargs['timeout'], 5)
+        self.assertFalse(buffer.closed)
+
+
+class _FakeOCRBackend:
+    """Reads the page number back from the rendered image size so ordering can be checked"""
+
+    name = 'fake'
+
+    def __init__(self):
+        self.batches = []
+
+    def recognize_batch(self, sources, file_type='PNG'):
+        self.batches.append(len(sources))
+        texts = []
+        for source in sources:
+            with Image.open(source) as image:
+                page_num = image.getpixel((image.width // 2, image.height // 2))
+            texts.append(f"Scanned page {page_num} explains how replication protects data against node failures.\n")
+        return texts
+
+
+def _build_scanned_pdf(path, pages=10, scanned=(2, 3, 4, 7, 8, 9, 10)):
+    """Text pages interleaved with image-only pages; each image's gray level encodes its page number"""
+    doc = fitz.open()
+    for page_num in range(1, pages + 1):
+        page = doc.new_page()
+        if page_num in scanned:
+            image = Image.new('L', (200, 260), page_num)
+            buffer = io.BytesIO()
+            image.save(buffer, format='PNG')
+            page.insert_image(page.rect, stream=buffer.getvalue())
+            page.insert_text((72, 800), str(page_num))  # a page number is not a text layer
+        else:
+            page.insert_text((72, 72), f"Typed page {page_num} introduces the consistency models used by stores.")
+    doc.save(path)
+    doc.close()
+
+
+class ScannedPDFTestCase(SimpleTestCase):
+    """Image-only pages are detected, OCR'd in batches and merged back in page order"""
+
+    def setUp(self):
+        fd, self.pdf_path = tempfile.mkstemp(suffix='.pdf')
+        os.close(fd)
+        _build_scanned_pdf(self.pdf_path)
+        self.backend = _FakeOCRBackend()
+        patcher = mock.patch('Socratic.utils.document_processor.get_ocr_backend', return_value=self.backend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(os.unlink, self.pdf_path)
+
+    def _page_order(self, text):
+        return [int(n) for n in re.findall(r'(?:Typed|Scanned) page (\d+)', text)]
+
+    def test_detects_image_only_pages(self):
+        doc = fitz.open(self.pdf_path)
+        shard = DocumentProcessor._extract_pdf_shard(doc, 0, len(doc))
+        doc.close()
+        self.assertEqual(shard['scanned'], [2, 3, 4, 7, 8, 9, 10])
+
+    def test_ocr_text_merged_in_page_order(self):
+        with mock.patch.object(DocumentProcessor, 'PDF_OCR_BATCH_SIZE', 3):
+            text = DocumentProcessor._read_pdf_paragraphs(self.pdf_path, workers=1)
+        self.assertEqual(self._page_order(text), list(range(1, 11)))
+        self.assertEqual(self.backend.batches, [3, 3, 1])
+
+    def test_streaming_matches_batch(self):
+        with mock.patch.object(DocumentProcessor, 'PDF_OCR_BATCH_SIZE', 2):
+            pages = list(DocumentProcessor._iter_pdf_pages(self.pdf_path, workers=1))
+            text = DocumentProcessor._read_pdf_paragraphs(self.pdf_path, workers=1)
+        self.assertEqual([page_num for page_num, _ in pages], list(range(1, 11)))
+        self.assertEqual(DocumentProcessor._reconstruct_paragraphs(''.join(t for _, t in pages)), text)
+
+    def test_parallel_matches_serial(self):
+        serial = DocumentProcessor._read_pdf_paragraphs(self.pdf_path, workers=1)
+        with mock.patch.object(DocumentProcessor, 'PDF_PARALLEL_MIN_PAGES', 1):
+            self.assertEqual(DocumentProcessor._read_pdf_paragraphs(self.pdf_path, workers=3, shard_size=3), serial)
+
+    def test_ocr_failure_keeps_text_layer(self):
+        self.backend.recognize_batch = mock.Mock(side_effect=Exception("quota exceeded"))
+        text = DocumentProcessor._read_pdf_paragraphs(self.pdf_path, workers=1)
+        self.assertEqual(self._page_order(text), [1, 5, 6])
+
+
+def _build_docx():
+    """Word handout with the constructs the streaming reader has to mirror"""
+    doc = Document()
+    doc.add_paragraph("Replication keeps several copies of each block on different nodes.")
+    doc.add_paragraph("")
+    paragraph = doc.add_paragraph("Quorum\treads")
+    paragraph.add_run(" and writes").add_break()
+    paragraph.add_run("overlap").add_break(WD_BREAK.PAGE)
+    paragraph._p.append(parse_xml(
+        f'<w:hyperlink {nsdecls("w", "r")} r:id="rId9"><w:r><w:t xml:space="preserve"> see notes </w:t></w:r></w:hyperlink>'
+    ))
+    paragraph._p.append(parse_xml(f'<w:ins {nsdecls("w")} w:id="1" w:author="a"><w:r><w:t>tracked</w:t></w:r></w:ins>'))
+
+    table = doc.add_table(rows=4, cols=3)
+    for row in range(4):
+        for col in range(3):
+            table.cell(row, col).text = f"r{row}c{col}" if (row + col) % 4 else ""
+    table.cell(0, 0).merge(table.cell(0, 1))
+    table.cell(1, 2).merge(table.cell(3, 2))
+    table.cell(2, 0).add_table(1, 1).cell(0, 0).text = "nested"
+    doc.add_paragraph("Consistency models trade latency for stronger guarantees.")
+
+    buffer = io.BytesIO()
+    doc.save(buffer)
+    return buffer
+
+
+class DocxStreamTestCase(SimpleTestCase):
+    """The iterparse reader must match the python-docx reader line for line"""
+
+    def test_matches_python_docx(self):
+        buffer = _build_docx()
+        expected = list(DocumentProcessor._iter_docx_chunks_python_docx(buffer))
+        buffer.seek(0)
+        self.assertEqual([(None, line + "\n") for line in DocxStream.iter_lines(buffer)], expected)
+        self.assertEqual(list(DocumentProcessor._iter_docx_chunks(buffer)), expected)
+        self.assertIn((None, "r0c1 | r0c1 | r0c2\n"), expected)
+
+    def test_falls_back_mid_stream(self):
+        buffer = _build_docx()
+        expected = list(DocumentProcessor._iter_docx_chunks_python_docx(buffer))
+        iter_lines = DocxStream.iter_lines
+
+        def give_up(source):
+            yield from islice(iter_lines(source), 2)
+            raise UnsupportedDocx("exotic")
+
+        with mock.patch.object(DocxStream, 'iter_lines', side_effect=give_up):
+            self.assertEqual(list(DocumentProcessor._iter_docx_chunks(buffer)), expected)
+
+    def test_rejects_non_document_main_part(self):
+        buffer = _build_docx()
+        with self.assertRaises(UnsupportedDocx):
+            with mock.patch('Socratic.utils.docx_stream.DOCUMENT_CONTENT_TYPE', 'application/x-other'):
+                list(DocxStream.iter_lines(buffer))
+
+
+class ExtractionBenchmarkTestCase(SimpleTestCase):
+    """Synthetic corpus generation, per-stage report and baseline comparison"""
+
+    def test_report_covers_every_stage(self):
+        with tempfile.TemporaryDirectory() as workdir:
+            documents = BenchmarkCorpus.build(workdir, only=['*-text-10'])
+            self.assertEqual([name for name, _, _ in documents], ['pdf-text-10', 'docx-text-10'])
+            report = ExtractionBenchmark.run(documents[:1], repeat=1)
+
+        result = report['results']['pdf-text-10/extract_text']
+        self.assertGreater(result['raw_chars'], 10000)
+        self.assertGreater(result['chars_per_second'], 0)
+        self.assertEqual(len(report['results']), len(ExtractionBenchmark.STAGES))
+
+    def test_compare_flags_regressions(self):
+        baseline = {'results': {'a': {'wall_seconds': 1.0}, 'b': {'wall_seconds': 1.0}, 'tiny': {'wall_seconds': 0.001}}}
+        current = {'results': {'a': {'wall_seconds': 1.1}, 'b': {'wall_seconds': 1.3}, 'tiny': {'wall_seconds': 0.003},
+                               'new': {'wall_seconds': 2.0}}}
+        rows = {row['key']: row for row in ExtractionBenchmark.compare(current, baseline, threshold=0.2)}
+        self.assertEqual(set(rows), {'a', 'b'})
+        self.assertFalse(rows['a']['regressed'])
+        self.assertTrue(rows['b']['regressed'])
+
+
+@override_settings(
+    SUMMARY_MAP_REDUCE={'CHUNK_PAGES': 40, 'CHUNK_CHARS': 1000, 'CONCURRENCY': 3, 'CACHE_ALIAS': 'default', 'CACHE_TIMEOUT': None},
+)
+class MapReduceSummaryTestCase(_StubTestCase):
+    """Chunks are summarised with bounded concurrency, cached, and merged in order"""
+
+    def setUp(self):
+        super().setUp()
+        self.chunks = [{'text': f"notes for chunk {i}", 'page_range': f"{i * 40 + 1}-{i * 40 + 40}"} for i in range(8)]
+        self.fail_parts = set()
+
+    def answer(self, prompt):
+        """Echoes which part a prompt covers; the parts in fail_parts fail once"""
+        part = re.search(r'PART (\d+) of', prompt)
+        if part and int(part.group(1)) in self.fail_parts:
+            self.fail_parts.discard(int(part.group(1)))
+            raise Exception("503 model overloaded")
+        if part:
+            return f"## Part {part.group(1)}\nsummary"
+        merged = re.findall(r'## Part (\d+)', prompt)
+        if 'Quick Reference' in prompt:
+            return "MERGED " + " ".join(merged)
+        return "\n".join(f"## Part {n}" for n in merged)
+
+    def test_map_then_reduce_in_order(self):
+        model = _StubModel(answer=self.answer, delay=0.01)
+        summary = MapReduceSummarizer(model, 10_000, 1_000).summarize(self.chunks, "Q1. Explain quorum reads")
+        self.assertEqual(summary, "MERGED 1 2 3 4 5 6 7 8")
+        self.assertLessEqual(model.max_in_flight, 3)
+        self.assertIn("Explain quorum reads", model.prompts[-1])
+
+    def test_retry_only_redoes_failed_chunks(self):
+        self.fail_parts = {3, 6}
+        model = _StubModel(answer=self.answer, delay=0.01)
+        summarizer = MapReduceSummarizer(model, 10_000, 1_000)
+        with self.assertRaises(ChunkSummaryError):
+            summarizer.summarize(self.chunks)
+        self.assertEqual(len(model.prompts), 8)
+
+        model.prompts.clear()
+        self.assertEqual(summarizer.summarize(self.chunks), "MERGED 1 2 3 4 5 6 7 8")
+        retried = [int(m.group(1)) for m in (re.search(r'PART (\d+) of', p) for p in model.prompts) if m]
+        self.assertEqual(sorted(retried), [3, 6])
+
+    def test_hierarchical_reduce_when_partials_overflow(self):
+        model = _StubModel(answer=self.answer, delay=0.01)
+        summary = MapReduceSummarizer(model, 60, 1_000).summarize(self.chunks)
+        merges = [p for p in model.prompts if 'PARTIAL STUDY GUIDES' in p]
+        self.assertGreater(len(merges), 1)
+        self.assertEqual(summary, "MERGED 1 2 3 4 5 6 7 8")
+
+    def test_group_sections_keeps_page_ranges(self):
+        sections = [{'text': 'x' * 400, 'page_range': f"{n}-{n}"} for n in range(1, 6)]
+        chunks = MapReduceSummarizer.group_sections(sections, 1000)
+        self.assertEqual([c['page_range'] for c in chunks], ['1-2', '3-4', '5-5'])
+
+
+class ParallelGenerationTestCase(_StubTestCase):
+    """Summary, Q&A and flashcards run concurrently and fail independently"""
+
+    STUDY_TEXT = "\n\n".join(
+        f"Paragraph {i} explains how replicated databases keep copies of every record on several machines."
+        for i in range(20)
+    )
+
+    @staticmethod
+    def model(delay=0.2, fail=(), hang=()):
+        """Answers summary / Q&A / flashcard prompts after delay; the kinds in fail raise, those in hang take 1s"""
+        def kind(prompt):
+            if 'exam setter' in prompt:
+                return 'qa'
+            return 'flashcards' if 'flashcards' in prompt else 'summary'
+
+        def answer(prompt):
+            if kind(prompt) in fail:
+                raise Exception(f"{kind(prompt)} call failed")
+            return {
+                'qa': "Q1: What is a quorum read?\nA1: A read answered by a majority of replicas.",
+                'flashcards': "TERM: Quorum\nDEFINITION: A majority of replicas.\n",
+                'summary': "## Replication\n" + "Replicas copy data so reads survive failures. " * 10,
+            }[kind(prompt)]
+
+        return _StubModel(answer=answer, delay=lambda prompt: 1.0 if kind(prompt) in hang else delay)
+
+    def _run(self, model, timeout=5):
+        with mock.patch.object(PremiumAIProcessor, '_model', model), \
+                mock.patch.object(PremiumAIProcessor, '_models_loaded', True), \
+                mock.patch.object(PremiumAIProcessor, 'CALL_TIMEOUT', timeout):
+            started = time.monotonic()
+            pack = PremiumAIProcessor.generate_study_pack(self.STUDY_TEXT)
+            return pack, time.monotonic() - started
+
+    def test_latency_is_the_slowest_call(self):
+        model = self.model(delay=0.3)
+        (summary, qa_data, flashcards), elapsed = self._run(model)
+        self.assertTrue(summary.startswith("## Replication"))
+        self.assertEqual(qa_data['total_questions'], 1)
+        self.assertEqual(flashcards, [{'term': 'Quorum', 'definition': 'A majority of replicas.'}])
+        self.assertLess(elapsed, 0.8)
+        self.assertEqual(model.request_options, [{'timeout': 5}] * 3)
+
+    def test_failed_flashcards_keep_summary(self):
+        (summary, qa_data, flashcards), _ = self._run(self.model(delay=0.05, fail={'flashcards'}))
+        self.assertTrue(summary.startswith("## Replication"))
+        self.assertEqual(qa_data['total_questions'], 1)
+        self.assertEqual(flashcards, [])
+
+    def test_timed_out_call_falls_back(self):
+        (summary, qa_data, flashcards), elapsed = self._run(self.model(delay=0.05, hang={'qa'}), timeout=0.3)
+        self.assertTrue(summary.startswith("## Replication"))
+        self.assertIn("timed out", qa_data['error'])
+        self.assertEqual(len(flashcards), 1)
+        self.assertLess(elapsed, 0.9)
+
+    def test_map_reduce_failure_propagates(self):
+        def fail():
+            raise ChunkSummaryError("2 of 8 map calls failed")
+
+        with self.assertRaises(ChunkSummaryError):
+            ParallelGeneration.run(
+                {'summary': (fail, lambda error: "", None), 'qa': (lambda: {}, lambda error: {}, 1)},
+                propagate=(ChunkSummaryError,),
+            )
+
+
+@override_settings(
+    LLM_CACHE={'ENABLED': True, 'ALIAS': 'default', 'MAX_ENTRY_BYTES': 100, 'TIMEOUT': None,
+               'MEMORY_MAX_ENTRIES': 2, 'MEMORY_MAX_BYTES': 1024 * 1024},
+)
+class LLMResponseCacheTestCase(_StubTestCase):
+    """Repeated prompts are answered from the in-process tier, then the shared tier"""
+
+    def setUp(self):
+        super().setUp()
+        LLMResponseCache.clear()
+        self.backend = _StubModel.numbered()
+        self.model = CachedModel(self.backend)
+
+    def test_repeated_prompt_hits_memory(self):
+        first = self.model.generate_content("Summarise:\r\nchapter 1  \n", request_options={'timeout': 5})
+        second = self.model.generate_content("Summarise:\nchapter 1")
+        self.assertEqual((first.text, second.text), ("answer 1", "answer 1"))
+        self.assertEqual(self.backend.calls, 1)
+        stats = LLMResponseCache.stats()
+        self.assertEqual((stats['memory_hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_shared_tier_survives_a_new_process(self):
+        self.model.generate_content("prompt")
+        LLMResponseCache._memory.clear()
+        self.assertEqual(self.model.generate_content("prompt").text, "answer 1")
+        self.assertEqual(LLMResponseCache.stats()['shared_hits'], 1)
+        self.assertEqual(LLMResponseCache.stats()['memory_entries'], 1)
+
+    def test_shared_tier_is_one_get_or_set_per_call(self):
+        cache = mock.Mock(get=mock.Mock(return_value=None))
+        with mock.patch('Socratic.utils.llm_cache.caches', {'default': cache}):
+            self.model.generate_content("prompt")
+            LLMResponseCache._memory.clear()
+            cache.get.return_value = "answer 1"
+            self.assertEqual(self.model.generate_content("prompt").text, "answer 1")
+            LLMResponseCache.set("long", "x" * 101)
+
+        self.assertEqual(cache.get.call_count, 2)
+        # One SET for the answer; no index rewrite, and the oversized answer stays in memory only
+        self.assertEqual([c.args[1] for c in cache.set.call_args_list], ["answer 1"])
+
+    def test_generation_config_is_part_of_the_key(self):
+        self.model.generate_content("prompt")
+        self.model.generate_content("prompt", generation_config={'temperature': 0.9})
+        self.assertEqual(self.backend.calls, 2)
+
+    def test_bypass_and_memory_eviction(self):
+        with LLMResponseCache.bypass():
+            self.model.generate_content("prompt")
+            self.model.generate_content("prompt")
+        self.assertEqual(self.backend.calls, 2)
+
+        for prompt in ("a", "b", "c"):
+            self.model.generate_content(prompt)
+        self.assertEqual(LLMResponseCache.stats()['memory_entries'], 2)
+
+    def test_bypass_stays_with_its_own_calls(self):
+        self.model.generate_content("prompt")
+        bypassing, released = threading.Event(), threading.Event()
+
+        def other_task():
+            with LLMResponseCache.bypass():
+                bypassing.set()
+                released.wait(5)
+
+        thread = threading.Thread(target=other_task)
+        thread.start()
+        self.addCleanup(released.set)
+        bypassing.wait(5)
+        self.assertEqual(GeminiClient.generate(self.model, "prompt").text, "answer 1")  # still cached here
+        with LLMResponseCache.bypass():
+            self.assertEqual(GeminiClient.generate(self.model, "prompt").text, "answer 2")  # reaches the client loop
+        released.set()
+        thread.join(5)
+        self.assertEqual(self.backend.calls, 2)
+
+
+def _quiz_items(prompt):
+    """Answers batched quiz prompts with JSON; drops the item for 'Q3' and repeats the answer as distractors for 'Q2'"""
+    items = []
+    for number, name in re.findall(r'^(\d+)\. (Q\d+) .*$', prompt, re.MULTILINE):
+        if name == 'Q3':
+            continue
+        answer = f"The answer to {name} explained in one sentence."
+        distractors = [answer] * 3 if name == 'Q2' else [f"Wrong option {n} for {name} here." for n in range(3)]
+        items.append({'id': int(number), 'answer': answer, 'distractors': distractors, 'explanation': f"Because {name}."})
+    return "```json\n" + json.dumps(items) + "\n```"
+
+
+class BatchedQuizTestCase(_StubTestCase):
+    """Batched quiz generation: one call per batch, per-item validation and fallbacks"""
+
+    def setUp(self):
+        super().setUp()
+        self.model = _StubModel(answer=_quiz_items)
+        processor = mock.Mock(_model=self.model, CALL_TIMEOUT=5)
+        patches = [
+            mock.patch.object(AIPoweredQuizGenerator, '_get_ai_processor', return_value=processor),
+            mock.patch.object(AIPoweredQuizGenerator, 'BATCH_MODE', True),
+            mock.patch.object(AIPoweredQuizGenerator, 'BATCH_SIZE', 10),
+        ]
+        for patcher in patches:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.questions = [f"Q{n} what is concept number {n}?" for n in range(1, 16)]
+
+    def test_one_call_per_batch(self):
+        items = AIPoweredQuizGenerator._generate_quiz_items(self.questions, "lecture " * 5000, False)
+        self.assertEqual(len(self.model.prompts), 2)
+        self.assertEqual(len(items), 15)
+        # The context is sent once per batch, packed to the quiz token budget
+        self.assertTrue(all(prompt.count("lecture") == 1875 for prompt in self.model.prompts))
+
+        first = items[0]
+        self.assertEqual(first['answer'], "The answer to Q1 explained in one sentence.")
+        self.assertIn(first['answer'], first['options'])
+        self.assertEqual(len(set(first['options'])), 4)
+        self.assertEqual(first['explanation'], "Because Q1.")
+
+    def test_items_are_validated_and_fall_back_individually(self):
+        items = AIPoweredQuizGenerator._generate_quiz_items(self.questions[:3], "context", False)
+
+        # Distractors equal to the answer are replaced by _validate_distractors
+        self.assertEqual(len(set(items[1]['options'])), 4)
+        self.assertIn(items[1]['answer'], items[1]['options'])
+
+        # Missing item: the per-question fallback answer and distractors
+        missing = items[2]
+        self.assertEqual(missing['answer'], AIPoweredQuizGenerator._generate_fallback_answer(self.questions[2]))
+        self.assertEqual(len(missing['options']), 4)
+
+    def test_failed_batch_falls_back(self):
+        self.model.answer = mock.Mock(side_effect=Exception("429 quota"))
+        items = AIPoweredQuizGenerator._generate_quiz_items(self.questions[:2], "context", True)
+        self.assertEqual([len(item['options']) for item in items], [4, 4])
+
+    def test_failed_batch_is_retried_in_halves(self):
+        calls = []
+
+        def fail_first(prompt):
+            calls.append(len(re.findall(r'^\d+\. Q', prompt, re.MULTILINE)))
+            return "not json" if len(calls) == 1 else _quiz_items(prompt)
+
+        self.model.answer = fail_first
+        items = AIPoweredQuizGenerator._generate_quiz_items(self.questions[:5], "context", True)
+        self.assertEqual((calls[0], sorted(calls[1:])), (5, [2, 3]))  # the halves run in parallel
+        self.assertEqual([item['explanation'] for item in items[:2]], ["Because Q1.", "Because Q2."])
+        self.assertEqual(items[2]['explanation'], _DEFAULT_EXPLANATION)  # Q3 is still missing: per-item fallback
+
+
+@override_settings(GEMINI_CLIENT={'MAX_IN_FLIGHT': 8, 'MODEL_MAX_IN_FLIGHT': {'models/slow': 2}})
+class GeminiClientTestCase(_StubTestCase):
+    """The shared client overlaps requests up to the per-model limit"""
+
+    @staticmethod
+    def slow_model():
+        """Upper-cases prompts after 0.05s; prompts containing 'fail' raise"""
+        def answer(prompt):
+            if 'fail' in prompt:
+                raise Exception("500 internal")
+            return prompt.upper()
+
+        return _StubModel('slow', answer=answer, delay=0.05)
+
+    def test_generate_many_respects_limit_and_order(self):
+        model = self.slow_model()
+        started = time.monotonic()
+        results = GeminiClient.generate_many(model, ['a', 'b', 'fail', 'd', 'e', 'f'])
+        elapsed = time.monotonic() - started
+
+        self.assertEqual([r.text for r in results if not isinstance(r, Exception)], ['A', 'B', 'D', 'E', 'F'])
+        self.assertIsInstance(results[2], Exception)
+        self.assertEqual(model.max_in_flight, 2)
+        self.assertLess(elapsed, 0.3)  # 3 waves of 0.05s, not 6 sequential calls
+
+    def test_sync_and_async_entry_points(self):
+        model = self.slow_model()
+        self.assertEqual(GeminiClient.generate(model, 'sync').text, 'SYNC')
+
+        async def caller():
+            return await asyncio.gather(*(GeminiClient.generate_async(model, p) for p in ('x', 'y', 'z')))
+
+        self.assertEqual([r.text for r in asyncio.run(caller())], ['X', 'Y', 'Z'])
+        self.assertEqual(model.max_in_flight, 2)
+        self.assertEqual(GeminiClient.in_flight()['models/slow'], 0)
+
+    def test_in_flight_counts_requests_holding_a_slot(self):
+        seen = []
+
+        async def peek():
+            seen.append(GeminiClient.in_flight()['models/peek'])
+
+        async def hold():
+            async with GeminiClient.slot('models/peek'):
+                async with GeminiClient.slot('models/peek'):  # reentrant: still one request
+                    await peek()
+
+        GeminiClient._submit(hold()).result()
+        self.assertEqual(seen, [1])
+        self.assertEqual(GeminiClient.in_flight()['models/peek'], 0)
+
+    def test_sync_only_models_run_in_executor(self):
+        stub = _StubModel.numbered()
+        model = mock.Mock(spec=['model_name', 'generate_content'], model_name=stub.model_name,
+                          generate_content=stub.generate_content)
+        self.assertEqual(GeminiClient.generate(model, 'prompt', request_options={'timeout': 5}).text, 'answer 1')
+
+    @override_settings(LLM_CACHE={'ENABLED': True, 'TIMEOUT': None})
+    def test_slow_cache_does_not_serialise_requests(self):
+        def slow_get(key):
+            time.sleep(0.1)
+            return None
+
+        model = CachedModel(_StubModel.numbered())
+        with mock.patch.object(LLMResponseCache, 'get', side_effect=slow_get), \
+                mock.patch.object(LLMResponseCache, 'set', side_effect=lambda key, text: time.sleep(0.1)):
+            started = time.monotonic()
+            results = GeminiClient.generate_many(model, [f"prompt {n}" for n in range(6)])
+            elapsed = time.monotonic() - started
+
+        self.assertEqual(len([r for r in results if not isinstance(r, Exception)]), 6)
+        self.assertLess(elapsed, 0.8)  # 6 lookups and 6 stores of 0.1s each would take 1.2s on the loop
+
+    def test_slow_cache_does_not_serialise_streams(self):
+        model = mock.Mock(model_name='models/cached', cached_text=lambda contents: time.sleep(0.1) or contents.upper())
+        threads = [
+            threading.Thread(target=GeminiClient.stream, args=(model, f"prompt {n}", lambda delta: None))
+            for n in range(4)
+        ]
+        started = time.monotonic()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertLess(time.monotonic() - started, 0.3)  # 0.4s if each lookup held the loop
+
+
+class TokenBudgetTestCase(SimpleTestCase):
+    """Offline token estimates and packing whole sections into a budget"""
+
+    SECTIONS = [
+        "## Replication\nLeader-follower replication copies every write to follower replicas.",
+        "## Consensus\nRaft elects a leader and commits entries once a quorum acknowledges them.",
+        "## Caching\nWrite-through caches update the cache and the database in the same operation.",
+        "## Sharding\nHash partitioning spreads keys evenly but makes range scans expensive.",
+    ]
+
+    def test_estimate(self):
+        self.assertEqual(TokenEstimator.estimate(""), 0)
+        self.assertEqual(TokenEstimator.estimate("2024"), 4)
+        english = "Replication keeps copies of the same data on several machines. " * 20
+        self.assertTrue(len(english) / 6 < TokenEstimator.estimate(english) < len(english) / 3)
+        with override_settings(PROMPT_TOKEN_BUDGETS={'CALIBRATION': 2.0}):
+            self.assertEqual(TokenEstimator.estimate("2024"), 8)
+            self.assertEqual(TokenEstimator.calibrate([("2024", 6), ("1999", 6)]), 1.5)
+
+    def test_pack_prioritises_matching_sections_in_document_order(self):
+        costs = [TokenEstimator.estimate(section) for section in self.SECTIONS]
+        budget = costs[1] + costs[3] + 5
+        report = PromptPacker.pack(self.SECTIONS, budget, "Q1. Explain hash partitioning. Q2. How does Raft reach consensus?")
+        self.assertEqual(report['text'], self.SECTIONS[1] + "\n\n" + self.SECTIONS[3])
+        self.assertLessEqual(report['tokens'], budget)
+        self.assertEqual(report['sections'], (2, 4))
+        self.assertEqual(report['prioritised'], 2)
+
+        # Without priority text the budget is filled from the start, whole sections only
+        report = PromptPacker.pack(self.SECTIONS, budget)
+        self.assertTrue(report['text'].startswith(self.SECTIONS[0]))
+        self.assertTrue(all(section in self.SECTIONS for section in report['text'].split("\n\n")))
+
+    def test_split_sections_and_oversized_section(self):
+        text = "intro paragraph\n" + "\n".join(self.SECTIONS)
+        self.assertEqual(len(PromptPacker.split_sections(text)), 5)
+        self.assertEqual(PromptPacker.split_sections("a\n\nb"), ["a", "b"])
+
+        report = PromptPacker.pack(["word " * 1000], 50)
+        self.assertLessEqual(report['tokens'], 50)
+        self.assertTrue(report['text'])
+
+
+class ExtractiveSummaryTestCase(SimpleTestCase):
+    """Local TF-IDF/TextRank selection of the paragraphs that go into the prompts"""
+
+    PARAGRAPHS = [
+        "Replication copies every write from the leader to follower replicas so reads survive failures.",
+        "Follower replicas apply the leader's replication log in order and acknowledge each write.",
+        "The cafeteria menu changes on Fridays and the coffee machine is on the second floor.",
+        "When the leader fails, replicas elect a new leader and replication resumes from the log.",
+        "Synchronous replication waits for follower replicas before acknowledging the write.",
+    ]
+
+    def budget_for(self, count):
+        return sum(TokenEstimator.estimate(p) for p in self.PARAGRAPHS[:count]) + 4 * count
+
+    def test_text_that_fits_is_unchanged(self):
+        text = ExtractiveSummarizer.select(self.PARAGRAPHS, 10_000)
+        self.assertEqual(text, "\n\n".join(self.PARAGRAPHS))
+
+    def test_central_paragraphs_within_budget_in_document_order(self):
+        matrix = ExtractiveSummarizer.tfidf_matrix(self.PARAGRAPHS)
+        budget = self.budget_for(2)
+        for method in ("textrank", "tfidf"):
+            self.assertEqual(int(ExtractiveSummarizer.scores(matrix, method).argmin()), 2, method)
+            with override_settings(EXTRACTIVE_SUMMARY={'METHOD': method}):
+                text = ExtractiveSummarizer.select(self.PARAGRAPHS, budget)
+            kept = text.split("\n\n")
+            self.assertLessEqual(TokenEstimator.estimate(text), budget)
+            self.assertNotIn(self.PARAGRAPHS[2], kept, method)
+            self.assertEqual(kept, [p for p in self.PARAGRAPHS if p in kept], method)
+
+    def test_duplicates_skipped_and_priority_boost(self):
+        paragraphs = [self.PARAGRAPHS[0], self.PARAGRAPHS[0], self.PARAGRAPHS[2], self.PARAGRAPHS[3]]
+        text = ExtractiveSummarizer.select(paragraphs, self.budget_for(3))
+        self.assertEqual(text.split("\n\n").count(self.PARAGRAPHS[0]), 1)
+
+        # Past questions tip the choice between equally central paragraphs
+        budget = TokenEstimator.estimate(self.PARAGRAPHS[4]) + 4
+        text = ExtractiveSummarizer.select(self.PARAGRAPHS, budget, "Q1. Why does synchronous replication wait for followers?")
+        self.assertEqual(text, self.PARAGRAPHS[4])
+
+        with self.assertRaises(Exception):
+            ExtractiveSummarizer.scores(ExtractiveSummarizer.tfidf_matrix(self.PARAGRAPHS), "lsa")
+
+    def test_free_tier_ranks_paragraphs_past_its_prompt_limit(self):
+        paragraph = "Replication copies every write from the leader to follower replicas. " * 4
+        sections = [{"text": f"{paragraph}section {n}"} for n in range(400)]  # ~115k characters
+        text = AIProcessor.collect_study_text(iter(sections))
+        self.assertIn("section 399", AIProcessor._preprocess_study_text(text))
+
+        with override_settings(EXTRACTIVE_SUMMARY={'ENABLED': False}):
+            text = AIProcessor.collect_study_text(iter(sections))
+            self.assertNotIn("section 399", text)
+            self.assertLessEqual(len(AIProcessor._preprocess_study_text(text)), AIProcessor.MAX_STUDY_CHARS)
+
+    def test_premium_text_within_the_study_budget_is_not_condensed(self):
+        text = "\n\n".join(self.PARAGRAPHS)
+        tokens = TokenEstimator.estimate(text)
+        budgets = {'STUDY': tokens, 'EXTRACT': self.budget_for(2)}
+        with override_settings(PROMPT_TOKEN_BUDGETS={'premium': budgets}, EXTRACTIVE_SUMMARY={'ENABLED': True}):
+            self.assertEqual(PremiumAIProcessor._condense_study_text(text), text)
+            budgets['STUDY'] = tokens - 1
+            self.assertLessEqual(TokenEstimator.estimate(PremiumAIProcessor._condense_study_text(text)), budgets['EXTRACT'])
+
+
+@override_settings(
+    SUMMARY_STREAM={'ENABLED': True, 'CACHE_ALIAS': 'default', 'TIMEOUT': 60, 'PUBLISH_INTERVAL': 60},
+    FAKE_BACKENDS={'LATENCY': {}, 'STREAM_CHUNK_CHARS': 40},
+)
+class SummaryStreamTestCase(_StubTestCase):
+    """Streamed summaries match the non-streaming path and reach the SSE cache entry"""
+
+    STUDY_TEXT = "\n\n".join(
+        f"Paragraph {i} explains how replicated databases keep copies of every record on several machines."
+        for i in range(5)
+    )
+
+    def test_streamed_summary_is_identical(self):
+        summary = "## Replication\n" + "Replicas copy every write so reads survive a failed machine. " * 8
+        deltas = []
+        with mock.patch.object(AIProcessor, '_model', _StubModel(answer=lambda prompt: summary)):
+            streamed = AIProcessor._generate_coherent_summary(self.STUDY_TEXT, "", deltas.append)
+            whole = AIProcessor._generate_coherent_summary(self.STUDY_TEXT, "")
+        self.assertEqual(streamed, whole)
+        self.assertGreater(len(deltas), 5)
+        self.assertEqual("".join(deltas), summary)
+
+    def test_publisher_throttles_and_closes_with_stored_summary(self):
+        publisher = SummaryStream.publisher(42)
+        publisher("## Repl")
+        self.assertEqual(SummaryStream.read(42), ("## Repl", False))
+
+        publisher("ication")  # within PUBLISH_INTERVAL: kept until the next write
+        self.assertEqual(SummaryStream.read(42), ("## Repl", False))
+
+        publisher.close(final_text="## Replication")
+        self.assertEqual(SummaryStream.read(42), ("## Replication", True))
+        self.assertEqual(SummaryStream.read(43), ("", False))
+
+    def test_deltas_after_close_are_ignored(self):
+        publisher = SummaryStream.publisher(44)
+        publisher("## Repl")
+        publisher.close(final_text="## Replication")
+
+        # A streamed call that overran its timeout keeps calling the publisher
+        publisher.last_publish = 1.0
+        publisher("ication, partial")
+        publisher.close()
+        self.assertEqual(SummaryStream.read(44), ("## Replication", True))
+
+
+@override_settings(CONTEXT_SESSIONS={'BACKEND': 'gemini', 'MIN_TOKENS': 1024, 'TTL': 900})
+class ContextSessionTestCase(_StubTestCase):
+    """Study context is uploaded once per document and prompts only refer to it"""
+
+    def setUp(self):
+        super().setUp()
+        self.cached_content = mock.Mock()
+        self.cached_content.name = 'cachedContents/abc'
+        self.session_model = _StubModel(answer=_quiz_items)
+        self.create = mock.Mock(return_value=self.cached_content)
+        patches = [
+            mock.patch('google.generativeai.caching.CachedContent.create', self.create),
+            mock.patch('google.generativeai.GenerativeModel.from_cached_content', return_value=self.session_model),
+            LLMResponseCache.bypass(),
+        ]
+        for patcher in patches:
+            patcher.__enter__()
+            self.addCleanup(patcher.__exit__, None, None, None)
+        self.model = mock.Mock(model_name='models/fake')
+
+    def test_quiz_prompts_refer_to_the_shared_context(self):
+        processor = mock.Mock(_model=self.model, CALL_TIMEOUT=5)
+        questions = [f"Q{n} what is concept number {n}?" for n in range(1, 16)]
+        with mock.patch.object(AIPoweredQuizGenerator, '_get_ai_processor', return_value=processor), \
+                mock.patch.object(AIPoweredQuizGenerator, 'BATCH_MODE', True):
+            items = AIPoweredQuizGenerator._generate_quiz_items(questions, "lecture " * 5000, False)
+
+        self.assertEqual(len(items), 15)
+        self.assertEqual(len(self.session_model.prompts), 2)
+        self.assertFalse(self.model.generate_content.called)
+        for prompt in self.session_model.prompts:
+            self.assertNotIn("lecture", prompt)
+            self.assertIn("provided in the context above", prompt)
+
+        # Uploaded once, packed to the quiz token budget
+        self.assertEqual(self.create.call_count, 1)
+        self.assertEqual(self.create.call_args.kwargs['contents'][0].count("lecture"), 1875)
+        self.cached_content.delete.assert_called_once_with()
+
+    @override_settings(MODEL_ROUTING={
+        'ENABLED': True, 'DEFAULT': ['flash'],
+        'ROUTES': {'quiz_batch': [{'MODELS': ['lite', 'flash']}], 'answer': [{'MODELS': ['lite', 'flash']}]},
+    })
+    def test_quiz_session_is_opened_on_the_routed_model(self):
+        processor = mock.Mock(_model=self.model, CALL_TIMEOUT=5)
+        lite = mock.Mock(model_name='models/lite')
+        with mock.patch.object(AIPoweredQuizGenerator, '_get_ai_processor', return_value=processor), \
+                mock.patch.object(GeminiConfig, 'get_model', side_effect=lambda name: {'lite': lite}[name]):
+            for batch_mode in (True, False):
+                with mock.patch.object(AIPoweredQuizGenerator, 'BATCH_MODE', batch_mode):
+                    AIPoweredQuizGenerator._generate_quiz_items(["Q1 what is a quorum?"], "lecture " * 5000, False)
+                self.assertEqual(self.create.call_args.kwargs['model'], 'models/lite')
+
+    def test_cache_outlives_calls_that_overran(self):
+        self.session_model.delay = 0.3
+        with ContextSessions.open(self.model, "lecture " * 5000) as session:
+            results = ParallelGeneration.run({
+                'qa': (lambda: GeminiConfig.generate('qa', self.model, session.reference, session),
+                       lambda error: None, 0.05),
+            })
+        self.assertEqual(results, {'qa': None})
+        self.assertFalse(self.cached_content.delete.called)  # the overrunning call still uses it
+
+        for _ in range(100):
+            if self.cached_content.delete.called:
+                break
+            time.sleep(0.01)
+        self.cached_content.delete.assert_called_once_with()
+
+    def test_small_contexts_and_failures_stay_inline(self):
+        with ContextSessions.open(self.model, "A short summary.") as session:
+            self.assertIs(session.model, self.model)
+            self.assertEqual(session.reference, "A short summary.")
+
+        with mock.patch('google.generativeai.caching.CachedContent.create', side_effect=Exception("400 too small")):
+            with ContextSessions.open(self.model, "lecture " * 5000) as session:
+                self.assertIs(session.model, self.model)
+                self.assertIn("lecture", session.reference)
+
+    @override_settings(CONTEXT_SESSIONS={'BACKEND': 'inline', 'MIN_TOKENS': 1024, 'TTL': 900})
+    def test_inline_backend_keeps_prompts_unchanged(self):
+        with ContextSessions.open(self.model, "lecture " * 5000) as session:
+            self.assertIs(session.model, self.model)
+            self.assertEqual(session.reference, "lecture " * 5000)
+        self.assertFalse(self.cached_content.delete.called)
+
+
+@override_settings(FAKE_BACKENDS={'LATENCY': {'llm': 0.0}, 'JITTER': 0.0, 'ERROR_RATE': 0.0, 'SEED': 0,
+                                  'STREAM_CHUNK_CHARS': 50})
+class FakeBackendsTestCase(SimpleTestCase):
+    """The offline backends answer in the shapes the pipeline parses, and cassettes replay recordings"""
+
+    NOTES = "\n\n".join(
+        f"Section {i} explains how replication keeps every record on several machines for availability."
+        for i in range(5)
+    )
+
+    def setUp(self):
+        FakeCalls.reset()
+
+    def test_fake_answers_parse(self):
+        model = FakeGenerativeModel("gemini-2.5-flash")
+        qa = PremiumAIProcessor._parse_qa_response(model.generate_content(
+            "Generate exactly 12 questions covering the full breadth of the notes.\n\n"
+            f"STUDY NOTES:\n{self.NOTES}\n\nStart immediately with Q1 (absolutely nothing before it):"
+        ).text)
+        self.assertEqual(len(qa), 12)
+
+        cards = PremiumAIProcessor._parse_flashcards_response(model.generate_content(
+            f"Generate exactly 8 flashcards.\n\nSTUDY NOTES:\n{self.NOTES}\n\n"
+            "Start immediately with the first TERM (absolutely nothing before it):"
+        ).text)
+        self.assertEqual(len(cards), 8)
+        self.assertIn(cards[0]['term'].lower(), self.NOTES.lower())
+
+        # Same prompt, same answer; streams join to the whole text
+        prompt = "Explain replication briefly."
+        self.assertEqual(model.generate_content(prompt).text, model.generate_content(prompt).text)
+        self.assertEqual("".join(chunk.text for chunk in model.generate_content(prompt, stream=True)),
+                         model.generate_content(prompt).text)
+
+    def test_error_injection(self):
+        from google.api_core import exceptions as google_exceptions
+        with override_settings(FAKE_BACKENDS={'LATENCY': {}, 'JITTER': 0.0, 'ERROR_RATE': 1.0, 'SEED': 0}):
+            with self.assertRaises(google_exceptions.GoogleAPIError):
+                FakeGenerativeModel("gemini-2.5-flash").generate_content("Explain replication.")
+        self.assertEqual(FakeCalls.stats()['llm'], {'calls': 1, 'errors': 1})
+
+    def test_cassette_record_and_replay(self):
+        with tempfile.TemporaryDirectory() as cassette_dir, \
+                override_settings(LLM_BACKEND={'BACKEND': 'record', 'CASSETTE_DIR': cassette_dir}):
+            real = _StubModel.numbered()
+            recorder = CassetteModel('models/fake', 'record', real)
+            self.assertEqual(recorder.generate_content("prompt one").text, "answer 1")
+            self.assertEqual(recorder.generate_content("prompt two").text, "answer 2")
+
+            Cassette._cassettes.clear()  # a new process reads the file
+            player = CassetteModel('fake', 'replay')
+            self.assertEqual(player.generate_content("prompt one\r\n").text, "answer 1")
+            self.assertEqual("".join(c.text for c in player.generate_content("prompt two", stream=True)), "answer 2")
+            with self.assertRaises(CassetteMiss):
+                player.generate_content("never recorded")
+            self.assertEqual(real.calls, 2)
+            Cassette._cassettes.clear()
+
+    def test_load_test_percentiles(self):
+        summary = PipelineLoadTest.summarize([4.0, 1.0, 3.0, 2.0, 5.0])
+        self.assertEqual(summary['count'], 5)
+        self.assertEqual(summary['p50'], 3.0)
+        self.assertEqual(summary['p90'], 4.6)
+        self.assertEqual(summary['max'], 5.0)
+        self.assertEqual(PipelineLoadTest.summarize([]), {'count': 0})
+
+
+class ResponseParserTestCase(SimpleTestCase):
+    """Incremental Q/A and flashcard parsing of streamed model output"""
+
+    QA = (
+        "Here are your questions.\n"
+        "**Q1:** What does replication copy?\n"
+        "A1: Every write,\nfrom the leader to the followers.\n\n"
+        "Q2) Why elect a leader?\n"
+        "A2. So that writes have a single order.\n"
+        "Quorum is mentioned here but is not a header.\n"
+    )
+
+    def test_qa_pairs_close_as_chunks_are_fed(self):
+        emitted = []
+        parser = QAStreamParser()
+        for index in range(0, len(self.QA), 7):
+            emitted.extend(parser.feed(self.QA[index:index + 7]))
+            if "Q2) Why elect a leader?\n" in self.QA[:index + 7]:
+                self.assertEqual(len(emitted), 1)  # pair 1 closed by the next header line
+        emitted.extend(parser.close())
+
+        self.assertEqual(parser.items, QAStreamParser.parse(self.QA))
+        self.assertEqual([pair["id"] for pair in emitted], [1, 2])
+        self.assertEqual(emitted[0]["question"], "What does replication copy?")
+        self.assertEqual(emitted[0]["answer"], "Every write,\nfrom the leader to the followers.")
+        self.assertTrue(emitted[1]["answer"].endswith("Quorum is mentioned here but is not a header."))
+        self.assertEqual(PremiumAIProcessor._parse_qa_response("Q3: Unanswered?\nQ1: x\nA1: y")[0]["id"], 1)
+
+    def test_malformed_flashcard_does_not_shift_pairs(self):
+        cards = FlashcardStreamParser.parse(
+            "TERM: Replica\nDEFINITION: A copy of the data.\n\n"
+            "TERM: Orphan\n\n"
+            "term: Quorum\nDefinition: A majority of the nodes,\nenough to commit."
+        )
+        self.assertEqual(cards, [
+            {"term": "Replica", "definition": "A copy of the data."},
+            {"term": "Quorum", "definition": "A majority of the nodes,\nenough to commit."},
+        ])
+
+
+class SingleCallTestCase(_StubTestCase):
+    """Premium summary, Q&A and flashcards from one JSON call, with per-part fallback"""
+
+    STUDY_TEXT = "\n\n".join(
+        f"## Topic {i}\n\nSection {i} explains how replication keeps every record on several machines "
+        f"so that reads and writes survive the failure of a single machine."
+        for i in range(6)
+    )
+
+    def generate(self):
+        FakeCalls.reset()
+        with LLMResponseCache.bypass(), \
+                mock.patch.object(PremiumAIProcessor, 'SINGLE_CALL', True), \
+                mock.patch.object(PremiumAIProcessor, '_models_loaded', True), \
+                mock.patch.object(PremiumAIProcessor, '_model', FakeGenerativeModel("gemini-2.5-flash")):
+            return PremiumAIProcessor.generate_study_pack(self.STUDY_TEXT)
+
+    def test_one_call_for_the_study_pack(self):
+        summary, qa_data, flashcards = self.generate()
+        self.assertEqual(FakeCalls.stats()['llm']['calls'], 1)
+        self.assertTrue(summary.startswith("## "))
+        self.assertIn("## Quick Reference: Key Terms", summary)
+        self.assertEqual(qa_data['total_questions'], PremiumAIProcessor.NUM_QUESTIONS)
+        self.assertEqual([pair['id'] for pair in qa_data['qa_pairs'][:3]], [1, 2, 3])
+        self.assertEqual(len(flashcards), PremiumAIProcessor.NUM_FLASHCARDS)
+
+    def test_missing_parts_fall_back_to_their_prompts(self):
+        partial = json.dumps({
+            "questions": [{"question": "Why replicate?", "answer": "To survive failures."}, {"question": " "}],
+            "flashcards": [{"term": "", "definition": "No term, so not a card."}],
+        })
+        with mock.patch.object(FakeResponses, '_study_pack', return_value=partial):
+            summary, qa_data, flashcards = self.generate()
+        self.assertEqual(FakeCalls.stats()['llm']['calls'], 3)
+        self.assertEqual(qa_data['qa_pairs'][0]['question'], "Why replicate?")
+        self.assertEqual(qa_data['total_questions'], 1)
+        self.assertTrue(summary.startswith("## "))
+        self.assertEqual(len(flashcards), PremiumAIProcessor.NUM_FLASHCARDS)
+
+        with mock.patch.object(FakeResponses, '_study_pack', return_value="not json"):
+            summary, qa_data, flashcards = self.generate()
+        self.assertEqual(FakeCalls.stats()['llm']['calls'], 4)
+        self.assertEqual(qa_data['total_questions'], PremiumAIProcessor.NUM_QUESTIONS)
+
+
+@override_settings(
+    QUIZ_RETRIEVAL={'ENABLED': True, 'TOP_K': 2, 'PASSAGE_TOKENS': 300, 'CACHE_ALIAS': 'default'},
+    PROMPT_TOKEN_BUDGETS={'quiz': {'CONTEXT': 60}},
+)
+class PassageIndexTestCase(_StubTestCase):
+    """BM25 retrieval of summary passages for quiz prompts"""
+
+    SUMMARY = "\n\n".join([
+        "## Replication\nLeader-follower replication copies every write to follower replicas.",
+        "## Consensus\nRaft elects a leader and commits log entries once a quorum acknowledges them.",
+        "## Caching\nWrite-through caches update the cache and the database in the same operation.",
+        "## Sharding\nHash partitioning spreads keys evenly but makes range scans expensive.",
+    ] + [f"## Topic {i}\nGeneral remarks about distributed systems, part {i}." for i in range(8)])
+
+    def test_search_and_context(self):
+        index = PassageIndex.build(self.SUMMARY)
+        self.assertEqual(index.search("Why are range scans expensive with hash partitioning?", 2)[0], 3)
+        self.assertEqual(index.search("photosynthesis", 2), [])
+
+        context = index.context("How does Raft reach a quorum?\nWhen is a write-through cache updated?")
+        self.assertEqual(context, index.passages[1] + "\n\n" + index.passages[2])
+        self.assertLessEqual(TokenEstimator.estimate(context), 60)
+
+        restored = PassageIndex.from_bytes(index.to_bytes())
+        self.assertEqual(restored.passages, index.passages)
+        self.assertEqual(restored.scores("quorum leader").tolist(), index.scores("quorum leader").tolist())
+
+    def test_for_result_builds_once_for_long_summaries(self):
+        result = mock.Mock(id=7, summary=self.SUMMARY)
+        with mock.patch.object(PassageIndex, 'build', wraps=PassageIndex.build) as build:
+            first = PassageIndex.for_result(result)
+            second = PassageIndex.for_result(result)
+        self.assertEqual(build.call_count, 1)
+        self.assertEqual(first.passages, second.passages)
+
+        self.assertIsNone(PassageIndex.for_result(mock.Mock(id=8, summary="## Short\nFits the budget.")))
+        self.assertEqual(
+            AIPoweredQuizGenerator._quiz_context(first, "Explain hash partitioning."), first.passages[3]
+        )
+
+
+def _named(name, error=None):
+    """A stub that answers with its model name, or raises error on every call"""
+    def answer(prompt):
+        if error:
+            raise error
+        return f"models/{name}"
+
+    return _StubModel(name, answer=answer)
+
+
+@override_settings(MODEL_ROUTING={
+    'ENABLED': True,
+    'DEFAULT': ['flash'],
+    'ROUTES': {
+        'answer': [{'MODELS': ['lite', 'flash']}],
+        'flashcards': [{'MAX_TOKENS': 10, 'MODELS': ['lite']}, {'MODELS': ['flash']}],
+    },
+})
+class ModelRoutingTestCase(_StubTestCase):
+    """Per call type and size model routing, with fallback on rate limits"""
+
+    def setUp(self):
+        super().setUp()
+        GeminiConfig.reset_routing_stats()
+
+    def models(self, **errors):
+        models = {name: _named(name, errors.get(name)) for name in ('flash', 'lite')}
+        return mock.patch.object(GeminiConfig, 'get_model', side_effect=lambda name: models[name])
+
+    def test_one_shared_model_per_name_across_threads(self):
+        from concurrent.futures import ThreadPoolExecutor
+        def slow_backend(model_name):
+            time.sleep(0.05)
+            return _named(model_name)
+
+        with mock.patch.dict(GeminiConfig._models, clear=True), \
+                mock.patch('Socratic.utils.gemini_config.get_llm_backend', return_value=slow_backend):
+            with ThreadPoolExecutor(max_workers=4) as pool:
+                models = list(pool.map(lambda _: GeminiConfig.get_model('threaded'), range(4)))
+        self.assertEqual(len({id(model) for model in models}), 1)
+
+    def test_route(self):
+        self.assertEqual(GeminiConfig.route('flashcards', 5), ['lite'])
+        self.assertEqual(GeminiConfig.route('flashcards', 500), ['flash'])
+        self.assertEqual(GeminiConfig.route('summary', 5), ['flash'])
+
+    def test_fallback_and_stats(self):
+        from google.api_core import exceptions as google_exceptions
+        own = _named('own')
+        with self.models(lite=google_exceptions.ResourceExhausted("quota")):
+            self.assertEqual(GeminiConfig.generate('answer', own, "short").text, "models/flash")
+            self.assertEqual(GeminiConfig.stream('answer', own, "short", lambda delta: None), "models/flash")
+        self.assertEqual(GeminiConfig.routing_stats()['answer'], {
+            'models/lite': {'calls': 0, 'fallbacks': 2},
+            'models/flash': {'calls': 2, 'fallbacks': 0},
+        })
+
+        with self.models(lite=ValueError("bad request")), self.assertRaises(ValueError):
+            GeminiConfig.generate('answer', own, "short")
+
+    def test_pinned_session_and_disabled_routing_use_own_model(self):
+        own = _named('own')
+        session = ContextSession(_named('cached'), "notes", "study notes")
+        session.pinned = True
+        with self.models():
+            self.assertEqual(GeminiConfig.generate('answer', own, "short", session).text, "models/cached")
+            with override_settings(MODEL_ROUTING={'ENABLED': False}):
+                self.assertEqual(GeminiConfig.generate('answer', own, "short").text, "models/own")
+            inline = ContextSession(own, "notes", "study notes")
+            self.assertEqual(GeminiConfig.generate('answer', own, "short", inline).text, "models/lite")
+
+
+@override_settings(
+    LLM_METRICS={'ENABLED': True, 'FLUSH_SIZE': 1000, 'FLUSH_INTERVAL': 3600},
+    MODEL_ROUTING={'ENABLED': True, 'DEFAULT': ['flash'], 'ROUTES': {'answer': [{'MODELS': ['lite', 'flash']}]}},
+)
+class LLMMetricsTestCase(_StubTestCase):
+    """Per-call latency, token and outcome records, attributed to a document and user"""
+
+    def setUp(self):
+        super().setUp()
+        LLMMetrics._buffer = []
+        LLMMetrics._last_flush = time.monotonic()
+        self.written = []
+        patcher = mock.patch('logs.models.LLMCall.objects.bulk_create', side_effect=self.written.extend)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def models(self, **errors):
+        models = {name: _named(name, errors.get(name)) for name in ('flash', 'lite')}
+        return mock.patch.object(GeminiConfig, 'get_model', side_effect=lambda name: models[name])
+
+    def test_routed_call_is_recorded_once(self):
+        from google.api_core import exceptions as google_exceptions
+        with self.models(lite=google_exceptions.ResourceExhausted("quota")):
+            with LLMMetrics.attribute('0f0e7c4e-3c43-4c39-a1a4-5d1e3b6f0c11', 7):
+                GeminiConfig.generate('answer', _named('own'), "What is a quorum read?")
+
+        [call] = self.written
+        self.assertEqual((call.call_type, call.model, call.outcome, call.attempts), ('answer', 'flash', 'ok', 2))
+        self.assertEqual((str(call.document_id), call.user_id), ('0f0e7c4e-3c43-4c39-a1a4-5d1e3b6f0c11', 7))
+        self.assertEqual(call.prompt_chars, len("What is a quorum read?"))
+        self.assertEqual(call.response_chars, len("models/flash"))
+        self.assertTrue(call.tokens_estimated)
+
+    def test_usage_metadata_and_failures(self):
+        from google.api_core import exceptions as google_exceptions
+        response = mock.Mock(text="A majority", usage_metadata=mock.Mock(prompt_token_count=40, candidates_token_count=3))
+        LLMMetrics.record('answer', 'models/flash', "prompt", response, time.monotonic())
+        with self.models(lite=google_exceptions.DeadlineExceeded("slow"), flash=ValueError("bad request")):
+            with self.assertRaises(ValueError):
+                GeminiConfig.generate('answer', _named('own'), "prompt")
+        LLMMetrics.flush()
+
+        used, failed = self.written
+        self.assertEqual((used.prompt_tokens, used.response_tokens, used.tokens_estimated), (40, 3, False))
+        self.assertEqual((failed.outcome, failed.attempts, failed.error), ('error', 2, 'ValueError: bad request'))
+        self.assertEqual(LLMMetrics._outcome(google_exceptions.ResourceExhausted("quota")), 'rate_limited')
+        self.assertEqual(LLMMetrics._outcome(TimeoutError()), 'timeout')
+
+    def test_fallbacks_in_worker_threads_keep_attribution(self):
+        with LLMMetrics.attribute(None, 3):
+            ParallelGeneration.run({
+                'answer': (lambda: AIPoweredQuizGenerator._generate_fallback_answer("Why elect a leader?"), None, None),
+                'explanation': (lambda: AIPoweredQuizGenerator._build_quiz_item("Why?", {'answer': "Votes"}), None, None),
+            })
+
+        self.assertEqual(
+            sorted((call.call_type, call.outcome, call.user_id) for call in self.written),
+            [('answer', 'fallback', 3), ('explanation', 'fallback', 3)],
+        )
+
+    @override_settings(MODEL_ROUTING={'ENABLED': False}, LLM_CACHE={'ENABLED': True, 'TIMEOUT': None})
+    def test_cached_stream_is_recorded_as_cached(self):
+        model = CachedModel(_named('own'))
+        with mock.patch.object(LLMResponseCache, 'get', return_value="Votes"):
+            self.assertEqual(GeminiConfig.stream('answer', model, "Why elect a leader?", lambda delta: None), "Votes")
+        LLMMetrics.flush()
+
+        [call] = self.written
+        self.assertTrue(call.cached)
+        self.assertEqual(call.response_chars, len("Votes"))
+
+    @override_settings(LLM_METRICS={'ENABLED': True, 'FLUSH_SIZE': 1, 'FLUSH_INTERVAL': 3600})
+    def test_only_the_attributing_thread_writes(self):
+        writers = []
+        with mock.patch('logs.models.LLMCall.objects.bulk_create',
+                        side_effect=lambda records: writers.append((threading.get_ident(), len(records)))):
+            with LLMMetrics.attribute(None, 3):
+                ParallelGeneration.run({
+                    f'answer {n}': (lambda: AIPoweredQuizGenerator._generate_fallback_answer("Why?"), None, None)
+                    for n in range(3)
+                })
+                self.assertEqual(writers, [])  # due, but left to this thread
+
+        self.assertEqual(writers, [(threading.get_ident(), 3)])
+
+    def test_failed_write_drops_the_batch(self):
+        LLMMetrics.fallback('qa')
+        with mock.patch('logs.models.LLMCall.objects.bulk_create', side_effect=Exception("database is locked")):
+            LLMMetrics.flush()
+        self.assertEqual(LLMMetrics._buffer, [])
+
+
+class LLMMetricsSummaryTestCase(TestCase):
+    """The llm_calls report stays bounded whatever window is asked for"""
+
+    def test_window_is_clamped_and_percentiles_use_the_latest_calls(self):
+        from logs.models import LLMCall
+        LLMCall.objects.bulk_create(
+            [LLMCall(call_type='answer', latency_ms=10_000) for _ in range(3)]
+            + [LLMCall(call_type='answer', latency_ms=100) for _ in range(2)]
+            + [LLMCall(call_type='answer', outcome='fallback', attempts=0)]
+        )
+        # The slow calls are the older ones
+        LLMCall.objects.filter(latency_ms=10_000).update(created_at=timezone.now() - timedelta(hours=1))
+        with mock.patch.object(LLMMetrics, 'LATENCY_SAMPLE', 2):
+            summary = LLMMetrics.summary(days=1_000_000)
+
+        self.assertEqual(summary['days'], LLMMetrics.MAX_DAYS)
+        answer = summary['call_types']['answer']
+        self.assertEqual((answer['calls'], answer['p99_ms']), (5, 100.0))
+        self.assertEqual(answer['outcomes'], {'ok': 3 + 2, 'fallback': 1})
+
+
+@override_settings(GEMINI_RATE_LIMITS={
+    'ENABLED': True,
+    'REDIS_URL': None,
+    'KEY_PREFIX': 'test:quota',
+    'DEFAULT': {'RPM': 60, 'TPM': 10_000},
+    'MODELS': {'tiny': {'RPM': 2, 'TPM': 1_000}},
+    'OUTPUT_TOKENS': 500,
+    'MAX_WAIT': 0,
+})
+class RateLimiterTestCase(_StubTestCase):
+    """Requests- and tokens-per-minute buckets shared by model calls"""
+
+    def setUp(self):
+        super().setUp()
+        RateLimiter._local = {}
+
+    def test_buckets_refill_over_the_minute(self):
+        self.assertEqual(RateLimiter.try_acquire('models/tiny', 600), 0)
+        # 200 more tokens take 12s at 1000 tokens per minute
+        self.assertAlmostEqual(RateLimiter.try_acquire('models/tiny', 600), 12, delta=0.1)
+        self.assertEqual(RateLimiter.try_acquire('models/tiny', 100), 0)
+        # Both requests of the minute are used
+        self.assertAlmostEqual(RateLimiter.try_acquire('models/tiny', 1), 30, delta=0.1)
+
+        key = RateLimiter._key('tiny')
+        requests, tokens, last = RateLimiter._local[key]
+        RateLimiter._local[key] = (requests, tokens, last - 60)
+        self.assertEqual(RateLimiter.try_acquire('models/tiny', 1_000), 0)
+
+    def test_waits_beyond_max_wait_raise_resource_exhausted(self):
+        from google.api_core import exceptions as google_exceptions
+        RateLimiter.acquire('models/tiny', 1_000)
+        with self.assertRaises(google_exceptions.ResourceExhausted):
+            RateLimiter.acquire('models/tiny', 1_000)
+
+    def test_wrapped_calls_settle_their_reservation(self):
+        model = RateLimiter.wrap(_StubModel('metered', answer=lambda prompt: "ok", tokens=100))
+        self.assertIsInstance(model, RateLimitedModel)
+        self.assertEqual(GeminiClient.generate(model, "x" * 400).text, "ok")
+        self.assertEqual(model.generate_content("x" * 400).text, "ok")
+
+        headroom = RateLimiter.headroom()['metered']
+        self.assertEqual(headroom['requests'], 58)
+        # Reserved ~100 prompt + 500 output tokens each, then settled to the 100 reported
+        self.assertAlmostEqual(headroom['tokens'], 9_800, delta=5)
+
+    @override_settings(GEMINI_CLIENT={'MAX_IN_FLIGHT': 8, 'MODEL_MAX_IN_FLIGHT': {'models/one-slot': 1}})
+    def test_waiting_for_quota_holds_no_in_flight_slot(self):
+        with override_settings(GEMINI_RATE_LIMITS={**settings.GEMINI_RATE_LIMITS, 'MAX_WAIT': 5}):
+            model = RateLimiter.wrap(_StubModel('one-slot', answer=lambda prompt: "ok", tokens=100))
+            # ~50 tokens short of the ~501 reserved: about 0.3s at 10_000 tokens a minute
+            RateLimiter._local[RateLimiter._key('one-slot')] = (60, 451, time.monotonic())
+            results = []
+            waiting = threading.Thread(target=lambda: results.append(GeminiClient.generate(model, "hi").text))
+            waiting.start()
+            time.sleep(0.1)
+
+            self.assertEqual(GeminiClient.in_flight().get('models/one-slot', 0), 0)
+            started = time.monotonic()
+            self.assertEqual(GeminiClient.generate(_StubModel('one-slot', answer=lambda prompt: "ok"), "hi").text, "ok")
+            self.assertLess(time.monotonic() - started, 0.1)
+            waiting.join()
+
+            deltas = []
+            self.assertEqual(GeminiClient.stream(model, "hi", deltas.append), "ok")
+        self.assertEqual((results, deltas), (["ok"], ["ok"]))
+        self.assertEqual(GeminiClient.in_flight()['models/one-slot'], 0)
+
+    def test_unreachable_redis_does_not_block_calls(self):
+        script = mock.Mock(side_effect=ConnectionError("refused"))
+        with mock.patch.object(RateLimiter, '_client', return_value=mock.Mock()), \
+                mock.patch.object(RateLimiter, '_script', script):
+            self.assertEqual(RateLimiter.try_acquire('models/tiny', 10_000), 0)
+
+
+@skipUnless(os.getenv('REDIS_URL'), "needs a Redis server (REDIS_URL)")
+class RedisRateLimiterTestCase(SimpleTestCase):
+    """The Redis Lua buckets behave like the in-process ones"""
+
+    def setUp(self):
+        self.limits = {
+            'ENABLED': True,
+            'KEY_PREFIX': f"test:quota:{os.getpid()}:{time.monotonic_ns()}",
+            'DEFAULT': {'RPM': 60, 'TPM': 10_000},
+            'MODELS': {'tiny': {'RPM': 2, 'TPM': 1_000}},
+            'MAX_WAIT': 0,
+        }
+        RateLimiter._redis = RateLimiter._script = None
+        RateLimiter._local = {}
+        self.addCleanup(setattr, RateLimiter, '_redis', None)
+
+    def scenario(self, redis_url):
+        """Each step's (wait ms, requests left, tokens left) with RPM 2 and TPM 1000"""
+        with override_settings(GEMINI_RATE_LIMITS={**self.limits, 'REDIS_URL': redis_url}):
+            key = RateLimiter._key('tiny')
+
+            def age(seconds):
+                # Move the last refill back instead of sleeping
+                if redis_url:
+                    client = RateLimiter._client()
+                    client.hset(key, 'ts', int(float(client.hget(key, 'ts'))) - int(seconds * 1000))
+                else:
+                    requests, tokens, last = RateLimiter._local[key]
+                    RateLimiter._local[key] = (requests, tokens, last - seconds)
+
+            steps = [
+                RateLimiter._run('models/tiny', 'acquire', 1, 600),
+                RateLimiter._run('models/tiny', 'acquire', 1, 600),  # 200 tokens short
+                RateLimiter._run('models/tiny', 'settle', 0, 300),
+                RateLimiter._run('models/tiny', 'acquire', 1, 600),
+                RateLimiter._run('models/tiny', 'acquire', 1, 1),  # no request left
+            ]
+            age(30)
+            steps.append(RateLimiter._run('models/tiny', 'acquire', 1, 1))
+            steps.append(RateLimiter._run('models/tiny', 'peek', 0, 0))
+            if redis_url:
+                RateLimiter._client().delete(key)
+            return steps
+
+    def test_script_matches_local_buckets(self):
+        expected = [(0, 1, 400), (12_000, 1, 400), (0, 1, 700), (0, 0, 100), (30_000, 0, 100), (0, 0, 599), (0, 0, 599)]
+        for backend, steps in (('redis', self.scenario(os.getenv('REDIS_URL'))), ('local', self.scenario(None))):
+            for step, ((wait_ms, requests, tokens), (want_wait, want_requests, want_tokens)) in enumerate(zip(steps, expected)):
+                with self.subTest(backend=backend, step=step):
+                    self.assertAlmostEqual(wait_ms, want_wait, delta=50)
+                    self.assertAlmostEqual(requests, want_requests, delta=0.01)
+                    self.assertAlmostEqual(tokens, want_tokens, delta=2)
+
+    def test_acquire_waits_for_the_shared_bucket(self):
+        from google.api_core import exceptions as google_exceptions
+        with override_settings(GEMINI_RATE_LIMITS={**self.limits, 'REDIS_URL': os.getenv('REDIS_URL')}):
+            try:
+                RateLimiter.acquire('models/tiny', 1_000)
+                self.assertAlmostEqual(RateLimiter.try_acquire('models/tiny', 1_000), 60, delta=0.1)
+                with self.assertRaises(google_exceptions.ResourceExhausted):
+                    RateLimiter.acquire('models/tiny', 1_000)
+                self.assertEqual(RateLimiter.headroom()['tiny']['requests'], 1)
+            finally:
+                RateLimiter._client().delete(RateLimiter._key('tiny'))
@@ -1,4 +1,17 @@
+import json
+import os
+
+from django.conf import settings
+
+from .context_session import ContextSessions
+from .document_processor import DocumentProcessor
+from .extractive_summary import ExtractiveSummarizer
 from .gemini_config import GeminiConfig
+from .llm_metrics import LLMMetrics
+from .map_reduce import ChunkSummaryError, MapReduceSummarizer
+from .parallel_generation import ParallelGeneration
+from .response_parser import FlashcardStreamParser, QAStreamParser
+from .token_budget import PromptPacker, TokenEstimator
 
 # ── Prompt templates ────────────────────────────────────────────────────────
 
@@ -215,9 +228,110 @@ Start immediately with the first TERM (absolutely nothing before it):
 """
 
 
-# ── Processor ────────────────────────────────────────────────────────────────
+# Single-call mode (PremiumAIProcessor.SINGLE_CALL): one JSON document instead of the three
+# prompts above. Only the parts that are wanted are included, and the response schema matches.
+_STUDY_PACK_JSON = """
+You are a friendly university tutor preparing a complete study pack from the notes below for a student,
+in plain, simple English.
 
-import re
+WRITING RULES (follow every single one, in every field):
+- Write as if explaining to a smart friend who has never studied this topic before.
+- After every technical term, add a plain-English explanation in parentheses.
+- NEVER copy a sentence word-for-word from the notes. Always rephrase in your own words.
+- Use real-world analogies and everyday examples wherever possible.
+- Cover EVERY heading and sub-heading from the notes without skipping any.
+{context_rules}
+The study pack has these fields:
+{parts}
+STUDY NOTES (cover every section — page by page, section by section):
+{study_text}
+{context_block}
+Write the study pack now as ONE JSON object with exactly the fields {fields} and nothing else.
+"""
+
+_PACK_SUMMARY_PART = """
+"summary_sections": the study guide, one entry per section of the notes, in order (if the notes have 10 sections, write 10 entries):
+- "heading": the section heading as it appears in the notes
+- "overview": 2-3 plain-English sentences on what the section is about and why it matters
+- "key_concepts": entries with "term" and "explanation" (1-3 sentences, with an analogy if it helps)
+- "why_it_matters": 1-2 sentences on how the topic is used in the real world or why it appears in exams
+"key_terms": the quick-reference table, entries with "term" and "meaning" (one plain-English sentence)
+"""
+
+_PACK_QA_PART = """
+"questions": Generate exactly {num_questions} exam-style questions, entries with "question" and "answer":
+- Use action verbs: "Explain", "Define", "State", "List", "Describe", "Compare", "What is", "Why is", "How does"
+- Be specific, and when the notes mention a specific count (e.g. "5 types of X"), ask for all of them.
+- Spread questions evenly across ALL sections — no more than 2 questions on the same topic.
+- Answers are 2-5 sentences, and never start with "According to the notes" or similar phrases.
+"""
+
+_PACK_FLASHCARD_PART = """
+"flashcards": Generate exactly {num_cards} flashcards on the most important and exam-likely terms, entries with "term" and "definition":
+- The term is a single important concept, acronym, or technique from the notes.
+- The definition is 1-3 conversational sentences with an everyday example, saying WHY it matters.
+- Never use vague openers such as "A concept related to..." or "This refers to...".
+"""
+
+_PACK_CONTEXT_RULES = (
+    "- The past exam questions show which topics the examiner considers most important — give those topics\n"
+    "  extra depth, and model the question style and difficulty on them.\n"
+)
+
+_PACK_CONTEXT_BLOCK = """
+PAST EXAM QUESTIONS (use these to identify which topics need the most depth):
+{context_text}
+"""
+
+
+def _string_fields(*names):
+    """Response schema of an array of objects whose fields are all required strings"""
+    return {
+        "type": "array",
+        "items": {
+            "type": "object",
+            "properties": {name: {"type": "string"} for name in names},
+            "required": list(names),
+        },
+    }
+
+
+def _string_entries(entries, *names):
+    """Entries of a JSON array that have every field as a non-empty string, stripped"""
+    valid = []
+    for entry in entries if isinstance(entries, list) else []:
+        if not isinstance(entry, dict):
+            continue
+        values = {name: entry.get(name).strip() for name in names if isinstance(entry.get(name), str)}
+        if len(values) == len(names) and all(values.values()):
+            valid.append(values)
+    return valid
+
+
+# Response schema properties of each part (see PremiumAIProcessor._study_pack_schema)
+_PACK_SCHEMA_PROPERTIES = {
+    "summary": {
+        "summary_sections": {
+            "type": "array",
+            "items": {
+                "type": "object",
+                "properties": {
+                    "heading": {"type": "string"},
+                    "overview": {"type": "string"},
+                    "key_concepts": _string_fields("term", "explanation"),
+                    "why_it_matters": {"type": "string"},
+                },
+                "required": ["heading", "overview", "key_concepts", "why_it_matters"],
+            },
+        },
+        "key_terms": _string_fields("term", "meaning"),
+    },
+    "qa": {"questions": _string_fields("question", "answer")},
+    "flashcards": {"flashcards": _string_fields("term", "definition")},
+}
+
+
+# ── Processor ────────────────────────────────────────────────────────────────
 
 class PremiumAIProcessor:
     """
@@ -234,6 +348,12 @@ class PremiumAIProcessor:
     NUM_FLASHCARDS = 20
     MAX_STUDY_CHARS   = 200_000
     MAX_CONTEXT_CHARS = 50_000
+    CALL_TIMEOUT      = int(os.getenv('AI_CALL_TIMEOUT', 240))  # seconds per Gemini call
+    TIER              = "premium"  # prompt token budgets: PROMPT_TOKEN_BUDGETS[TIER]
+
+    # Single-call mode asks for the summary, Q&A and flashcards as one schema-constrained JSON
+    # document; a part that is missing or invalid falls back to its own prompt
+    SINGLE_CALL = os.getenv('PREMIUM_SINGLE_CALL', 'false').lower() == 'true'
 
     # ── Lifecycle ─────────────────────────────────────────────────────────
 
@@ -243,8 +363,9 @@ class PremiumAIProcessor:
             return
         try:
             print("Loading Gemini model...")
-            GeminiConfig.configure()
-            cls._model = GeminiConfig.get_model("gemini-2.5-flash")
+            # get_model configures the API key when the real backend is selected
+            # Calls are routed per type and size (MODEL_ROUTING); this is the default model
+            cls._model = GeminiConfig.get_model(settings.MODEL_ROUTING['DEFAULT'][0])
             cls._models_loaded = True
             print("Gemini model loaded successfully!")
         except Exception as e:
@@ -254,29 +375,28 @@ class PremiumAIProcessor:
     # ── Public API ────────────────────────────────────────────────────────
 
     @classmethod
-    def generate_enhanced_content(cls, study_text, past_questions_text=""):
-        """Generate summary and Q&A using Gemini."""
-        if not cls._models_loaded:
-            cls.load_models()
-
-        try:
-            processed_text = cls._preprocess_study_text(study_text)
-
-            if not processed_text or len(processed_text) < 100:
-                return (
-                    "The document doesn't contain enough readable text to process. "
-                    "Please make sure your file has actual content and try again.",
-                    {"total_questions": 0, "qa_pairs": [], "context_used": False},
-                )
-
-            summary = cls._generate_coherent_summary(processed_text, past_questions_text)
-            qa_data = cls._generate_meaningful_questions(processed_text, past_questions_text)
-
-            return summary, qa_data
+    def generate_enhanced_content(cls, study_text, past_questions_text="", chunks=None, on_summary_delta=None):
+        """
+        Generate summary and Q&A using Gemini (both calls run concurrently).
+        With chunks (the whole document split by page range) the summary is built map-reduce
+        so content past MAX_STUDY_CHARS is covered; Q&A still uses study_text.
+        on_summary_delta(text) receives the summary as it streams (single-prompt summaries only).
+        """
+        summary, qa_data, _ = cls._generate_concurrently(
+            study_text, past_questions_text, chunks, with_flashcards=False, on_summary_delta=on_summary_delta
+        )
+        return summary, qa_data
 
-        except Exception as e:
-            error_msg = f"Content generation failed: {str(e)}"
-            return error_msg, {"error": error_msg}
+    @classmethod
+    def generate_study_pack(cls, study_text, past_questions_text="", chunks=None, on_summary_delta=None):
+        """
+        Summary, Q&A and flashcards with the three Gemini calls in flight at once.
+        A failed or timed-out call falls back on its own (e.g. no flashcards) without
+        losing the others. Returns (summary, qa_data, flashcards).
+        """
+        return cls._generate_concurrently(
+            study_text, past_questions_text, chunks, with_flashcards=True, on_summary_delta=on_summary_delta
+        )
 
     @classmethod
     def generate_flashcards(cls, study_text):
@@ -285,19 +405,29 @@ class PremiumAIProcessor:
             cls.load_models()
 
         try:
-            processed_text = cls._preprocess_study_text(study_text)
-            prompt = _FLASHCARD.format(
-                num_cards=cls.NUM_FLASHCARDS,
-                study_text=processed_text[:cls.MAX_STUDY_CHARS],
-            )
-            response = cls._model.generate_content(prompt)
-            if response.text:
-                return cls._parse_flashcards_response(response.text)
-            return []
+            return cls._generate_flashcards(cls._condense_study_text(cls._preprocess_study_text(study_text)))
         except Exception as e:
             print(f"Flashcard generation failed: {str(e)}")
             return []
 
+    @classmethod
+    def collect_study_text(cls, sections):
+        """
+        Pull sections from DocumentProcessor.iter_sections until the prompt budget
+        (MAX_STUDY_CHARS of usable paragraphs) is filled. Pages past that point would
+        be truncated away by the prompts, so they are never extracted.
+        """
+        return DocumentProcessor.collect_sections(sections, cls.MAX_STUDY_CHARS)
+
+    @classmethod
+    def exceeds_prompt_budget(cls, study_text):
+        """True when the usable text is cut off by MAX_STUDY_CHARS or the study token budget (use map-reduce for the summary)"""
+        processed_text = cls._preprocess_study_text(study_text)
+        return (
+            len(processed_text) >= cls.MAX_STUDY_CHARS
+            or TokenEstimator.estimate(processed_text) > settings.PROMPT_TOKEN_BUDGETS[cls.TIER]["STUDY"]
+        )
+
     # ── Private helpers ───────────────────────────────────────────────────
 
     @classmethod
@@ -318,23 +448,257 @@ class PremiumAIProcessor:
         return "\n\n".join(good)  # No cap — send everything
 
     @classmethod
-    def _generate_coherent_summary(cls, study_text, context_text):
-        """Generate a plain-English, section-by-section summary covering the entire document."""
+    def _generate_concurrently(cls, study_text, past_questions_text, chunks, with_flashcards, on_summary_delta=None):
+        if not cls._models_loaded:
+            cls.load_models()
+
+        try:
+            processed_text = cls._preprocess_study_text(study_text)
+
+            if not processed_text or len(processed_text) < 100:
+                return (
+                    "The document doesn't contain enough readable text to process. "
+                    "Please make sure your file has actual content and try again.",
+                    {"total_questions": 0, "qa_pairs": [], "context_used": False},
+                    [],
+                )
+
+            processed_text = cls._condense_study_text(processed_text, past_questions_text)
+
+            # One copy of the notes shared by summary, Q&A and flashcards (uploaded once with context caching)
+            study_notes = cls._pack_study_text(processed_text, "STUDY", past_questions_text)
+            with ContextSessions.open(cls._model, study_notes, label="study notes") as session:
+                prepared = {}
+                if cls.SINGLE_CALL:
+                    # A map-reduce summary is many calls and stays one; flashcards only when asked for
+                    wanted = [name for name, needed in (
+                        ("summary", not chunks), ("qa", True), ("flashcards", with_flashcards),
+                    ) if needed]
+                    prepared = cls._generate_study_pack_json(processed_text, past_questions_text, wanted, session)
+                    if "summary" in prepared and on_summary_delta:
+                        on_summary_delta(prepared["summary"])
+
+                if chunks:
+                    # Map-reduce is many calls, each bounded by CALL_TIMEOUT on its own
+                    summary_call = (
+                        lambda: cls._generate_map_reduce_summary(chunks, past_questions_text),
+                        lambda error: f"Summary generation issue: {error}",
+                        None,
+                    )
+                else:
+                    summary_call = (
+                        lambda: cls._generate_coherent_summary(
+                            processed_text, past_questions_text, on_summary_delta, session
+                        ),
+                        lambda error: f"Summary generation issue: {error}",
+                        cls.CALL_TIMEOUT,
+                    )
+
+                calls = {
+                    "summary": summary_call,
+                    "qa": (
+                        lambda: cls._generate_meaningful_questions(processed_text, past_questions_text, session),
+                        lambda error: {
+                            "error":           f"Q&A generation failed: {error}",
+                            "total_questions": 0,
+                            "context_used":    False,
+                            "qa_pairs":        [],
+                        },
+                        cls.CALL_TIMEOUT,
+                    ),
+                }
+                if with_flashcards:
+                    calls["flashcards"] = (
+                        lambda: cls._generate_flashcards(processed_text, session),
+                        lambda error: [],
+                        cls.CALL_TIMEOUT,
+                    )
+
+                calls = {name: call for name, call in calls.items() if name not in prepared}
+                # Let the task retry on a map-reduce failure; summarised chunks are cached
+                results = ParallelGeneration.run(calls, propagate=(ChunkSummaryError,)) if calls else {}
+                results.update(prepared)
+            return results["summary"], results["qa"], results.get("flashcards", [])
+
+        except ChunkSummaryError:
+            raise
+        except Exception as e:
+            error_msg = f"Content generation failed: {str(e)}"
+            return error_msg, {"error": error_msg}, []
+
+    @classmethod
+    def _generate_content(cls, prompt, session=None, call_type=None):
+        """Single Gemini call on the model routed for call_type (see GeminiConfig.route); gives up after CALL_TIMEOUT"""
+        return GeminiConfig.generate(
+            call_type, cls._model, prompt, session, request_options={"timeout": cls.CALL_TIMEOUT}
+        )
+
+    @classmethod
+    def _generate_study_pack_json(cls, processed_text, context_text, wanted, session=None):
+        """
+        The wanted parts ("summary", "qa", "flashcards") from one JSON-schema call, as the
+        separate generators return them. Parts that are missing or invalid are left out
+        (all of them when the call fails) so the caller generates them the usual way.
+        """
+        parts = {
+            "summary":    _PACK_SUMMARY_PART,
+            "qa":         _PACK_QA_PART.format(num_questions=cls.NUM_QUESTIONS),
+            "flashcards": _PACK_FLASHCARD_PART.format(num_cards=cls.NUM_FLASHCARDS),
+        }
+        schema = cls._study_pack_schema(wanted)
+        prompt = _STUDY_PACK_JSON.format(
+            context_rules=_PACK_CONTEXT_RULES if context_text else "",
+            parts="".join(parts[name] for name in wanted),
+            study_text=cls._study_notes(processed_text, "STUDY", context_text, session),
+            context_block=_PACK_CONTEXT_BLOCK.format(context_text=cls._pack_context_text(context_text))
+            if context_text else "",
+            fields=", ".join(schema["properties"]),
+        )
+
+        try:
+            response = GeminiConfig.generate(
+                "study_pack", cls._model, prompt, session,
+                generation_config={"response_mime_type": "application/json", "response_schema": schema},
+                request_options={"timeout": cls.CALL_TIMEOUT},
+            )
+            prepared = cls._parse_study_pack(response.text, wanted, bool(context_text))
+        except Exception as e:
+            print(f"Single-call generation failed, using separate prompts: {str(e)}")
+            return {}
+
+        missing = [name for name in wanted if name not in prepared]
+        if missing:
+            print(f"Single-call generation is missing {', '.join(missing)}; generating separately")
+        return prepared
+
+    @staticmethod
+    def _study_pack_schema(wanted):
+        properties = {}
+        for name in wanted:
+            properties.update(_PACK_SCHEMA_PROPERTIES[name])
+        return {"type": "object", "properties": properties, "required": list(properties)}
+
+    @classmethod
+    def _parse_study_pack(cls, response_text, wanted, context_used):
+        """The valid wanted parts of a single-call JSON response"""
+        data = json.loads(response_text)
+        if not isinstance(data, dict):
+            raise ValueError("the response is not a JSON object")
+
+        prepared = {}
+        if "summary" in wanted:
+            summary = cls._render_summary(data.get("summary_sections"), data.get("key_terms"))
+            # Same bar as the summary prompt's fallback
+            if len(summary.split()) >= 30:
+                prepared["summary"] = summary
+
+        if "qa" in wanted:
+            entries = _string_entries(data.get("questions"), "question", "answer")[:40]
+            if entries:
+                qa_pairs = [
+                    cls._make_qa(number, entry["question"], [entry["answer"]])
+                    for number, entry in enumerate(entries, 1)
+                ]
+                prepared["qa"] = {
+                    "total_questions": len(qa_pairs),
+                    "context_used":    context_used,
+                    "qa_pairs":        qa_pairs,
+                }
+
+        if "flashcards" in wanted:
+            cards = _string_entries(data.get("flashcards"), "term", "definition")
+            if cards:
+                prepared["flashcards"] = cards
+
+        return prepared
+
+    @staticmethod
+    def _render_summary(sections, key_terms):
+        """The study guide markdown the summary prompt asks for, from its JSON sections"""
+        blocks = []
+        for section in sections if isinstance(sections, list) else []:
+            if not isinstance(section, dict) or not str(section.get("heading") or "").strip():
+                continue
+            concepts = _string_entries(section.get("key_concepts"), "term", "explanation")
+            lines = [f"## {section['heading'].strip()}", "", str(section.get("overview") or "").strip(), ""]
+            if concepts:
+                lines += ["### Key Concepts"]
+                lines += [f"- **{concept['term']}**: {concept['explanation']}" for concept in concepts]
+                lines += [""]
+            why = str(section.get("why_it_matters") or "").strip()
+            if why:
+                lines += ["### Why This Matters", why, ""]
+            blocks.append("\n".join(lines + ["---"]))
+
+        rows = _string_entries(key_terms, "term", "meaning")
+        if blocks and rows:
+            blocks.append("\n".join(
+                ["## Quick Reference: Key Terms", "| Term | What it actually means |", "|------|------------------------|"]
+                + [f"| {row['term']} | {row['meaning']} |" for row in rows]
+            ))
+        return "\n\n".join(blocks)
+
+    @classmethod
+    def _pack_study_text(cls, study_text, budget_name, context_text=""):
+        """Whole paragraphs up to the tier's token budget, those matching past questions first"""
+        budget = settings.PROMPT_TOKEN_BUDGETS[cls.TIER][budget_name]
+        sections = PromptPacker.split_sections(study_text, budget)
+        return PromptPacker.pack(sections, budget, context_text, label=f"{cls.TIER} {budget_name.lower()}")["text"]
+
+    @classmethod
+    def _condense_study_text(cls, processed_text, context_text=""):
+        """
+        The most informative paragraphs of the whole document within the EXTRACT budget, for
+        documents over the STUDY budget; smaller ones are sent whole, as exceeds_prompt_budget assumes.
+        """
+        if not ExtractiveSummarizer.enabled():
+            return processed_text
+        budgets = settings.PROMPT_TOKEN_BUDGETS[cls.TIER]
+        if TokenEstimator.estimate(processed_text) <= budgets["STUDY"]:
+            return processed_text
+        budget = budgets["EXTRACT"]
+        return ExtractiveSummarizer.select(
+            processed_text.split("\n\n"), budget, context_text, label=f"{cls.TIER} study text"
+        )
+
+    @classmethod
+    def _study_notes(cls, study_text, budget_name, context_text="", session=None):
+        """The study-notes field of a prompt: the session's shared context, or the packed text"""
+        if session:
+            return session.reference
+        return cls._pack_study_text(study_text, budget_name, context_text)
+
+    @classmethod
+    def _pack_context_text(cls, context_text):
+        budget = settings.PROMPT_TOKEN_BUDGETS[cls.TIER]["CONTEXT"]
+        sections = PromptPacker.split_sections(context_text, budget)
+        return PromptPacker.pack(sections, budget, label=f"{cls.TIER} past questions")["text"]
+
+    @classmethod
+    def _generate_coherent_summary(cls, study_text, context_text, on_delta=None, session=None):
+        """Generate a plain-English, section-by-section summary covering the entire document. Streams deltas to on_delta when given."""
         try:
             if context_text:
                 prompt = _SUMMARY_WITH_CONTEXT.format(
-                    study_text=study_text[:cls.MAX_STUDY_CHARS],
-                    context_text=context_text[:cls.MAX_CONTEXT_CHARS],
+                    study_text=cls._study_notes(study_text, "STUDY", context_text, session),
+                    context_text=cls._pack_context_text(context_text),
                 )
             else:
                 prompt = _SUMMARY_NO_CONTEXT.format(
-                    study_text=study_text[:cls.MAX_STUDY_CHARS],
+                    study_text=cls._study_notes(study_text, "STUDY", session=session),
                 )
 
-            response = cls._model.generate_content(prompt)
+            if on_delta:
+                # Same prompt and post-processing; the text is the chunks joined
+                text = GeminiConfig.stream(
+                    "summary", cls._model, prompt, on_delta, session,
+                    request_options={"timeout": cls.CALL_TIMEOUT},
+                )
+            else:
+                text = cls._generate_content(prompt, session, "summary").text
 
-            if response.text:
-                summary = response.text.strip()
+            if text:
+                summary = text.strip()
                 if len(summary.split()) < 30:
                     # Fallback: first 10 meaningful sentences
                     sentences = [s.strip() for s in study_text.split(".") if len(s.strip()) > 25]
@@ -347,7 +711,15 @@ class PremiumAIProcessor:
             return f"Summary generation issue: {str(e)}"
 
     @classmethod
-    def _generate_meaningful_questions(cls, study_text, context_text):
+    def _generate_map_reduce_summary(cls, chunks, context_text):
+        """Section-by-section summary of every chunk, merged into one study guide."""
+        summarizer = MapReduceSummarizer(
+            cls._model, cls.MAX_STUDY_CHARS, cls.MAX_CONTEXT_CHARS, request_timeout=cls.CALL_TIMEOUT
+        )
+        return summarizer.summarize(chunks, context_text)
+
+    @classmethod
+    def _generate_meaningful_questions(cls, study_text, context_text, session=None):
         """Generate exam-style Q&A pairs covering the entire document."""
         try:
             num_q = cls.NUM_QUESTIONS
@@ -355,19 +727,19 @@ class PremiumAIProcessor:
             if context_text:
                 prompt = _QA_WITH_CONTEXT.format(
                     num_questions=num_q,
-                    study_text=study_text[:cls.MAX_STUDY_CHARS],
-                    context_text=context_text[:cls.MAX_CONTEXT_CHARS],
+                    study_text=cls._study_notes(study_text, "QA_STUDY", context_text, session),
+                    context_text=cls._pack_context_text(context_text),
                 )
             else:
                 prompt = _QA_NO_CONTEXT.format(
                     num_questions=num_q,
-                    study_text=study_text[:cls.MAX_STUDY_CHARS],
+                    study_text=cls._study_notes(study_text, "QA_STUDY", session=session),
                 )
 
-            response = cls._model.generate_content(prompt)
+            text = cls._generate_content(prompt, session, "qa").text
 
-            if response.text:
-                qa_pairs = cls._parse_qa_response(response.text)
+            if text:
+                qa_pairs = cls._parse_qa_response(text)
                 return {
                     "total_questions": len(qa_pairs),
                     "context_used":    bool(context_text),
@@ -389,42 +761,27 @@ class PremiumAIProcessor:
                 "qa_pairs":        [],
             }
 
+    @classmethod
+    def _generate_flashcards(cls, processed_text, session=None):
+        prompt = _FLASHCARD.format(
+            num_cards=cls.NUM_FLASHCARDS,
+            study_text=cls._study_notes(processed_text, "STUDY", session=session),
+        )
+        text = cls._generate_content(prompt, session, "flashcards").text
+        if text:
+            return cls._parse_flashcards_response(text)
+        return []
+
     @classmethod
     def _parse_qa_response(cls, response_text):
         """
-        Robust regex-based parser.
-
-        Matches only lines that start with Q<number>: or A<number>:
-        This prevents prompt instructions (which also start with letters)
-        from being mistakenly parsed as questions or answers.
+        Q<number>: / A<number>: pairs of a complete response (see QAStreamParser), by number.
+        Only lines that start with a header count, so prompt echoes are never parsed.
         """
-        # Strip bold/italic markers some models add  (**Q1:** → Q1:)
-        text = re.sub(r"\*+", "", response_text)
-
-        question_re = re.compile(
-            r"^Q(\d+)\s*[:\.\)]\s*(.+?)(?=^Q\d+\s*[:\.\)]|^A\d+\s*[:\.\)]|\Z)",
-            re.MULTILINE | re.DOTALL,
-        )
-        answer_re = re.compile(
-            r"^A(\d+)\s*[:\.\)]\s*(.+?)(?=^Q\d+\s*[:\.\)]|^A\d+\s*[:\.\)]|\Z)",
-            re.MULTILINE | re.DOTALL,
-        )
-
-        questions = {int(m.group(1)): m.group(2).strip() for m in question_re.finditer(text)}
-        answers   = {int(m.group(1)): m.group(2).strip() for m in answer_re.finditer(text)}
-
-        pairs = []
-        for idx in sorted(questions):
-            if idx in answers:
-                pairs.append({
-                    "id":         idx,
-                    "question":   questions[idx],
-                    "answer":     answers[idx],
-                    "type":       "concept_based",
-                    "difficulty": "medium",
-                })
+        pairs = sorted(QAStreamParser.parse(response_text), key=lambda pair: pair["id"])
 
         if not pairs:
+            LLMMetrics.fallback("qa")
             pairs = cls._generate_fallback_questions(response_text)
 
         return pairs[:40]
@@ -453,24 +810,7 @@ class PremiumAIProcessor:
     @classmethod
     def _parse_flashcards_response(cls, response_text):
         """
-        Robust regex-based flashcard parser.
-        Matches TERM: and DEFINITION: lines regardless of capitalisation or extra spacing.
+        TERM: / DEFINITION: cards of a complete response (see FlashcardStreamParser).
+        Cards are paired as they are read, so a malformed card never shifts the others.
         """
-        # Strip bold/italic markers
-        text = re.sub(r"\*+", "", response_text)
-
-        term_re = re.compile(r"^TERM\s*:\s*(.+?)$", re.MULTILINE | re.IGNORECASE)
-        def_re  = re.compile(
-            r"^DEFINITION\s*:\s*(.+?)(?=^TERM\s*:|^\s*$\Z)",
-            re.MULTILINE | re.DOTALL | re.IGNORECASE,
-        )
-
-        terms       = [m.group(1).strip() for m in term_re.finditer(text)]
-        definitions = [m.group(1).strip() for m in def_re.finditer(text)]
-
-        flashcards = []
-        for term, definition in zip(terms, definitions):
-            if term and definition:
-                flashcards.append({"term": term, "definition": definition})
-
-        return flashcards
\ No newline at end of file
+        return FlashcardStreamParser.parse(response_text)
\ No newline at end of file
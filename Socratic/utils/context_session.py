@@ -0,0 +1,140 @@
+import contextlib
+import datetime
+import hashlib
+import threading
+
+import google.generativeai as genai
+from django.conf import settings
+from google.generativeai import caching
+
+from .llm_cache import CachedModel
+from .rate_limiter import RateLimiter
+from .token_budget import TokenEstimator
+
+
+class ContextSession:
+    """
+    Shared context for every prompt about one document (the packed study notes, or the
+    summary for quiz prompts). Prompts put `reference` where the context text would go and
+    are sent to `model`.
+
+    This base class is the local stand-in: reference is the context itself and model the
+    processor's model, i.e. exactly the inline prompts. Use as a context manager.
+    """
+
+    # Prompts must go to this session's model (GeminiConfig routing leaves them alone)
+    pinned = False
+
+    def __init__(self, model, context_text, label):
+        self.model = model
+        self.context_text = context_text
+        self.label = label
+        self.tokens = TokenEstimator.estimate(context_text)
+        self.calls = 0
+
+    @property
+    def reference(self):
+        self.calls += 1
+        return self.context_text
+
+    @contextlib.contextmanager
+    def in_use(self):
+        """Wraps each model call made with the session (GeminiConfig.generate and stream)"""
+        yield
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        return False
+
+
+class GeminiContextSession(ContextSession):
+    """
+    Gemini context caching: the context is uploaded once as CachedContent and prompts only carry
+    a short reference to it, so each call sends (and is billed for) the instructions alone.
+    The cache expires after TTL seconds and is deleted when the session closes, or, if calls
+    that overran their timeout are still running with it, when the last of them finishes.
+    """
+
+    REFERENCE = "[The complete {label} are provided in the context above. Use all of them.]"
+
+    # The cached context belongs to the model it was created for
+    pinned = True
+
+    def __init__(self, model, context_text, label):
+        super().__init__(model, context_text, label)
+        self.active = 0
+        self.closed = False
+        self.lock = threading.Lock()
+        config = settings.CONTEXT_SESSIONS
+        self.cached_content = caching.CachedContent.create(
+            model=model.model_name,
+            display_name=label[:128],
+            contents=[context_text],
+            ttl=datetime.timedelta(seconds=config['TTL']),
+        )
+        # The context digest keeps LLMResponseCache keys apart: prompts no longer contain the text
+        digest = hashlib.sha256(context_text.encode('utf-8')).hexdigest()
+        self.model = CachedModel(
+            RateLimiter.wrap(genai.GenerativeModel.from_cached_content(self.cached_content)), context_key=digest
+        )
+        print(f"Context session ({label}): ~{self.tokens} tokens uploaded once as {self.cached_content.name}")
+
+    @property
+    def reference(self):
+        self.calls += 1
+        return self.REFERENCE.format(label=self.label)
+
+    @contextlib.contextmanager
+    def in_use(self):
+        with self.lock:
+            self.active += 1
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.active -= 1
+                last = self.closed and self.active == 0
+            if last:
+                self._delete()
+
+    def close(self):
+        print(f"Context session ({self.label}) closed after {self.calls} prompts (~{self.tokens * self.calls} tokens not resent)")
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            running = self.active
+        if running:
+            print(f"Context session ({self.label}): {running} calls still running, cache deleted after the last one")
+        else:
+            self._delete()
+
+    def _delete(self):
+        try:
+            self.cached_content.delete()
+        except Exception as e:
+            print(f"Context cache delete failed (expires on its own): {str(e)}")
+
+
+class ContextSessions:
+    """Open the session type selected by CONTEXT_SESSIONS['BACKEND'] ('gemini' or 'inline')"""
+
+    @staticmethod
+    def open(model, context_text, label="study notes"):
+        config = settings.CONTEXT_SESSIONS
+        # Fake, record and replay backends keep prompts self-contained (cassettes match on prompt text)
+        real_api = settings.LLM_BACKEND['BACKEND'] == 'gemini'
+        if config['BACKEND'] == 'gemini' and real_api and hasattr(model, 'model_name'):
+            # Below the provider minimum a cache cannot be created (and would not pay off)
+            if TokenEstimator.estimate(context_text) >= config['MIN_TOKENS']:
+                try:
+                    return GeminiContextSession(model, context_text, label)
+                except Exception as e:
+                    print(f"Context caching unavailable, sending {label} inline: {str(e)}")
+        return ContextSession(model, context_text, label)
@@ -1,36 +1,129 @@
 import fitz  # PyMuPDF
 from PIL import Image
+import io
+import logging
+import mmap
+import multiprocessing
 import os
 import re
+import tempfile
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
 from docx import Document
-import requests
+from .docx_stream import DocxStream
+from .ocr_backends import get_ocr_backend
+
+logger = logging.getLogger(__name__)
+
+# PDF pool workers are started clean (forkserver, else spawn), never forked from the Celery worker:
+# it already runs the GeminiClient loop and generation threads, and a forked child can deadlock
+# on a lock one of them held. Clean workers cannot inherit the document, so they get a file path.
+_PDF_POOL_CONTEXT = multiprocessing.get_context(
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+)
+
+
+def _compile_family(patterns, flags=0):
+    """Merge a pattern family into a single alternation so each line is scanned once"""
+    return re.compile('|'.join(f'(?:{pattern})' for pattern in patterns), flags)
+
+
+# ── Line classification ──────────────────────────────────────────────────────
+
+LINE_TOC_START = 'toc_start'
+LINE_TOC = 'toc'
+LINE_NOISE = 'noise'
+LINE_HEADER = 'header'
+LINE_CONTENT = 'content'
+
+# TOC heading that switches the filter into skip mode
+_TOC_START_RE = re.compile(r'contents?|table of contents?|index', re.IGNORECASE)
+
+# Lines that belong to a table of contents
+_TOC_LINE_RE = _compile_family([
+    r'\.\.\.\s*\d+$',
+    r'^\d+\.\d*\s',
+    r'^\s*\w+\s+\.\.\.\s*\d+',
+    r'^page\s+\d+',
+    r'^\d+\s*$',
+], re.IGNORECASE)
+
+# Clear non-content
+_NON_CONTENT_RE = _compile_family([
+    r'^\.\.\.\s*\d+$', r'^\d+\s*$', r'^page\s+\d+', r'^pg\.?\s*\d+',
+    r'^copyright', r'^confidential', r'^\d+/\d+/\d+', r'^version\s+\d',
+    r'^=====', r'^\*\*\*\*\*', r'^------', r'^–––––',  # Page separators
+    r'^figure\s+\d+', r'^table\s+\d+', r'^fig\.\s*\d+',  # Figure/table captions
+], re.IGNORECASE)
+
+# Comprehensive patterns for section headers (case-sensitive)
+_HEADER_RE = _compile_family([
+    # Unit patterns
+    r'^UNIT\s+\d+',
+    r'^Unit\s+\d+',
+    # Chapter patterns
+    r'^CHAPTER\s+\d+',
+    r'^Chapter\s+\d+',
+    r'^CH\.?\s*\d+',
+    # Numbered sections (1, 1.1, 1.1.1, etc.)
+    r'^\d+\.\d+(\.\d+)*\s+[A-Za-z]',
+    r'^\d+\.\s+[A-Za-z]',
+    r'^\d+\s+[A-Za-z]',
+    # Roman numerals
+    r'^(I|II|III|IV|V|VI|VII|VIII|IX|X|XI|XII)\.?\s+[A-Za-z]',
+    r'^(i|ii|iii|iv|v|vi|vii|viii|ix|x|xi|xii)\.?\s+[A-Za-z]',
+    # Lettered sections (A, B, C, etc.)
+    r'^[A-Z]\.\s+[A-Za-z]',
+    r'^[a-z]\.\s+[A-Za-z]',
+    # Substantial title lines (multiple words, proper capitalization)
+    r'^[A-Z][A-Za-z]+(\s+[A-Za-z]+){2,}.*$',
+    # ALL CAPS meaningful headers (but not too short)
+    r'^[A-Z][A-Z\s]{10,}$',
+])
+
+# Lines that look like references or captions
+_REFERENCE_RE = _compile_family([
+    r'^(Figure|Table|Fig\.|Table|Equation)\s+\d+',
+    r'^\[\d+\]',  # Citation
+    r'^References?$',
+    r'^Bibliography$',
+], re.IGNORECASE)
+
 
 class DocumentProcessor:
     """
     Enhanced text extraction with comprehensive structural analysis
     Now using PyMuPDF (fitz) for superior PDF extraction
     """
+
+    # Bump whenever extraction output changes so cached extractions are not reused
+    EXTRACTOR_VERSION = 2
+
+    # Parallel PDF extraction: page shards are spread over a process pool.
+    # Documents below PDF_PARALLEL_MIN_PAGES stay serial (pool start-up dominates).
+    PDF_WORKERS = int(os.getenv('PDF_EXTRACT_WORKERS', os.cpu_count() or 1))
+    PDF_SHARD_SIZE = int(os.getenv('PDF_EXTRACT_SHARD_SIZE', 25))
+    PDF_PARALLEL_MIN_PAGES = int(os.getenv('PDF_PARALLEL_MIN_PAGES', 60))
+
+    # Scanned PDFs: pages with an image but fewer than PDF_OCR_MIN_CHARS characters of text layer
+    # are rendered (at most PDF_OCR_DPI, PDF_OCR_MAX_SIDE pixels) and OCR'd PDF_OCR_BATCH_SIZE at a time
+    PDF_OCR_ENABLED = os.getenv('PDF_OCR_ENABLED', 'true').lower() == 'true'
+    PDF_OCR_MIN_CHARS = int(os.getenv('PDF_OCR_MIN_CHARS', 25))
+    PDF_OCR_DPI = int(os.getenv('PDF_OCR_DPI', 200))
+    PDF_OCR_MAX_SIDE = int(os.getenv('PDF_OCR_MAX_SIDE', 3000))
+    PDF_OCR_BATCH_SIZE = int(os.getenv('PDF_OCR_BATCH_SIZE', 8))
     
     @staticmethod
-    def extract_text_from_pdf(file_path):
-        """Extract coherent text from PDF with structural preservation using PyMuPDF"""
+    def extract_text_from_pdf(source, workers=None, shard_size=None):
+        """
+        Extract coherent text from PDF with structural preservation using PyMuPDF.
+        source is a file path or an in-memory / spooled binary file object.
+        """
         try:
-            # Open PDF with PyMuPDF
-            doc = fitz.open(file_path)
-            full_text = ""
-            
-            # Extract text from all pages with better structure preservation
-            for page_num in range(len(doc)):
-                page = doc[page_num]
-                # Extract text with layout preservation
-                page_text = page.get_text("text")
-                if page_text:
-                    full_text += page_text + "\n"
-            
-            doc.close()
-            
-            # Reconstruct paragraphs and filter non-content
-            processed_text = DocumentProcessor._reconstruct_paragraphs(full_text)
+            # Reconstruct paragraphs (per page shard) and filter non-content
+            processed_text = DocumentProcessor._read_pdf_paragraphs(source, workers, shard_size)
             meaningful_content = DocumentProcessor._extract_meaningful_sections(processed_text)
 
             # Fallback: if filtering removed too much, return processed text
@@ -43,39 +136,494 @@ class DocumentProcessor:
             raise Exception(f"PDF extraction failed: {str(e)}")
     
     @staticmethod
-    def extract_text_from_pdf_chunked(file_path, chunk_size=50):
+    def _read_pdf_paragraphs(source, workers=None, shard_size=None):
+        """
+        Read every page and reconstruct paragraphs shard by shard.
+        Output is identical to running _reconstruct_paragraphs over the whole document.
+        """
+        workers = workers or DocumentProcessor.PDF_WORKERS
+        shard_size = shard_size or DocumentProcessor.PDF_SHARD_SIZE
+
+        with DocumentProcessor._pdf_source(source) as pdf_source:
+            doc = DocumentProcessor._open_pdf(pdf_source)
+            try:
+                page_count = len(doc)
+                shards = None
+
+                if (workers > 1 and page_count > shard_size
+                        and page_count >= DocumentProcessor.PDF_PARALLEL_MIN_PAGES):
+                    shards = DocumentProcessor._extract_pdf_shards_parallel(
+                        pdf_source, page_count, workers, shard_size
+                    )
+
+                if shards is None:
+                    shards = [DocumentProcessor._extract_pdf_shard(doc, 0, page_count)]
+
+                scanned_pages = [page_num for shard in shards for page_num in shard['scanned']]
+                if scanned_pages:
+                    ocr_texts = DocumentProcessor._ocr_pdf_pages(doc, scanned_pages)
+                    shards = [DocumentProcessor._apply_pdf_ocr(shard, ocr_texts) for shard in shards]
+            finally:
+                doc.close()
+
+        return DocumentProcessor._merge_pdf_shards(shards)
+
+    @staticmethod
+    @contextmanager
+    def _pdf_source(source):
+        """
+        Yield something PyMuPDF can open without copying the document: the path
+        itself, or a memoryview over an in-memory buffer or memory-mapped temp file.
+        """
+        if isinstance(source, (str, os.PathLike)):
+            yield source
+            return
+
+        source.seek(0)
+        if hasattr(source, 'getbuffer'):
+            with source.getbuffer() as view:
+                yield view
+        else:
+            with mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ) as mapped, memoryview(mapped) as view:
+                yield view
+
+    @staticmethod
+    @contextmanager
+    def _pdf_worker_path(pdf_source):
+        """A path pool workers can open: the source path, or a temp copy of an in-memory document"""
+        if not isinstance(pdf_source, memoryview):
+            yield pdf_source
+            return
+
+        with tempfile.NamedTemporaryFile(suffix='.pdf', delete=False) as copy:
+            copy.write(pdf_source)
+        try:
+            yield copy.name
+        finally:
+            os.unlink(copy.name)
+
+    @staticmethod
+    def _open_pdf(pdf_source):
+        """Open a path or memoryview from _pdf_source"""
+        if isinstance(pdf_source, memoryview):
+            return fitz.open(stream=pdf_source, filetype="pdf")
+        return fitz.open(pdf_source)
+
+    @staticmethod
+    def _extract_pdf_shards_parallel(pdf_source, page_count, workers, shard_size):
+        """Extract page ranges in a process pool; returns None so the caller can fall back to serial"""
+        ranges = [
+            (start_page, min(start_page + shard_size, page_count))
+            for start_page in range(0, page_count, shard_size)
+        ]
+        try:
+            with DocumentProcessor._pdf_worker_path(pdf_source) as pdf_path, ProcessPoolExecutor(
+                max_workers=min(workers, len(ranges)),
+                mp_context=_PDF_POOL_CONTEXT,
+                initializer=_init_pdf_worker,
+                initargs=(pdf_path,),
+            ) as pool:
+                starts, ends = zip(*ranges)
+                shards = list(pool.map(_extract_pdf_shard_in_worker, starts, ends))
+            print(f"Parallel PDF extraction: {page_count} pages in {len(ranges)} shards")
+            return shards
+        except Exception:
+            logger.exception("Parallel PDF extraction failed, falling back to serial")
+            return None
+
+    @staticmethod
+    def _extract_pdf_shard(doc, start_page, end_page, keep_pages=False):
+        """
+        Extract raw and paragraph-reconstructed text for pages [start_page, end_page).
+        With keep_pages the raw (page_num, page_text) pairs are returned for streaming instead.
+        'scanned' lists the 1-based pages that need OCR; their pairs are kept so OCR text can be merged in.
+        """
+        page_texts = []
+        scanned = []
+        for page_num in range(start_page, end_page):
+            page = doc[page_num]
+            page_text = page.get_text("text")
+            if DocumentProcessor.PDF_OCR_ENABLED and DocumentProcessor._needs_ocr(page, page_text):
+                scanned.append(page_num + 1)
+            if page_text:
+                page_texts.append((page_num + 1, page_text + "\n"))
+
+        if keep_pages:
+            return {'pages': page_texts, 'scanned': scanned}
+
+        return DocumentProcessor._build_pdf_shard(page_texts, scanned)
+
+    @staticmethod
+    def _build_pdf_shard(page_texts, scanned=()):
+        raw_text = "".join(page_text for _, page_text in page_texts)
+        return {
+            'raw': raw_text,
+            'text': DocumentProcessor._reconstruct_paragraphs(raw_text),
+            'clean_tail': DocumentProcessor._ends_with_paragraph_break(raw_text),
+            'scanned': list(scanned),
+            'pages': page_texts if scanned else None,
+        }
+
+    @staticmethod
+    def _needs_ocr(page, page_text):
+        """A page is image-only when it carries an image but (almost) no text layer"""
+        if len("".join(page_text.split())) >= DocumentProcessor.PDF_OCR_MIN_CHARS:
+            return False
+        return bool(page.get_images())
+
+    @staticmethod
+    def _apply_pdf_ocr(shard, ocr_texts):
+        """Rebuild a shard with OCR text in place of the text layer of its scanned pages"""
+        replaced = [page_num for page_num in shard['scanned'] if page_num in ocr_texts]
+        if not replaced:
+            return shard
+        page_texts = dict(shard['pages'])
+        page_texts.update((page_num, ocr_texts[page_num]) for page_num in replaced)
+        return DocumentProcessor._build_pdf_shard(sorted(page_texts.items()))
+
+    @staticmethod
+    def _ocr_pdf_pages(doc, page_nums):
+        """
+        Render the given 1-based pages and OCR them in batches through the configured backend.
+        Returns {page_num: text}; pages that fail or come back empty keep their text layer.
+        """
+        ocr_texts = {}
+        batch_size = DocumentProcessor.PDF_OCR_BATCH_SIZE
+        try:
+            backend = get_ocr_backend()
+            for start in range(0, len(page_nums), batch_size):
+                batch = page_nums[start:start + batch_size]
+                images = [DocumentProcessor._render_pdf_page(doc[page_num - 1]) for page_num in batch]
+                for page_num, text in zip(batch, backend.recognize_batch(images, 'PNG')):
+                    if text.strip():
+                        ocr_texts[page_num] = text + "\n"
+            print(f"OCR'd {len(page_nums)} image-only PDF pages ({backend.name})")
+        except Exception as e:
+            print(f"Scanned page OCR failed after {len(ocr_texts)} pages, keeping the text layer: {str(e)}")
+        return ocr_texts
+
+    @staticmethod
+    def _render_pdf_page(page):
+        """Render a page to a grayscale PNG buffer at PDF_OCR_DPI, capped at PDF_OCR_MAX_SIDE pixels"""
+        zoom = min(
+            DocumentProcessor.PDF_OCR_DPI / 72,
+            DocumentProcessor.PDF_OCR_MAX_SIDE / max(page.rect.width, page.rect.height),
+        )
+        pixmap = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom), colorspace=fitz.csGRAY, alpha=False)
+        pixmap.set_dpi(round(72 * zoom), round(72 * zoom))
+        return io.BytesIO(pixmap.tobytes("png"))
+
+    @staticmethod
+    def _ends_with_paragraph_break(raw_text):
+        """
+        True when raw_text ends on a blank line, so _reconstruct_paragraphs of the
+        following text starts from the same state (no open paragraph or hyphenation).
+        """
+        text = raw_text.replace('\r\n', '\n').replace('\r', '\n')
+        tail = text.rsplit('\n', 2)
+        return len(tail) == 3 and tail[2] == '' and not tail[1].strip()
+
+    @staticmethod
+    def _merge_pdf_shards(shards):
+        """Join per-shard paragraphs in page order, re-running shards that do not end on a paragraph break"""
+        parts = []
+        pending = []
+
+        for shard in shards:
+            if not shard['raw']:
+                continue
+            if pending:
+                pending.append(shard['raw'])
+                if shard['clean_tail']:
+                    parts.append(DocumentProcessor._reconstruct_paragraphs(''.join(pending)))
+                    pending = []
+            elif shard['clean_tail']:
+                parts.append(shard['text'])
+            else:
+                pending.append(shard['raw'])
+
+        if pending:
+            parts.append(DocumentProcessor._reconstruct_paragraphs(''.join(pending)))
+
+        return '\n'.join(part for part in parts if part)
+
+    @staticmethod
+    def iter_sections(source, file_type):
+        """
+        Stream cleaned sections with page provenance while the file is being read.
+        Yields dicts with 'text', 'page_range' and 'char_count'; joined with blank
+        lines they match extract_text. Stop iterating to stop extraction early.
+        """
+        file_type = file_type.upper()
+        
+        if file_type in ['PDF']:
+            return DocumentProcessor._iter_sections_from_chunks(DocumentProcessor._iter_pdf_pages(source))
+        elif file_type in ['DOCX', 'DOC']:
+            return DocumentProcessor._iter_sections_from_chunks(DocumentProcessor._iter_docx_chunks(source))
+        elif file_type in ['JPG', 'JPEG', 'PNG', 'BMP', 'TIFF']:
+            return DocumentProcessor._iter_sections_from_chunks(
+                DocumentProcessor._iter_image_chunks(source, file_type), fallback=False
+            )
+        else:
+            raise ValueError(f"Unsupported file type: {file_type}")
+
+    @staticmethod
+    def collect_sections(sections, max_usable_chars):
+        """
+        Join iter_sections output until max_usable_chars of usable paragraphs (80+ characters
+        and 12+ words, the ones the AI processors keep) are collected; stopping early stops
+        extraction, so pages past that point are never read.
+        """
+        texts = []
+        usable_chars = 0
+
+        for section in sections:
+            texts.append(section["text"])
+            for paragraph in section["text"].split("\n\n"):
+                paragraph = paragraph.strip()
+                if len(paragraph) >= 80 and len(paragraph.split()) >= 12:
+                    # Length of the "\n\n"-joined text the processors' _preprocess_study_text builds
+                    usable_chars += len(paragraph) + (2 if usable_chars else 0)
+            if usable_chars >= max_usable_chars:
+                break
+
+        return "\n\n".join(texts)
+
+    @staticmethod
+    def _iter_sections_from_chunks(chunks, fallback=True):
+        """
+        Run (page_num, raw_text) chunks through reconstruction and the section filter.
+        With fallback, sections are held back until they add up to 100 characters so the
+        "filtering removed too much" fallback of the batch extractors still applies.
+        """
+        lines = DocumentProcessor._iter_reconstructed_lines(chunks)
+        
+        if not fallback:
+            for text, pages in DocumentProcessor._iter_meaningful_sections(lines):
+                yield DocumentProcessor._make_section(text, pages)
+            return
+        
+        released = False
+        seen_lines = []
+        held = []
+        
+        def remember(source):
+            for line, pages in source:
+                if not released:
+                    seen_lines.append((line, pages))
+                yield line, pages
+        
+        for text, pages in DocumentProcessor._iter_meaningful_sections(remember(lines)):
+            if released:
+                yield DocumentProcessor._make_section(text, pages)
+                continue
+            
+            held.append((text, pages))
+            if len('\n\n'.join(held_text for held_text, _ in held).strip()) >= 100:
+                released = True
+                seen_lines.clear()
+                for held_text, held_pages in held:
+                    yield DocumentProcessor._make_section(held_text, held_pages)
+                held.clear()
+        
+        if released:
+            return
+        
+        # Fallback: if filtering removed too much, emit the processed text
+        processed_text = '\n'.join(line for line, _ in seen_lines).strip()
+        if len(processed_text) > 100:
+            pages = DocumentProcessor._span_pages(seen_lines[0][1], seen_lines[-1][1])
+            yield DocumentProcessor._make_section(processed_text, pages)
+            return
+        
+        for held_text, held_pages in held:
+            yield DocumentProcessor._make_section(held_text, held_pages)
+
+    @staticmethod
+    def _make_section(text, pages):
+        text = text.strip()
+        return {
+            'text': text,
+            'page_range': f"{pages[0]}-{pages[1]}" if pages else None,
+            'char_count': len(text),
+        }
+
+    @staticmethod
+    def _iter_reconstructed_lines(chunks):
+        """
+        Reconstruct paragraphs incrementally, yielding (line, pages).
+        Chunks are buffered only until the text ends on a paragraph break, so the
+        lines are identical to _reconstruct_paragraphs over the whole text.
+        """
+        pending = []
+        first_page = last_page = None
+        
+        for page_num, raw_text in chunks:
+            if not raw_text:
+                continue
+            if not pending:
+                first_page = page_num
+            pending.append(raw_text)
+            last_page = page_num
+            
+            if DocumentProcessor._ends_with_paragraph_break(raw_text):
+                yield from DocumentProcessor._tag_lines(''.join(pending), first_page, last_page)
+                pending = []
+        
+        if pending:
+            yield from DocumentProcessor._tag_lines(''.join(pending), first_page, last_page)
+
+    @staticmethod
+    def _tag_lines(raw_text, first_page, last_page):
+        pages = (first_page, last_page) if first_page is not None else None
+        processed_text = DocumentProcessor._reconstruct_paragraphs(raw_text)
+        if processed_text:
+            for line in processed_text.split('\n'):
+                yield line, pages
+
+    @staticmethod
+    def _iter_pdf_pages(source, workers=None, shard_size=None):
+        """Yield (page_num, page_text) for every non-empty page, 1-based, in page order"""
+        workers = workers or DocumentProcessor.PDF_WORKERS
+        shard_size = shard_size or DocumentProcessor.PDF_SHARD_SIZE
+        
+        with DocumentProcessor._pdf_source(source) as pdf_source:
+            doc = DocumentProcessor._open_pdf(pdf_source)
+            try:
+                yield from DocumentProcessor._ocr_scanned_pages(
+                    doc, DocumentProcessor._iter_pdf_page_stream(doc, pdf_source, workers, shard_size)
+                )
+            finally:
+                doc.close()
+
+    @staticmethod
+    def _iter_pdf_page_stream(doc, pdf_source, workers, shard_size):
+        """Yield (page_num, page_text, scanned) for pages with text or needing OCR"""
+        page_count = len(doc)
+        next_page = 0
+        
+        if (workers > 1 and page_count > shard_size
+                and page_count >= DocumentProcessor.PDF_PARALLEL_MIN_PAGES):
+            try:
+                for page in DocumentProcessor._iter_pdf_pages_parallel(pdf_source, page_count, workers, shard_size):
+                    next_page = page[0]
+                    yield page
+                return
+            except Exception:
+                logger.exception("Parallel PDF streaming failed at page %d, continuing serially", next_page + 1)
+        
+        for page_num in range(next_page, page_count):
+            yield from DocumentProcessor._iter_shard_pages(
+                DocumentProcessor._extract_pdf_shard(doc, page_num, page_num + 1, keep_pages=True)
+            )
+
+    @staticmethod
+    def _iter_shard_pages(shard):
+        """Flatten a keep_pages shard into (page_num, page_text, scanned) in page order"""
+        page_texts = dict(shard['pages'])
+        scanned = set(shard['scanned'])
+        for page_num in sorted(page_texts.keys() | scanned):
+            yield page_num, page_texts.get(page_num, ""), page_num in scanned
+
+    @staticmethod
+    def _ocr_scanned_pages(doc, pages):
+        """
+        Pass text pages straight through and OCR scanned ones PDF_OCR_BATCH_SIZE at a time.
+        Pages after a scanned page wait for its batch so output stays in page order.
+        """
+        pending = []
+        waiting = 0
+        
+        for page_num, page_text, scanned in pages:
+            if not scanned and not pending:
+                if page_text:
+                    yield page_num, page_text
+                continue
+            
+            pending.append((page_num, page_text, scanned))
+            waiting += scanned
+            if waiting >= DocumentProcessor.PDF_OCR_BATCH_SIZE:
+                yield from DocumentProcessor._flush_ocr_pages(doc, pending)
+                pending, waiting = [], 0
+        
+        if pending:
+            yield from DocumentProcessor._flush_ocr_pages(doc, pending)
+
+    @staticmethod
+    def _flush_ocr_pages(doc, pending):
+        ocr_texts = DocumentProcessor._ocr_pdf_pages(doc, [page_num for page_num, _, scanned in pending if scanned])
+        for page_num, page_text, _ in pending:
+            page_text = ocr_texts.get(page_num, page_text)
+            if page_text:
+                yield page_num, page_text
+
+    @staticmethod
+    def _iter_pdf_pages_parallel(pdf_source, page_count, workers, shard_size):
+        """Read shards ahead in a process pool, keeping at most `workers` shards in flight"""
+        ranges = iter([
+            (start_page, min(start_page + shard_size, page_count))
+            for start_page in range(0, page_count, shard_size)
+        ])
+        with DocumentProcessor._pdf_worker_path(pdf_source) as pdf_path:
+            yield from DocumentProcessor._iter_pdf_shards_in_pool(pdf_path, ranges, workers)
+
+    @staticmethod
+    def _iter_pdf_shards_in_pool(pdf_path, ranges, workers):
+        """Shards of pdf_path in order, at most `workers` of them read ahead"""
+        pool = ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=_PDF_POOL_CONTEXT,
+            initializer=_init_pdf_worker,
+            initargs=(pdf_path,),
+        )
+        try:
+            in_flight = deque(
+                pool.submit(_extract_pdf_shard_in_worker, start_page, end_page, True)
+                for start_page, end_page in islice(ranges, workers)
+            )
+            while in_flight:
+                shard = in_flight.popleft().result()
+                for start_page, end_page in islice(ranges, 1):
+                    in_flight.append(pool.submit(_extract_pdf_shard_in_worker, start_page, end_page, True))
+                yield from DocumentProcessor._iter_shard_pages(shard)
+        finally:
+            # Consumer stopped pulling (or a worker failed): drop shards not started yet
+            pool.shutdown(wait=False, cancel_futures=True)
+
+    @staticmethod
+    def extract_text_from_pdf_chunked(source, chunk_size=50):
         """
         Extract text from large PDFs in chunks by page ranges
         Returns a list of text chunks for processing large documents
         """
         try:
-            doc = fitz.open(file_path)
-            total_pages = len(doc)
-            chunks = []
-            
-            # Process in chunks
-            for start_page in range(0, total_pages, chunk_size):
-                end_page = min(start_page + chunk_size, total_pages)
-                chunk_text = ""
-                
-                for page_num in range(start_page, end_page):
-                    page = doc[page_num]
-                    page_text = page.get_text("text")
-                    if page_text:
-                        chunk_text += page_text + "\n"
+            with DocumentProcessor._pdf_source(source) as pdf_source:
+                doc = DocumentProcessor._open_pdf(pdf_source)
+                total_pages = len(doc)
+                chunks = []
                 
-                # Process chunk
-                processed_chunk = DocumentProcessor._reconstruct_paragraphs(chunk_text)
-                meaningful_chunk = DocumentProcessor._extract_meaningful_sections(processed_chunk)
+                # Process in chunks
+                for start_page in range(0, total_pages, chunk_size):
+                    end_page = min(start_page + chunk_size, total_pages)
+                    shard = DocumentProcessor._extract_pdf_shard(doc, start_page, end_page)
+                    if shard['scanned']:
+                        shard = DocumentProcessor._apply_pdf_ocr(
+                            shard, DocumentProcessor._ocr_pdf_pages(doc, shard['scanned'])
+                        )
+                    chunk_text = shard['raw']
+                    
+                    # Process chunk
+                    processed_chunk = DocumentProcessor._reconstruct_paragraphs(chunk_text)
+                    meaningful_chunk = DocumentProcessor._extract_meaningful_sections(processed_chunk)
+                    
+                    if meaningful_chunk and len(meaningful_chunk.strip()) > 100:
+                        chunks.append({
+                            'text': meaningful_chunk.strip(),
+                            'page_range': f"{start_page + 1}-{end_page}",
+                            'char_count': len(meaningful_chunk)
+                        })
                 
-                if meaningful_chunk and len(meaningful_chunk.strip()) > 100:
-                    chunks.append({
-                        'text': meaningful_chunk.strip(),
-                        'page_range': f"{start_page + 1}-{end_page}",
-                        'char_count': len(meaningful_chunk)
-                    })
-            
-            doc.close()
+                doc.close()
             return chunks
                 
         except Exception as e:
@@ -87,116 +635,97 @@ class DocumentProcessor:
         if not text:
             return ""
         
-        lines = text.split('\n')
-        sections = []
+        lines = ((line, None) for line in text.split('\n'))
+        return '\n\n'.join(section for section, _ in DocumentProcessor._iter_meaningful_sections(lines))
+    
+    @staticmethod
+    def _iter_meaningful_sections(lines):
+        """
+        Yield (section_text, pages) as soon as each meaningful section closes.
+        lines is an iterable of (line, pages) where pages is a (first, last) page tuple or None.
+        """
         current_section = []
         current_header = None
+        section_pages = None
         in_toc = False
         
-        # Comprehensive patterns for section headers
-        header_patterns = [
-            # Unit patterns
-            r'^UNIT\s+\d+',
-            r'^Unit\s+\d+',
-            # Chapter patterns
-            r'^CHAPTER\s+\d+',
-            r'^Chapter\s+\d+',
-            r'^CH\.?\s*\d+',
-            # Numbered sections (1, 1.1, 1.1.1, etc.)
-            r'^\d+\.\d+(\.\d+)*\s+[A-Za-z]',
-            r'^\d+\.\s+[A-Za-z]',
-            r'^\d+\s+[A-Za-z]',
-            # Roman numerals
-            r'^(I|II|III|IV|V|VI|VII|VIII|IX|X|XI|XII)\.?\s+[A-Za-z]',
-            r'^(i|ii|iii|iv|v|vi|vii|viii|ix|x|xi|xii)\.?\s+[A-Za-z]',
-            # Lettered sections (A, B, C, etc.)
-            r'^[A-Z]\.\s+[A-Za-z]',
-            r'^[a-z]\.\s+[A-Za-z]',
-            # Substantial title lines (multiple words, proper capitalization)
-            r'^[A-Z][A-Za-z]+(\s+[A-Za-z]+){2,}.*$',
-            # ALL CAPS meaningful headers (but not too short)
-            r'^[A-Z][A-Z\s]{10,}$',
-        ]
-        
-        # TOC detection patterns
-        toc_patterns = [
-            r'contents?|table of contents?|index',
-            r'^\s*(page|pg\.?)\s*\d+',
-            r'\.\.\.\s*\d+$'
-        ]
-        
-        # Clear non-content patterns
-        non_content_patterns = [
-            r'^\.\.\.\s*\d+$', r'^\d+\s*$', r'^page\s+\d+', r'^pg\.?\s*\d+',
-            r'^copyright', r'^confidential', r'^\d+/\d+/\d+', r'^version\s+\d',
-            r'^=====', r'^\*\*\*\*\*', r'^------', r'^–––––',  # Page separators
-            r'^figure\s+\d+', r'^table\s+\d+', r'^fig\.\s*\d+',  # Figure/table captions
-        ]
-        
-        for line in lines:
+        for line, pages in lines:
             line = line.strip()
             if not line:
                 continue
             
-            # Check for TOC start
-            if re.search(r'contents?|table of contents?|index', line, re.IGNORECASE):
+            kind = DocumentProcessor._classify_line(line, in_toc)
+            
+            # TOC heading starts (or restarts) the skip; TOC lines keep skipping
+            if kind == LINE_TOC_START:
                 in_toc = True
                 continue
-            
-            # Skip TOC content
-            if in_toc:
-                if DocumentProcessor._is_toc_line(line):
-                    continue
-                else:
-                    # If we find substantial non-TOC content, exit TOC
-                    if len(line) > 50 and not DocumentProcessor._is_toc_line(line):
-                        in_toc = False
-                    else:
-                        continue
-            
-            # Skip clear non-content
-            if any(re.search(pattern, line, re.IGNORECASE) for pattern in non_content_patterns):
+            if kind == LINE_TOC:
                 continue
             
-            # Check if this is a section header
-            is_header = any(re.search(pattern, line) for pattern in header_patterns)
+            # Anything else means substantial non-TOC content was found
+            in_toc = False
             
-            if is_header:
-                # Save previous section if meaningful
+            if kind == LINE_HEADER:
+                # Emit previous section if meaningful
                 if current_section and DocumentProcessor._is_meaningful_section(current_section):
                     if current_header:
-                        sections.append(f"{current_header}\n{''.join(current_section)}")
+                        yield f"{current_header}\n{''.join(current_section)}", section_pages
                     else:
-                        sections.append(''.join(current_section))
+                        yield ''.join(current_section), section_pages
                 
                 # Start new section
                 current_header = line
                 current_section = []
-            else:
-                # Add content line if meaningful
-                if DocumentProcessor._is_meaningful_line(line):
-                    current_section.append(line + " ")
+                section_pages = pages
+            elif kind == LINE_CONTENT:
+                current_section.append(line + " ")
+                section_pages = DocumentProcessor._span_pages(section_pages, pages)
         
-        # Add final section
+        # Emit final section
         if current_section and DocumentProcessor._is_meaningful_section(current_section):
             if current_header:
-                sections.append(f"{current_header}\n{''.join(current_section)}")
+                yield f"{current_header}\n{''.join(current_section)}", section_pages
             else:
-                sections.append(''.join(current_section))
+                yield ''.join(current_section), section_pages
+    
+    @staticmethod
+    def _span_pages(pages, more_pages):
+        """Widen a (first, last) page range; None means no page information"""
+        if pages is None:
+            return more_pages
+        if more_pages is None:
+            return pages
+        return pages[0], more_pages[1]
+    
+    @staticmethod
+    def _classify_line(line, in_toc=False):
+        """
+        Classify a stripped, non-empty line exactly once as one of
+        LINE_TOC_START, LINE_TOC, LINE_NOISE, LINE_HEADER or LINE_CONTENT.
+        """
+        if _TOC_START_RE.search(line):
+            return LINE_TOC_START
+        
+        # Inside a TOC only a long non-TOC line ends the skip
+        if in_toc and (len(line) <= 50 or _TOC_LINE_RE.search(line)):
+            return LINE_TOC
         
-        return '\n\n'.join(sections)
+        if _NON_CONTENT_RE.search(line):
+            return LINE_NOISE
+        
+        if _HEADER_RE.search(line):
+            return LINE_HEADER
+        
+        if DocumentProcessor._is_meaningful_line(line):
+            return LINE_CONTENT
+        
+        return LINE_NOISE
     
     @staticmethod
     def _is_toc_line(line):
         """Check if line is part of table of contents"""
-        toc_indicators = [
-            r'\.\.\.\s*\d+$',
-            r'^\d+\.\d*\s',
-            r'^\s*\w+\s+\.\.\.\s*\d+',
-            r'^page\s+\d+',
-            r'^\d+\s*$'
-        ]
-        return any(re.search(pattern, line, re.IGNORECASE) for pattern in toc_indicators)
+        return _TOC_LINE_RE.search(line) is not None
     
     @staticmethod
     def _is_meaningful_section(section_lines):
@@ -216,7 +745,7 @@ class DocumentProcessor:
             return False
         
         # Check alpha character ratio — skip gibberish but keep real text
-        alpha_chars = sum(1 for c in section_text if c.isalpha())
+        alpha_chars = sum(map(str.isalpha, section_text))
         if len(section_text) > 0 and alpha_chars / len(section_text) < 0.3:
             return False
         
@@ -228,20 +757,13 @@ class DocumentProcessor:
         if len(line) < 5:
             return False
         
-        # Check alpha character ratio
-        alpha_chars = sum(1 for c in line if c.isalpha())
-        if len(line) > 0 and alpha_chars / len(line) < 0.3:
+        # Check alpha character ratio (single pass over the line)
+        alpha_chars = sum(map(str.isalpha, line))
+        if alpha_chars / len(line) < 0.3:
             return False
         
         # Skip lines that look like references or captions
-        reference_patterns = [
-            r'^(Figure|Table|Fig\.|Table|Equation)\s+\d+',
-            r'^\[\d+\]',  # Citation
-            r'^References?$',
-            r'^Bibliography$'
-        ]
-        
-        if any(re.search(pattern, line, re.IGNORECASE) for pattern in reference_patterns):
+        if _REFERENCE_RE.search(line):
             return False
         
         return True
@@ -286,28 +808,11 @@ class DocumentProcessor:
         return '\n'.join(reconstructed_lines)
     
     @staticmethod
-    def extract_text_from_docx(file_path):
-        """Extract text from Word documents with structural preservation"""
+    def extract_text_from_docx(source):
+        """Extract text from Word documents (path or binary file object) with structural preservation"""
         try:
-            doc = Document(file_path)
-            full_text = ""
-            
-            # Collect ALL paragraph text first (don't filter yet — matches PDF path)
-            for paragraph in doc.paragraphs:
-                para_text = paragraph.text.strip()
-                if para_text:
-                    full_text += para_text + "\n"
-            
-            # Also extract text from tables
-            for table in doc.tables:
-                for row in table.rows:
-                    row_text = []
-                    for cell in row.cells:
-                        cell_text = cell.text.strip()
-                        if cell_text:
-                            row_text.append(cell_text)
-                    if row_text:
-                        full_text += " | ".join(row_text) + "\n"
+            # Collect ALL paragraph and table text first (don't filter yet — matches PDF path)
+            full_text = "".join(text for _, text in DocumentProcessor._iter_docx_chunks(source))
             
             # Process with same pipeline as PDF
             processed_text = DocumentProcessor._reconstruct_paragraphs(full_text)
@@ -322,71 +827,94 @@ class DocumentProcessor:
         except Exception as e:
             raise Exception(f"DOCX extraction failed: {str(e)}")
     
+    @staticmethod
+    def _iter_docx_chunks(source):
+        """
+        Yield (None, line) for every paragraph, then every table row (Word has no fixed pages).
+        Streams document.xml with DocxStream; anything it cannot render exactly (or any parse
+        error) continues with python-docx from the line where the stream stopped.
+        """
+        emitted = 0
+        try:
+            if hasattr(source, 'seek'):
+                source.seek(0)
+            for line in DocxStream.iter_lines(source):
+                yield None, line + "\n"
+                emitted += 1
+            return
+        except Exception as e:
+            print(f"Streaming DOCX reader gave up after {emitted} lines, using python-docx: {str(e)}")
+        
+        yield from islice(DocumentProcessor._iter_docx_chunks_python_docx(source), emitted, None)
+
+    @staticmethod
+    def _iter_docx_chunks_python_docx(source):
+        """Reference reader on the full python-docx object model"""
+        if hasattr(source, 'seek'):
+            source.seek(0)
+        doc = Document(source)
+        
+        for paragraph in doc.paragraphs:
+            para_text = paragraph.text.strip()
+            if para_text:
+                yield None, para_text + "\n"
+        
+        # Also extract text from tables
+        for table in doc.tables:
+            for row in table.rows:
+                row_text = []
+                for cell in row.cells:
+                    cell_text = cell.text.strip()
+                    if cell_text:
+                        row_text.append(cell_text)
+                if row_text:
+                    yield None, " | ".join(row_text) + "\n"
+    
 
     @staticmethod
-    def extract_text_from_image(file_path):
-        """Extract text from images using OCR.space API"""
+    def extract_text_from_image(source, file_type='PNG'):
+        """Extract text from images (path or binary file object) using the configured OCR backend"""
         try:
-            print(f"Starting OCR.space OCR for: {file_path}")
-            
-            api_key = os.getenv('OCR_API_KEY') 
-            if not api_key:
-                raise Exception("OCR_API_KEY not found in environment variables")
+            text = DocumentProcessor._ocr_image_text(source, file_type)
             
-            # Prepare the image
-            with open(file_path, 'rb') as f:
-                files = {'file': f}
+            if text:
+                # Process with same section extraction
+                processed_text = DocumentProcessor._reconstruct_paragraphs(text)
+                meaningful_content = DocumentProcessor._extract_meaningful_sections(processed_text)
                 
-                payload = {
-                    'apikey': api_key,
-                    'language': 'eng',
-                    'isOverlayRequired': False,
-                    'detectOrientation': True,
-                    'scale': True,
-                    'OCREngine': 2 
-                }
-                
-                response = requests.post(
-                    'https://api.ocr.space/parse/image',
-                    files=files,
-                    data=payload
-                )
-                
-                result = response.json()
-                
-                if result.get('IsErroredOnProcessing'):
-                    raise Exception(f"OCR.space error: {result.get('ErrorMessage', 'Unknown error')}")
-                
-                # Extract text
-                text = result.get('ParsedResults', [{}])[0].get('ParsedText', '')
-                
-                if text:
-                    print(f"OCR.space extracted {len(text)} characters")
-                    
-                    # Process with same section extraction
-                    processed_text = DocumentProcessor._reconstruct_paragraphs(text)
-                    meaningful_content = DocumentProcessor._extract_meaningful_sections(processed_text)
-                    
-                    return meaningful_content.strip()
-                else:
-                    print("No text detected in image")
-                    return ""
+                return meaningful_content.strip()
+            else:
+                print("No text detected in image")
+                return ""
                     
         except Exception as e:
-            print(f"OCR.space failed: {str(e)}")
+            print(f"OCR failed: {str(e)}")
             raise Exception(f"Image OCR failed: {str(e)}")
     
     @staticmethod
-    def extract_text(file_path, file_type):
-        """Extract text from file with meaningful content preservation"""
+    def _iter_image_chunks(source, file_type):
+        """An image is a single page of OCR text"""
+        yield 1, DocumentProcessor._ocr_image_text(source, file_type)
+    
+    @staticmethod
+    def _ocr_image_text(source, file_type='PNG'):
+        """Run the configured OCR backend (OCR_BACKEND) and return the raw recognised text"""
+        return get_ocr_backend().recognize(source, file_type)
+    
+    @staticmethod
+    def extract_text(source, file_type):
+        """
+        Extract text from file with meaningful content preservation.
+        source is a file path or a binary file object (e.g. a buffer read from storage).
+        """
         file_type = file_type.upper()
         
         if file_type in ['PDF']:
-            return DocumentProcessor.extract_text_from_pdf(file_path)
+            return DocumentProcessor.extract_text_from_pdf(source)
         elif file_type in ['DOCX', 'DOC']:
-            return DocumentProcessor.extract_text_from_docx(file_path)
+            return DocumentProcessor.extract_text_from_docx(source)
         elif file_type in ['JPG', 'JPEG', 'PNG', 'BMP', 'TIFF']:
-            return DocumentProcessor.extract_text_from_image(file_path)
+            return DocumentProcessor.extract_text_from_image(source, file_type)
         else:
             raise ValueError(f"Unsupported file type: {file_type}")
     
@@ -448,34 +976,21 @@ class DocumentProcessor:
         return stats
 
     @staticmethod
-    def debug_extraction(file_path, file_type='PDF'):
+    def debug_extraction(source, file_type='PDF'):
         """Debug method to see what's being extracted at each stage"""
         print("=== DOCUMENT EXTRACTION DEBUG ===")
         
         # Raw extraction
         file_type_upper = file_type.upper()
         if file_type_upper == 'PDF':
-            doc = fitz.open(file_path)
-            raw_text = ""
-            for page in doc:
-                raw_text += page.get_text("text") + "\n"
-            doc.close()
+            with DocumentProcessor._pdf_source(source) as pdf_source:
+                doc = DocumentProcessor._open_pdf(pdf_source)
+                raw_text = ""
+                for page in doc:
+                    raw_text += page.get_text("text") + "\n"
+                doc.close()
         elif file_type_upper in ['DOCX', 'DOC']:
-            doc = Document(file_path)
-            raw_text = ""
-            for paragraph in doc.paragraphs:
-                para_text = paragraph.text.strip()
-                if para_text:
-                    raw_text += para_text + "\n"
-            for table in doc.tables:
-                for row in table.rows:
-                    row_text = []
-                    for cell in row.cells:
-                        cell_text = cell.text.strip()
-                        if cell_text:
-                            row_text.append(cell_text)
-                    if row_text:
-                        raw_text += " | ".join(row_text) + "\n"
+            raw_text = "".join(text for _, text in DocumentProcessor._iter_docx_chunks(source))
         else:
             raw_text = f"Debug not available for {file_type}"
         
@@ -492,9 +1007,22 @@ class DocumentProcessor:
         print("\n" + "="*50)
         
         # Final output
-        final = DocumentProcessor.extract_text(file_path, file_type)
+        final = DocumentProcessor.extract_text(source, file_type)
         print(f"3. FINAL EXTRACTED LENGTH: {len(final)}")
         print("FINAL CONTENT SAMPLE:")
         print(final[:1000])
         
-        return final
\ No newline at end of file
+        return final
+
+
+# ── Process pool workers ─────────────────────────────────────────────────────
+
+# Each pool worker opens its own PyMuPDF handle once and reuses it for every shard
+_worker_pdf = None
+
+def _init_pdf_worker(pdf_source):
+    global _worker_pdf
+    _worker_pdf = DocumentProcessor._open_pdf(pdf_source)
+
+def _extract_pdf_shard_in_worker(start_page, end_page, keep_pages=False):
+    return DocumentProcessor._extract_pdf_shard(_worker_pdf, start_page, end_page, keep_pages)
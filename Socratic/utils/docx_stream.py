@@ -0,0 +1,177 @@
+import posixpath
+import zipfile
+
+from lxml import etree
+
+
+W_NS = 'http://schemas.openxmlformats.org/wordprocessingml/2006/main'
+REL_NS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+CT_NS = 'http://schemas.openxmlformats.org/package/2006/content-types'
+OFFICE_DOCUMENT_REL = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument'
+DOCUMENT_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.wordprocessingml.document.main+xml'
+
+
+def _w(tag):
+    return f'{{{W_NS}}}{tag}'
+
+
+W_BODY, W_P, W_TBL, W_TR, W_TC = _w('body'), _w('p'), _w('tbl'), _w('tr'), _w('tc')
+W_R, W_HYPERLINK, W_T, W_TAB, W_PTAB = _w('r'), _w('hyperlink'), _w('t'), _w('tab'), _w('ptab')
+W_BR, W_CR, W_NO_BREAK_HYPHEN = _w('br'), _w('cr'), _w('noBreakHyphen')
+W_TCPR, W_TRPR, W_GRID_SPAN, W_GRID_BEFORE, W_VMERGE = _w('tcPr'), _w('trPr'), _w('gridSpan'), _w('gridBefore'), _w('vMerge')
+W_VAL, W_TYPE = _w('val'), _w('type')
+
+# Run children python-docx turns into text; w:br depends on its break type
+_RUN_TEXT = {W_TAB: "\t", W_PTAB: "\t", W_CR: "\n", W_NO_BREAK_HYPHEN: "-"}
+_BREAK_TEXT = {'textWrapping': "\n", 'page': "", 'column': ""}
+
+
+class UnsupportedDocx(Exception):
+    """The document uses something the streaming reader cannot render exactly like python-docx"""
+
+
+class DocxStream:
+    """
+    Stream the text of word/document.xml with lxml iterparse instead of building the python-docx
+    object model. Output is the same as DocumentProcessor's python-docx reader: the stripped text of
+    every non-empty body paragraph, then one " | "-joined line per table row (merged cells repeat
+    their text the way python-docx's row.cells does). Raises UnsupportedDocx when that cannot be
+    guaranteed, so the caller can fall back to python-docx.
+    """
+
+    @staticmethod
+    def iter_lines(source):
+        """Yield paragraph lines as they are parsed, then the table rows collected on the way"""
+        with zipfile.ZipFile(source) as package:
+            part_name = DocxStream._main_part_name(package)
+            table_rows = []
+
+            with package.open(part_name) as document_xml:
+                # Same parser options as python-docx so whitespace handling matches
+                events = etree.iterparse(
+                    document_xml, events=('end',), remove_blank_text=True, resolve_entities=False,
+                )
+                for _, element in events:
+                    parent = element.getparent()
+                    if parent is None:
+                        if element.tag != _w('document'):
+                            raise UnsupportedDocx(f"unexpected root element {element.tag}")
+                        continue
+                    if parent.tag != W_BODY:
+                        continue
+
+                    if element.tag == W_P:
+                        text = DocxStream._paragraph_text(element).strip()
+                        if text:
+                            yield text
+                    elif element.tag == W_TBL:
+                        table_rows.extend(DocxStream._table_rows(element))
+
+                    # Body-level element done: drop it and everything before it
+                    element.clear()
+                    while element.getprevious() is not None:
+                        del parent[0]
+
+        yield from table_rows
+
+    @staticmethod
+    def _main_part_name(package):
+        """Resolve the main document part the same way python-docx does, refusing anything unusual"""
+        rels = etree.fromstring(package.read('_rels/.rels'))
+        targets = [
+            rel.get('Target') for rel in rels.iter(f'{{{REL_NS}}}Relationship')
+            if rel.get('Type') == OFFICE_DOCUMENT_REL and rel.get('TargetMode') != 'External'
+        ]
+        if len(targets) != 1:
+            raise UnsupportedDocx("no single officeDocument relationship")
+        part_name = posixpath.normpath(targets[0]).lstrip('/')
+
+        content_types = etree.fromstring(package.read('[Content_Types].xml'))
+        for override in content_types.iter(f'{{{CT_NS}}}Override'):
+            if override.get('PartName', '').lstrip('/') == part_name:
+                if override.get('ContentType') != DOCUMENT_CONTENT_TYPE:
+                    raise UnsupportedDocx(f"main part is {override.get('ContentType')}")
+                return part_name
+        raise UnsupportedDocx("main part has no content type override")
+
+    # ── Text (mirrors python-docx 1.2 Paragraph.text / Run.text) ──────────
+
+    @staticmethod
+    def _paragraph_text(p):
+        parts = []
+        for child in p:
+            if child.tag == W_R:
+                parts.append(DocxStream._run_text(child))
+            elif child.tag == W_HYPERLINK:
+                parts.extend(DocxStream._run_text(r) for r in child if r.tag == W_R)
+        return "".join(parts)
+
+    @staticmethod
+    def _run_text(r):
+        parts = []
+        for child in r:
+            tag = child.tag
+            if tag == W_T:
+                parts.append(child.text or "")
+            elif tag == W_BR:
+                break_type = child.get(W_TYPE, 'textWrapping')
+                if break_type not in _BREAK_TEXT:
+                    raise UnsupportedDocx(f"unknown break type {break_type}")
+                parts.append(_BREAK_TEXT[break_type])
+            elif tag in _RUN_TEXT:
+                parts.append(_RUN_TEXT[tag])
+        return "".join(parts)
+
+    # ── Tables (mirrors python-docx _Row.cells / _Cell.text) ──────────────
+
+    @staticmethod
+    def _table_rows(tbl):
+        """One line per row; vertically merged cells resolve to the text of the cell they continue"""
+        previous_row = None  # grid offset -> cell texts contributed by the tc starting there
+        for tr in (child for child in tbl if child.tag == W_TR):
+            offset = DocxStream._int_property(tr, W_TRPR, W_GRID_BEFORE, 0)
+            row = {}
+            row_cells = []
+
+            for tc in (child for child in tr if child.tag == W_TC):
+                span = DocxStream._int_property(tc, W_TCPR, W_GRID_SPAN, 1)
+                if DocxStream._vmerge(tc) == 'continue':
+                    if previous_row is None or offset not in previous_row:
+                        raise UnsupportedDocx("vertical merge without a cell above")
+                    cells = previous_row[offset]
+                else:
+                    cells = [DocxStream._cell_text(tc)] * span
+                row[offset] = cells
+                row_cells.extend(cells)
+                offset += span
+
+            previous_row = row
+            row_text = [cell_text for cell_text in (text.strip() for text in row_cells) if cell_text]
+            if row_text:
+                yield " | ".join(row_text)
+
+    @staticmethod
+    def _cell_text(tc):
+        return "\n".join(DocxStream._paragraph_text(p) for p in tc if p.tag == W_P)
+
+    @staticmethod
+    def _vmerge(tc):
+        tc_pr = tc.find(W_TCPR)
+        vmerge = tc_pr.find(W_VMERGE) if tc_pr is not None else None
+        if vmerge is None:
+            return None
+        value = vmerge.get(W_VAL, 'continue')
+        if value not in ('continue', 'restart'):
+            raise UnsupportedDocx(f"unknown vMerge value {value}")
+        return value
+
+    @staticmethod
+    def _int_property(element, properties_tag, tag, default):
+        properties = element.find(properties_tag)
+        prop = properties.find(tag) if properties is not None else None
+        if prop is None:
+            return default
+        try:
+            return int(prop.get(W_VAL))
+        except (TypeError, ValueError):
+            raise UnsupportedDocx(f"invalid {tag} value")
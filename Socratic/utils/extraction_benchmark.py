@@ -0,0 +1,331 @@
+import json
+import os
+from fnmatch import fnmatch
+import platform
+import random
+import resource
+import statistics
+import time
+from datetime import datetime, timezone
+
+import fitz  # PyMuPDF
+from docx import Document
+from PIL import Image, ImageDraw
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+from .document_processor import DocumentProcessor
+
+
+_WORDS = (
+    "replication consensus latency throughput partition quorum leader follower snapshot "
+    "checkpoint elasticity tenant scheduler container virtual machine hypervisor network "
+    "routing packet congestion window storage block object index query transaction "
+    "isolation durability availability consistency cache eviction shard cluster node"
+).split()
+
+_TOPICS = ["Cloud Service Models", "Distributed Storage", "Consensus Protocols", "Network Layer",
+           "Virtualisation", "Transaction Processing", "Caching Strategies", "Fault Tolerance"]
+
+SUPPORTED_EXTENSIONS = {'.pdf': 'PDF', '.docx': 'DOCX', '.png': 'PNG', '.jpg': 'JPG', '.jpeg': 'JPEG'}
+
+
+class BenchmarkCorpus:
+    """
+    Deterministic synthetic documents (reportlab / python-docx) plus an optional folder of real ones.
+    Generated files are cached in the work directory by name, so repeated runs skip generation.
+    """
+
+    # name -> (generator, pages)
+    SYNTHETIC = {
+        'pdf-text-10': ('_write_text_pdf', 10),
+        'pdf-text-100': ('_write_text_pdf', 100),
+        'pdf-text-500': ('_write_text_pdf', 500),
+        'pdf-tables-100': ('_write_table_pdf', 100),
+        'pdf-toc-100': ('_write_toc_pdf', 100),
+        'pdf-scanned-10': ('_write_scanned_pdf', 10),
+        'docx-text-10': ('_write_text_docx', 10),
+        'docx-text-100': ('_write_text_docx', 100),
+        'docx-text-500': ('_write_text_docx', 500),
+        'docx-tables-100': ('_write_table_docx', 100),
+    }
+
+    LINES_PER_PAGE = 48
+
+    @classmethod
+    def build(cls, workdir, only=None, real_dir=None):
+        """Return [(name, path, file_type)] for every document matching the `only` globs, generating missing ones"""
+        os.makedirs(workdir, exist_ok=True)
+        documents = []
+
+        for name, (generator, pages) in cls.SYNTHETIC.items():
+            if only and not any(fnmatch(name, pattern) for pattern in only):
+                continue
+            extension = 'pdf' if name.startswith('pdf') else 'docx'
+            path = os.path.join(workdir, f"{name}.{extension}")
+            if not os.path.exists(path):
+                print(f"Generating {name} ({pages} pages)")
+                getattr(cls, generator)(path, pages, random.Random(name))
+            documents.append((name, path, extension.upper()))
+
+        if real_dir:
+            for filename in sorted(os.listdir(real_dir)):
+                file_type = SUPPORTED_EXTENSIONS.get(os.path.splitext(filename)[1].lower())
+                name = f"real-{filename}"
+                if file_type and (not only or any(fnmatch(name, pattern) for pattern in only)):
+                    documents.append((name, os.path.join(real_dir, filename), file_type))
+
+        return documents
+
+    # ── Content ───────────────────────────────────────────────────────────
+
+    @classmethod
+    def _sentence(cls, rnd, words=None):
+        words = words or rnd.randint(8, 18)
+        text = " ".join(rnd.choice(_WORDS) for _ in range(words))
+        return text[0].upper() + text[1:] + "."
+
+    @classmethod
+    def _page_lines(cls, rnd, page_num):
+        """Lecture-note page: a numbered heading, paragraphs wrapped with hyphenation, noise lines"""
+        lines = ["copyright 2024 Example University", f"{page_num % 9 + 1}.{page_num % 5 + 1} {rnd.choice(_TOPICS)}"]
+        while len(lines) < cls.LINES_PER_PAGE - 2:
+            paragraph = " ".join(cls._sentence(rnd) for _ in range(rnd.randint(2, 5)))
+            while paragraph and len(lines) < cls.LINES_PER_PAGE - 2:
+                line, paragraph = paragraph[:90], paragraph[90:]
+                if paragraph and line[-1].isalpha() and paragraph[0].isalpha():
+                    line += "-"
+                lines.append(line)
+            lines.append("")
+        lines.append(f"Page {page_num + 1}")
+        return lines
+
+    # ── PDF generators ────────────────────────────────────────────────────
+
+    @classmethod
+    def _write_text_pdf(cls, path, pages, rnd):
+        pdf = canvas.Canvas(path, pagesize=A4)
+        for page_num in range(pages):
+            cls._draw_lines(pdf, cls._page_lines(rnd, page_num))
+            pdf.showPage()
+        pdf.save()
+
+    @classmethod
+    def _write_table_pdf(cls, path, pages, rnd):
+        pdf = canvas.Canvas(path, pagesize=A4)
+        for page_num in range(pages):
+            lines = [f"Table {page_num + 1} {rnd.choice(_TOPICS)} comparison"]
+            for _ in range(cls.LINES_PER_PAGE - 6):
+                lines.append("  ".join(f"{rnd.choice(_WORDS)[:10]:<10}" for _ in range(6)))
+            lines.append(cls._sentence(rnd))
+            cls._draw_lines(pdf, lines, font_size=8)
+            pdf.showPage()
+        pdf.save()
+
+    @classmethod
+    def _write_toc_pdf(cls, path, pages, rnd):
+        """A long table of contents (a fifth of the document) ahead of ordinary content pages"""
+        pdf = canvas.Canvas(path, pagesize=A4)
+        toc_pages = max(1, pages // 5)
+        for page_num in range(toc_pages):
+            lines = ["Table of Contents"] if page_num == 0 else []
+            while len(lines) < cls.LINES_PER_PAGE:
+                section = f"{rnd.randint(1, 12)}.{rnd.randint(1, 9)} {rnd.choice(_TOPICS)}"
+                lines.append(f"{section} {'.' * 20} {rnd.randint(1, pages)}")
+            cls._draw_lines(pdf, lines)
+            pdf.showPage()
+        for page_num in range(toc_pages, pages):
+            cls._draw_lines(pdf, cls._page_lines(rnd, page_num))
+            pdf.showPage()
+        pdf.save()
+
+    @classmethod
+    def _write_scanned_pdf(cls, path, pages, rnd):
+        """Pages that are only a rendered image of text (no text layer)"""
+        pdf = canvas.Canvas(path, pagesize=A4)
+        width, height = A4
+        for page_num in range(pages):
+            image = Image.new('L', (1240, 1754), 255)  # A4 at 150 DPI
+            draw = ImageDraw.Draw(image)
+            for offset, line in enumerate(cls._page_lines(rnd, page_num)):
+                draw.text((100, 100 + offset * 32), line, fill=0)
+            pdf.drawImage(ImageReader(image), 0, 0, width=width, height=height)
+            pdf.showPage()
+        pdf.save()
+
+    @staticmethod
+    def _draw_lines(pdf, lines, font_size=10):
+        pdf.setFont("Helvetica", font_size)
+        _, height = A4
+        for offset, line in enumerate(lines):
+            pdf.drawString(50, height - 50 - offset * (font_size + 5), line)
+
+    # ── DOCX generators ───────────────────────────────────────────────────
+
+    @classmethod
+    def _write_text_docx(cls, path, pages, rnd):
+        doc = Document()
+        for page_num in range(pages):
+            doc.add_paragraph(f"{page_num % 9 + 1}.{page_num % 5 + 1} {rnd.choice(_TOPICS)}")
+            for _ in range(6):
+                doc.add_paragraph(" ".join(cls._sentence(rnd) for _ in range(rnd.randint(2, 5))))
+        doc.save(path)
+
+    @classmethod
+    def _write_table_docx(cls, path, pages, rnd):
+        doc = Document()
+        for page_num in range(pages):
+            doc.add_paragraph(f"{page_num + 1}. {rnd.choice(_TOPICS)}")
+            doc.add_paragraph(cls._sentence(rnd, 20))
+            table = doc.add_table(rows=12, cols=5)
+            for row in table.rows:
+                for cell in row.cells:
+                    cell.text = " ".join(rnd.choice(_WORDS) for _ in range(rnd.randint(1, 3)))
+        doc.save(path)
+
+
+class ExtractionBenchmark:
+    """
+    Times extract_text, _reconstruct_paragraphs and _extract_meaningful_sections separately.
+    Each stage reports median/best wall time over `repeat` runs, peak RSS of this process
+    during the stage and its growth over the RSS at stage start (pool workers are not
+    included), and raw characters per second.
+    """
+
+    STAGES = ('extract_text', 'reconstruct_paragraphs', 'meaningful_sections')
+
+    @classmethod
+    def run(cls, documents, repeat=3):
+        results = {}
+        for name, path, file_type in documents:
+            raw_text = cls._raw_text(path, file_type)
+            reconstructed = DocumentProcessor._reconstruct_paragraphs(raw_text)
+            stages = {
+                'extract_text': lambda: DocumentProcessor.extract_text(path, file_type),
+                'reconstruct_paragraphs': lambda: DocumentProcessor._reconstruct_paragraphs(raw_text),
+                'meaningful_sections': lambda: DocumentProcessor._extract_meaningful_sections(reconstructed),
+            }
+            for stage in cls.STAGES:
+                result = cls._measure(stages[stage], len(raw_text), repeat)
+                results[f"{name}/{stage}"] = result
+                print(f"{name:<24} {stage:<24} {result['wall_seconds']:>8.4f}s "
+                      f"{result['peak_rss_mb']:>8.1f}MB {result['chars_per_second']:>14,.0f} chars/s")
+        return {'meta': cls._meta(repeat), 'results': results}
+
+    @staticmethod
+    def _raw_text(path, file_type):
+        """Unprocessed text the later stages start from (same concatenation as the extractors)"""
+        if file_type == 'PDF':
+            doc = fitz.open(path)
+            raw_text = "".join(page_text + "\n" for page_text in (page.get_text("text") for page in doc) if page_text)
+            doc.close()
+            return raw_text
+        if file_type in ('DOCX', 'DOC'):
+            return "".join(text for _, text in DocumentProcessor._iter_docx_chunks(path))
+        return DocumentProcessor._ocr_image_text(path, file_type)
+
+    @classmethod
+    def _measure(cls, stage, raw_chars, repeat):
+        timings = []
+        peak_rss = 0
+        rss_growth = 0
+        output_chars = 0
+        for _ in range(repeat):
+            cls._reset_peak_rss()
+            rss_before = cls._proc_status_bytes('VmRSS:')
+            start = time.perf_counter()
+            output = stage()
+            timings.append(time.perf_counter() - start)
+            stage_peak = cls._peak_rss_bytes()
+            peak_rss = max(peak_rss, stage_peak)
+            if rss_before is not None:
+                rss_growth = max(rss_growth, stage_peak - rss_before)
+            output_chars = len(output)
+
+        wall = statistics.median(timings)
+        return {
+            'wall_seconds': round(wall, 6),
+            'best_seconds': round(min(timings), 6),
+            'peak_rss_mb': round(peak_rss / (1024 * 1024), 2),
+            'peak_rss_growth_mb': round(rss_growth / (1024 * 1024), 2),
+            'raw_chars': raw_chars,
+            'output_chars': output_chars,
+            'chars_per_second': round(raw_chars / wall) if wall else 0,
+        }
+
+    @staticmethod
+    def _reset_peak_rss():
+        """Linux lets a process reset its high-water mark; elsewhere the lifetime peak is reported"""
+        try:
+            with open('/proc/self/clear_refs', 'w') as f:
+                f.write('5')
+        except OSError:
+            pass
+
+    @classmethod
+    def _peak_rss_bytes(cls):
+        peak = cls._proc_status_bytes('VmHWM:')
+        if peak is None:
+            peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return peak
+
+    @staticmethod
+    def _proc_status_bytes(field):
+        """A kB field from /proc/self/status, or None off Linux"""
+        try:
+            with open('/proc/self/status') as f:
+                for line in f:
+                    if line.startswith(field):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            pass
+        return None
+
+    @staticmethod
+    def _meta(repeat):
+        return {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'extractor_version': DocumentProcessor.EXTRACTOR_VERSION,
+            'pdf_workers': DocumentProcessor.PDF_WORKERS,
+            'repeat': repeat,
+        }
+
+    # ── Baseline comparison ───────────────────────────────────────────────
+
+    @staticmethod
+    def compare(current, baseline, threshold=0.15, min_seconds=0.005):
+        """
+        Compare median wall times against a stored run. Returns one row per measurement present in
+        both; 'regressed' is set when the current time exceeds the baseline by more than threshold.
+        Measurements faster than min_seconds in both runs are too noisy to judge and are skipped.
+        """
+        rows = []
+        for key, result in current['results'].items():
+            previous = baseline.get('results', {}).get(key)
+            if not previous or not previous['wall_seconds']:
+                continue
+            if max(previous['wall_seconds'], result['wall_seconds']) < min_seconds:
+                continue
+            change = result['wall_seconds'] / previous['wall_seconds'] - 1
+            rows.append({
+                'key': key,
+                'baseline_seconds': previous['wall_seconds'],
+                'current_seconds': result['wall_seconds'],
+                'change': round(change, 4),
+                'regressed': change > threshold,
+            })
+        return rows
+
+    @staticmethod
+    def dump(report, path):
+        with open(path, 'w') as f:
+            json.dump(report, f, indent=2, sort_keys=True)
+
+    @staticmethod
+    def load(path):
+        with open(path) as f:
+            return json.load(f)
@@ -0,0 +1,100 @@
+from django.conf import settings
+from django.core.cache import caches
+from .document_processor import DocumentProcessor
+
+
+class ExtractionCache:
+    """
+    Content-addressed cache of extracted study text.
+
+    Entries are keyed by the SHA-256 of the uploaded bytes plus
+    DocumentProcessor.EXTRACTOR_VERSION, so the same lecture PDF uploaded by
+    different students is only extracted (or OCR'd) once. Entries expire after TIMEOUT;
+    total size is left to the cache's own eviction (Redis maxmemory with an LRU/LFU policy
+    in production), so a read is one GET and a write one SET. Only the hit/miss counters
+    are shared across workers, with atomic increments.
+    """
+
+    HITS_KEY   = "extraction:hits"
+    MISSES_KEY = "extraction:misses"
+
+    # ── Config ────────────────────────────────────────────────────────────
+
+    @classmethod
+    def _config(cls):
+        return getattr(settings, "EXTRACTION_CACHE", {})
+
+    @classmethod
+    def enabled(cls):
+        return cls._config().get("ENABLED", True)
+
+    @classmethod
+    def _cache(cls):
+        return caches[cls._config().get("ALIAS", "default")]
+
+    # ── Keys ──────────────────────────────────────────────────────────────
+
+    @classmethod
+    def make_key(cls, digest, file_type, variant=""):
+        """
+        variant separates extractions of the same bytes that differ downstream,
+        e.g. the free and premium study-text budgets.
+        """
+        return f"extraction:v{DocumentProcessor.EXTRACTOR_VERSION}:{file_type.upper()}:{variant}:{digest}"
+
+    # ── Public API ────────────────────────────────────────────────────────
+
+    @classmethod
+    def get(cls, key):
+        """Return cached text or None; never raises"""
+        if not cls.enabled():
+            return None
+        try:
+            cache = cls._cache()
+            text = cache.get(key)
+            cls._incr(cache, cls.MISSES_KEY if text is None else cls.HITS_KEY)
+            return text
+        except Exception as e:
+            print(f"Extraction cache read failed: {str(e)}")
+            return None
+
+    @classmethod
+    def set(cls, key, text):
+        """Store text unless it is larger than MAX_ENTRY_BYTES"""
+        if not cls.enabled() or not text:
+            return
+        config = cls._config()
+        if len(text.encode("utf-8")) > config.get("MAX_ENTRY_BYTES", 32 * 1024 * 1024):
+            return
+        try:
+            cls._cache().set(key, text, config.get("TIMEOUT", None))
+        except Exception as e:
+            print(f"Extraction cache write failed: {str(e)}")
+
+    @classmethod
+    def stats(cls):
+        """Hit/miss counters of all workers"""
+        cache = cls._cache()
+        hits = cache.get(cls.HITS_KEY) or 0
+        misses = cache.get(cls.MISSES_KEY) or 0
+        lookups = hits + misses
+        return {
+            "hits":     hits,
+            "misses":   misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+    @classmethod
+    def clear(cls):
+        """Reset the counters; entries expire with TIMEOUT"""
+        cls._cache().delete_many([cls.HITS_KEY, cls.MISSES_KEY])
+
+    # ── Private helpers ───────────────────────────────────────────────────
+
+    @staticmethod
+    def _incr(cache, key):
+        cache.add(key, 0, None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, None)
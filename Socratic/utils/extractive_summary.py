@@ -0,0 +1,155 @@
+import math
+import time
+from collections import Counter
+
+import numpy as np
+from django.conf import settings
+
+from .token_budget import PromptPacker, TokenEstimator
+
+
+class ExtractiveSummarizer:
+    """
+    Local extractive pre-summary: ranks the paragraphs of a document and keeps the most
+    informative ones that fit a token budget, in document order, so the prompt covers the
+    whole document instead of its first pages.
+
+    Paragraphs are TF-IDF vectors (sublinear tf, the MAX_FEATURES terms found in most
+    paragraphs). METHOD 'textrank' scores them by PageRank over the cosine-similarity graph,
+    'tfidf' by cosine similarity to the document centroid. Paragraphs sharing keywords with
+    the priority text (past exam questions) are boosted up to PRIORITY_BOOST, and a paragraph
+    nearly identical to one already kept (repeated slide headers, duplicated pages) is skipped.
+    """
+
+    # ── Config ────────────────────────────────────────────────────────────
+
+    @staticmethod
+    def _config():
+        return getattr(settings, "EXTRACTIVE_SUMMARY", {})
+
+    @classmethod
+    def enabled(cls):
+        return cls._config().get("ENABLED", True)
+
+    # ── Public API ────────────────────────────────────────────────────────
+
+    @classmethod
+    def select(cls, paragraphs, budget, priority_text="", label="study text"):
+        """Paragraphs worth keeping within budget tokens, joined in document order"""
+        paragraphs = [paragraph for paragraph in paragraphs if paragraph.strip()]
+        costs = [TokenEstimator.estimate(paragraph) for paragraph in paragraphs]
+        separator_cost = TokenEstimator.estimate("\n\n")
+        if sum(costs) + separator_cost * max(0, len(paragraphs) - 1) <= budget:
+            return "\n\n".join(paragraphs)
+
+        started = time.perf_counter()
+        config = cls._config()
+        matrix = cls.tfidf_matrix(paragraphs)
+        scores = cls.scores(matrix, config.get("METHOD", "textrank"))
+        scores = scores * cls._priority_boost(paragraphs, priority_text)
+
+        chosen, used = [], 0
+        kept = np.empty_like(matrix)  # vectors of the chosen paragraphs, first len(chosen) rows
+        threshold = config.get("REDUNDANCY", 0.85)
+        smallest = min(costs) + separator_cost
+        for index in np.argsort(-scores, kind="stable"):
+            if budget - used < smallest:
+                break
+            cost = costs[index] + (separator_cost if chosen else 0)
+            if used + cost > budget:
+                continue
+            vector = matrix[index]
+            if chosen and float(np.max(kept[:len(chosen)] @ vector)) > threshold:
+                continue
+            kept[len(chosen)] = vector
+            chosen.append(index)
+            used += cost
+
+        if not chosen:
+            # Every paragraph is over budget on its own (text without paragraph breaks)
+            return PromptPacker.pack(paragraphs, budget, priority_text, label)["text"]
+
+        print(
+            f"Extractive pre-summary ({label}): kept {len(chosen)}/{len(paragraphs)} paragraphs, "
+            f"~{used}/{sum(costs)} tokens ({config.get('METHOD', 'textrank')}, "
+            f"{time.perf_counter() - started:.2f}s)"
+        )
+        return "\n\n".join(paragraphs[index] for index in sorted(chosen))
+
+    @classmethod
+    def tfidf_matrix(cls, paragraphs):
+        """Row-normalised TF-IDF matrix (paragraphs x terms, float32); empty rows stay zero"""
+        words = [PromptPacker.words(paragraph) for paragraph in paragraphs]
+        document_frequency = Counter()
+        for paragraph_words in words:
+            document_frequency.update(set(paragraph_words))
+
+        # Terms in a single paragraph add nothing to any similarity
+        shared = [(count, term) for term, count in document_frequency.items() if count > 1]
+        shared.sort(key=lambda item: (-item[0], item[1]))
+        vocabulary = {term: column for column, (_, term) in enumerate(shared[:cls._config().get("MAX_FEATURES", 4096)])}
+
+        matrix = np.zeros((len(paragraphs), max(1, len(vocabulary))), dtype=np.float32)
+        for row, paragraph_words in enumerate(words):
+            for term, count in Counter(word for word in paragraph_words if word in vocabulary).items():
+                matrix[row, vocabulary[term]] = 1 + math.log(count)
+
+        if vocabulary:
+            frequencies = np.array([document_frequency[term] for term in vocabulary], dtype=np.float32)
+            matrix[:, :len(vocabulary)] *= np.log((1 + len(paragraphs)) / (1 + frequencies)) + 1
+        norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+        np.divide(matrix, norms, out=matrix, where=norms > 0)
+        return matrix
+
+    @classmethod
+    def scores(cls, matrix, method="textrank"):
+        if method == "tfidf":
+            return cls._centroid_scores(matrix)
+        if method == "textrank":
+            return cls._textrank_scores(matrix)
+        raise Exception(f"Unknown extractive ranking method: {method} (expected textrank or tfidf)")
+
+    # ── Ranking ───────────────────────────────────────────────────────────
+
+    @staticmethod
+    def _centroid_scores(matrix):
+        centroid = matrix.mean(axis=0)
+        norm = np.linalg.norm(centroid)
+        return matrix @ (centroid / norm) if norm else np.zeros(len(matrix), dtype=np.float32)
+
+    @classmethod
+    def _textrank_scores(cls, matrix):
+        """
+        PageRank over the similarity graph S = M M^T without its diagonal. S is never built:
+        S x is computed as M (M^T x) - diag(S) x, so memory stays linear in the paragraph count.
+        """
+        config = cls._config()
+        damping = config.get("DAMPING", 0.85)
+        count = len(matrix)
+        self_similarity = np.einsum("ij,ij->i", matrix, matrix)
+
+        def similarity_times(vector):
+            return matrix @ (matrix.T @ vector) - self_similarity * vector
+
+        degree = similarity_times(np.ones(count, dtype=np.float32))
+        connected = degree > 1e-9
+        rank = np.full(count, 1.0 / count, dtype=np.float32)
+        for _ in range(config.get("ITERATIONS", 50)):
+            spread = similarity_times(np.divide(rank, degree, out=np.zeros_like(rank), where=connected))
+            # Isolated paragraphs pass their rank to everyone, as in PageRank's dangling nodes
+            spread += rank[~connected].sum() / count
+            updated = (1 - damping) / count + damping * spread
+            if np.abs(updated - rank).sum() < 1e-6:
+                return updated
+            rank = updated
+        return rank
+
+    @classmethod
+    def _priority_boost(cls, paragraphs, priority_text):
+        keywords = PromptPacker.keywords(priority_text)
+        if not keywords:
+            return np.ones(len(paragraphs), dtype=np.float32)
+        overlap = np.array([len(keywords & PromptPacker.keywords(paragraph)) for paragraph in paragraphs], dtype=np.float32)
+        if not overlap.max():
+            return np.ones(len(paragraphs), dtype=np.float32)
+        return 1 + cls._config().get("PRIORITY_BOOST", 1.0) * overlap / overlap.max()
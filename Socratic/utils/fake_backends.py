@@ -0,0 +1,398 @@
+import asyncio
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from google.api_core import exceptions as google_exceptions
+
+from .token_budget import PromptPacker, TokenEstimator
+
+
+# The notes a prompt is about: everything after its notes/context label up to the next instruction block
+_NOTES_RE = re.compile(
+    r"(?:STUDY NOTES[^\n]*|PARTIAL STUDY GUIDES[^\n]*|CONTEXT):\s*(.*?)"
+    r"(?=\n\s*(?:PAST EXAM QUESTIONS|Generate exactly|Start immediately|Write the|QUESTIONS:|Requirements)|\Z)",
+    re.S,
+)
+_HEADING_RE = re.compile(r"^(?:#{1,6}\s+|\d+(?:\.\d+)*\.?\s+)([A-Z][^\n|]{2,70})$", re.M)
+_WORD_RE = re.compile(r"[a-z][a-z\-]{3,}")
+_QUIZ_QUESTION_RE = re.compile(r"^(\d+)\. (.+)$", re.M)
+_PACK_FIELDS_RE = re.compile(r"with exactly the fields (.+?) and nothing else")
+
+_FALLBACK_TERMS = ["replication", "consistency", "latency", "throughput", "partitioning", "caching",
+                   "scheduling", "virtualisation", "elasticity", "availability"]
+
+_SENTENCES = (
+    "{A} is about how {b} and {c} fit together, a bit like the stations of a busy kitchen.",
+    "Think of {b} as the step that keeps {c} predictable when demand suddenly changes.",
+    "{A} matters because exam questions often ask how {b} affects {c}.",
+    "In practice {b} trades a little {c} for much better reliability.",
+    "{A} sets the rules for when {b} happens and who is responsible for {c}.",
+    "Without {b}, {c} would have to be handled by hand every single time.",
+)
+
+_QUESTIONS = (
+    "Explain what {a} means and why it matters.",
+    "Define {a} and give an everyday example.",
+    "State two advantages of {a}.",
+    "How does {a} relate to {b}?",
+    "Compare {a} with {b}.",
+    "Describe the main steps involved in {a}.",
+)
+
+# One silent MPEG-1 Layer III frame (128 kbps, 44.1 kHz, mono): 417 bytes, 1152 samples
+_SILENT_MP3_FRAME = bytes([0xFF, 0xFB, 0x90, 0xC0]) + bytes(413)
+_MP3_FRAME_SECONDS = 1152 / 44100
+_SPOKEN_CHARS_PER_SECOND = 15
+
+
+class FakeCalls:
+    """
+    Latency and failure injection shared by the fake LLM, OCR and TTS backends. Each call waits
+    FAKE_BACKENDS['LATENCY'][service] ± JITTER and fails with probability ERROR_RATE, raising
+    the kind of error the real service raises. The random stream is seeded with SEED, so a
+    single-threaded run is reproducible.
+    """
+
+    _random = None
+    _counters = {}
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _config():
+        return getattr(settings, "FAKE_BACKENDS", {})
+
+    @classmethod
+    def plan(cls, service):
+        """(delay in seconds, exception to raise or None) for the next call to service"""
+        config = cls._config()
+        latency = config.get("LATENCY", {}).get(service, 0.0)
+        jitter = config.get("JITTER", 0.0)
+        with cls._lock:
+            if cls._random is None:
+                cls._random = random.Random(config.get("SEED", 0))
+            delay = max(0.0, latency * (1 + cls._random.uniform(-jitter, jitter)))
+            fails = cls._random.random() < config.get("ERROR_RATE", 0.0)
+            error = cls._error(service, cls._random) if fails else None
+            counter = cls._counters.setdefault(service, {"calls": 0, "errors": 0})
+            counter["calls"] += 1
+            counter["errors"] += int(fails)
+        return delay, error
+
+    @classmethod
+    def call(cls, service):
+        delay, error = cls.plan(service)
+        time.sleep(delay)
+        if error:
+            raise error
+
+    @classmethod
+    async def call_async(cls, service):
+        delay, error = cls.plan(service)
+        await asyncio.sleep(delay)
+        if error:
+            raise error
+
+    @classmethod
+    def stats(cls):
+        """{service: {'calls', 'errors'}} since the last reset"""
+        with cls._lock:
+            return {service: dict(counter) for service, counter in cls._counters.items()}
+
+    @classmethod
+    def reset(cls):
+        with cls._lock:
+            cls._random = None
+            cls._counters = {}
+
+    @staticmethod
+    def _error(service, rnd):
+        if service == "llm":
+            return rnd.choice((
+                google_exceptions.ResourceExhausted("Resource has been exhausted (fake backend)"),
+                google_exceptions.ServiceUnavailable("The service is currently unavailable (fake backend)"),
+                google_exceptions.DeadlineExceeded("Deadline exceeded (fake backend)"),
+            ))
+        return Exception(f"Fake {service} backend: injected failure")
+
+
+class FakeResponse:
+    """Response or stream chunk of the fake and replay backends (callers read .text)"""
+
+    def __init__(self, text):
+        self.text = text
+
+
+class FakeResponses:
+    """
+    Deterministic answers in the shapes the pipeline parses: study guide markdown (and merged
+    partial guides), Q1:/A1: pairs, TERM:/DEFINITION: cards, batched quiz and study pack JSON,
+    one-per-line distractors and short answers. Terms and headings are taken from the notes in
+    the prompt, and the same prompt always gets the same answer.
+    """
+
+    @classmethod
+    def respond(cls, prompt):
+        rnd = random.Random(hashlib.sha256(prompt.encode("utf-8")).hexdigest())
+        notes = cls._notes(prompt)
+        terms = cls._terms(notes)
+
+        if "Return ONLY a JSON array" in prompt:
+            return cls._quiz_items(rnd, prompt, terms)
+        if "as ONE JSON object" in prompt:
+            return cls._study_pack(rnd, prompt, notes, terms)
+        if "PARTIAL STUDY GUIDES" in prompt:
+            return cls._merged_guide(rnd, notes, terms, final="## Quick Reference" in prompt)
+        if "Start immediately with Q1" in prompt:
+            return cls._qa_pairs(rnd, terms, cls._requested(prompt, "questions", 10))
+        if "Start immediately with the first TERM" in prompt:
+            return cls._flashcards(rnd, terms, cls._requested(prompt, "flashcards", 10))
+        if "INCORRECT multiple choice options" in prompt:
+            return "\n".join(cls._sentence(rnd, terms) for _ in range(3))
+        if "## [Section heading" in prompt:
+            return cls._study_guide(rnd, notes, terms, final="## Quick Reference" in prompt)
+        return " ".join(cls._sentence(rnd, terms) for _ in range(rnd.randint(2, 3)))
+
+    @classmethod
+    def lecture_text(cls, seed, paragraphs=6):
+        """Plain lecture-note text (what OCR of a page returns)"""
+        rnd = random.Random(seed)
+        lines = []
+        for number in range(paragraphs):
+            lines.append(f"{number + 1}. {cls._title(rnd.choice(_FALLBACK_TERMS))}")
+            lines.append(" ".join(cls._sentence(rnd, _FALLBACK_TERMS) for _ in range(3)))
+        return "\n".join(lines)
+
+    # ── Shapes ────────────────────────────────────────────────────────────
+
+    @classmethod
+    def _study_guide(cls, rnd, notes, terms, final):
+        headings = list(dict.fromkeys(match.strip() for match in _HEADING_RE.findall(notes)))[:12]
+        if not headings:
+            headings = [cls._title(term) for term in terms[:6]]
+
+        blocks = []
+        for heading in headings:
+            concepts = rnd.sample(terms, min(3, len(terms)))
+            blocks.append("\n".join([
+                f"## {heading}",
+                "",
+                " ".join(cls._sentence(rnd, terms) for _ in range(2)),
+                "",
+                "### Key Concepts",
+                *(f"- **{cls._title(term)}**: {cls._sentence(rnd, terms)}" for term in concepts),
+                "",
+                "### Why This Matters",
+                cls._sentence(rnd, terms),
+                "",
+                "---",
+            ]))
+        if final:
+            blocks.append(cls._key_terms_table(rnd, terms))
+        return "\n\n".join(blocks)
+
+    @classmethod
+    def _merged_guide(cls, rnd, notes, terms, final):
+        merged = re.sub(r"\n## Quick Reference: Key Terms.*?(?=\n## |\Z)", "", notes.strip(), flags=re.S)
+        return merged + ("\n\n" + cls._key_terms_table(rnd, terms) if final else "")
+
+    @classmethod
+    def _key_terms_table(cls, rnd, terms):
+        rows = [f"| {cls._title(term)} | {cls._sentence(rnd, terms)} |" for term in terms[:8]]
+        return "\n".join(["## Quick Reference: Key Terms", "| Term | What it actually means |",
+                          "|------|------------------------|", *rows])
+
+    @classmethod
+    def _qa_pairs(cls, rnd, terms, count):
+        pairs = []
+        for number in range(1, count + 1):
+            a, b = rnd.sample(terms, 2)
+            question = rnd.choice(_QUESTIONS).format(a=a, b=b)
+            answer = " ".join(cls._sentence(rnd, terms) for _ in range(rnd.randint(2, 4)))
+            pairs.append(f"Q{number}: {question}\nA{number}: {answer}")
+        return "\n\n".join(pairs)
+
+    @classmethod
+    def _flashcards(cls, rnd, terms, count):
+        cards = []
+        for number in range(count):
+            term = terms[number % len(terms)]
+            definition = " ".join(cls._sentence(rnd, terms) for _ in range(rnd.randint(1, 2)))
+            cards.append(f"TERM: {cls._title(term)}\nDEFINITION: {definition}")
+        return "\n\n".join(cards)
+
+    @classmethod
+    def _quiz_items(cls, rnd, prompt, terms):
+        block = prompt.split("QUESTIONS:", 1)[-1].split("For each question", 1)[0]
+        items = []
+        for number, _ in _QUIZ_QUESTION_RE.findall(block):
+            distractors = []
+            while len(distractors) < 3:
+                distractor = cls._sentence(rnd, terms)
+                if distractor not in distractors:
+                    distractors.append(distractor)
+            items.append({
+                "id": int(number),
+                "answer": " ".join(cls._sentence(rnd, terms) for _ in range(2)),
+                "distractors": distractors,
+                "explanation": cls._sentence(rnd, terms),
+            })
+        return json.dumps(items, indent=1)
+
+    @classmethod
+    def _study_pack(cls, rnd, prompt, notes, terms):
+        """The single-call JSON document, with the fields the prompt asks for"""
+        match = _PACK_FIELDS_RE.search(prompt)
+        fields = [field.strip() for field in match.group(1).split(",")] if match else []
+        pack = {}
+        if "summary_sections" in fields:
+            headings = list(dict.fromkeys(match.strip() for match in _HEADING_RE.findall(notes)))[:12]
+            pack["summary_sections"] = [{
+                "heading": heading,
+                "overview": " ".join(cls._sentence(rnd, terms) for _ in range(2)),
+                "key_concepts": [
+                    {"term": cls._title(term), "explanation": cls._sentence(rnd, terms)}
+                    for term in rnd.sample(terms, min(3, len(terms)))
+                ],
+                "why_it_matters": cls._sentence(rnd, terms),
+            } for heading in headings or [cls._title(term) for term in terms[:6]]]
+        if "key_terms" in fields:
+            pack["key_terms"] = [{"term": cls._title(term), "meaning": cls._sentence(rnd, terms)} for term in terms[:8]]
+        if "questions" in fields:
+            pack["questions"] = [
+                {"question": question, "answer": answer}
+                for question, answer in re.findall(r"^Q\d+: (.+)\nA\d+: (.+)$", cls._qa_pairs(
+                    rnd, terms, cls._requested(prompt, "exam-style questions", 10)), re.M)
+            ]
+        if "flashcards" in fields:
+            pack["flashcards"] = [
+                {"term": term, "definition": definition}
+                for term, definition in re.findall(r"^TERM: (.+)\nDEFINITION: (.+)$", cls._flashcards(
+                    rnd, terms, cls._requested(prompt, "flashcards", 10)), re.M)
+            ]
+        return json.dumps(pack, indent=1)
+
+    # ── Helpers ───────────────────────────────────────────────────────────
+
+    @staticmethod
+    def _notes(prompt):
+        match = _NOTES_RE.search(prompt)
+        return match.group(1) if match else prompt
+
+    @staticmethod
+    def _terms(notes):
+        """The notes' keywords by frequency (fixed stand-ins when there are too few)"""
+        keywords = PromptPacker.keywords(notes)
+        counts = Counter(word for word in _WORD_RE.findall(notes.lower()) if word in keywords)
+        terms = [word for word, _ in counts.most_common(30)]
+        return terms if len(terms) >= 3 else terms + _FALLBACK_TERMS
+
+    @staticmethod
+    def _requested(prompt, noun, default):
+        match = re.search(rf"Generate exactly (\d+) {noun}", prompt)
+        return int(match.group(1)) if match else default
+
+    @staticmethod
+    def _sentence(rnd, terms):
+        a, b, c = (rnd.choice(terms) for _ in range(3))
+        return rnd.choice(_SENTENCES).format(A=a.capitalize(), b=b, c=c)
+
+    @staticmethod
+    def _title(term):
+        return term.replace("-", " ").title()
+
+
+class FakeGenerativeModel:
+    """
+    Offline stand-in for genai.GenerativeModel (LLM_BACKEND=fake): FakeResponses answers
+    after a simulated delay, with the errors FakeCalls injects. Streams are cut into
+    STREAM_CHUNK_CHARS chunks that arrive over the call's latency.
+    """
+
+    def __init__(self, model_name):
+        self.model_name = model_name if model_name.startswith("models/") else f"models/{model_name}"
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        return simulated_response(FakeResponses.respond(prompt_text(contents)), stream)
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        return await simulated_response_async(FakeResponses.respond(prompt_text(contents)), stream)
+
+    def count_tokens(self, contents):
+        return _TokenCount(TokenEstimator.estimate(prompt_text(contents)))
+
+
+class _TokenCount:
+    def __init__(self, total_tokens):
+        self.total_tokens = total_tokens
+
+
+# ── Shared by the fake and replay backends ────────────────────────────────
+
+# Share of a streamed call's latency spent before the first chunk
+_FIRST_CHUNK_SHARE = 0.3
+
+
+def prompt_text(contents):
+    return contents if isinstance(contents, str) else "\n".join(str(part) for part in contents)
+
+
+def simulated_response(text, stream=False):
+    """text as a response (or a stream of chunks) delivered with the fake llm latency"""
+    delay, error = FakeCalls.plan("llm")
+    if not stream:
+        time.sleep(delay)
+        if error:
+            raise error
+        return FakeResponse(text)
+
+    time.sleep(delay * _FIRST_CHUNK_SHARE)
+    if error:
+        raise error
+    chunks = _stream_chunks(text)
+    pause = delay * (1 - _FIRST_CHUNK_SHARE) / len(chunks)
+
+    def iterate():
+        for chunk in chunks:
+            yield FakeResponse(chunk)
+            time.sleep(pause)
+
+    return iterate()
+
+
+async def simulated_response_async(text, stream=False):
+    delay, error = FakeCalls.plan("llm")
+    if not stream:
+        await asyncio.sleep(delay)
+        if error:
+            raise error
+        return FakeResponse(text)
+
+    await asyncio.sleep(delay * _FIRST_CHUNK_SHARE)
+    if error:
+        raise error
+    chunks = _stream_chunks(text)
+    pause = delay * (1 - _FIRST_CHUNK_SHARE) / len(chunks)
+
+    async def iterate():
+        for chunk in chunks:
+            yield FakeResponse(chunk)
+            await asyncio.sleep(pause)
+
+    return iterate()
+
+
+def silent_mp3(text):
+    """Silent MP3 about as long as text takes to read aloud (what the fake TTS backend writes)"""
+    seconds = max(1.0, len(text) / _SPOKEN_CHARS_PER_SECOND)
+    return _SILENT_MP3_FRAME * int(seconds / _MP3_FRAME_SECONDS)
+
+
+def _stream_chunks(text):
+    size = max(1, getattr(settings, "FAKE_BACKENDS", {}).get("STREAM_CHUNK_CHARS", 200))
+    return [text[start:start + size] for start in range(0, len(text), size)] or [""]
@@ -1,5 +1,15 @@
+import os
+
 import google.generativeai as genai
+from django.conf import settings
+from .context_session import ContextSessions
+from .document_processor import DocumentProcessor
+from .extractive_summary import ExtractiveSummarizer
 from .gemini_config import GeminiConfig
+from .llm_metrics import LLMMetrics
+from .parallel_generation import ParallelGeneration
+from .response_parser import QAStreamParser
+from .token_budget import PromptPacker
 
 # ── Prompt templates ────────────────────────────────────────────────────────
 
@@ -216,12 +226,11 @@ Start immediately with the first TERM (nothing before it):
 
 # ── Processor ────────────────────────────────────────────────────────────────
 
-import re
-
 class AIProcessor:
     """
     Free-tier AI processor using Google Gemini.
-    15 questions, processes up to 30 good paragraphs.
+    15 questions, from the most informative paragraphs of the whole document (up to MAX_EXTRACT_CHARS
+    of usable text, or the first MAX_STUDY_CHARS when the extractive pre-summary is off).
     """
 
     _model = None
@@ -232,7 +241,10 @@ class AIProcessor:
     NUM_QUESTIONS  = 15
     NUM_FLASHCARDS = 20
     MAX_STUDY_CHARS   = 50_000
+    MAX_EXTRACT_CHARS = 2_000_000  # safety cap on what is extracted and ranked; EXTRACT tokens reach the prompts
     MAX_CONTEXT_CHARS = 10_000
+    CALL_TIMEOUT      = int(os.getenv('AI_CALL_TIMEOUT', 240))  # seconds per Gemini call
+    TIER              = "free"  # prompt token budgets: PROMPT_TOKEN_BUDGETS[TIER]
 
     # ── Lifecycle ─────────────────────────────────────────────────────────
 
@@ -242,8 +254,9 @@ class AIProcessor:
             return
         try:
             print("Loading Gemini model...")
-            GeminiConfig.configure()
-            cls._model = GeminiConfig.get_model("gemini-2.5-flash")
+            # get_model configures the API key when the real backend is selected
+            # Calls are routed per type and size (MODEL_ROUTING); this is the default model
+            cls._model = GeminiConfig.get_model(settings.MODEL_ROUTING['DEFAULT'][0])
             cls._models_loaded = True
             print("Gemini model loaded successfully!")
         except Exception as e:
@@ -253,8 +266,11 @@ class AIProcessor:
     # ── Public API ────────────────────────────────────────────────────────
 
     @classmethod
-    def generate_enhanced_content(cls, study_text, past_questions_text=""):
-        """Generate summary and Q&A using Gemini."""
+    def generate_enhanced_content(cls, study_text, past_questions_text="", on_summary_delta=None):
+        """
+        Generate summary and Q&A using Gemini (both calls run concurrently).
+        on_summary_delta(text) receives the summary as it streams.
+        """
         if not cls._models_loaded:
             cls.load_models()
 
@@ -268,50 +284,137 @@ class AIProcessor:
                     {"total_questions": 0, "qa_pairs": [], "context_used": False},
                 )
 
-            summary = cls._generate_coherent_summary(processed_text, past_questions_text)
-            qa_data = cls._generate_meaningful_questions(processed_text, past_questions_text)
+            processed_text = cls._condense_study_text(processed_text, past_questions_text)
+
+            # One copy of the notes shared by summary and Q&A (uploaded once with context caching)
+            study_notes = cls._pack_study_text(processed_text, "STUDY", past_questions_text)
+            with ContextSessions.open(cls._model, study_notes, label="study notes") as session:
+                results = ParallelGeneration.run({
+                    "summary": (
+                        lambda: cls._generate_coherent_summary(
+                            processed_text, past_questions_text, on_summary_delta, session
+                        ),
+                        lambda error: f"Summary generation issue: {error}",
+                        cls.CALL_TIMEOUT,
+                    ),
+                    "qa": (
+                        lambda: cls._generate_meaningful_questions(processed_text, past_questions_text, session),
+                        lambda error: {
+                            "error":           f"Q&A generation failed: {error}",
+                            "total_questions": 0,
+                            "context_used":    False,
+                            "qa_pairs":        [],
+                        },
+                        cls.CALL_TIMEOUT,
+                    ),
+                })
 
-            return summary, qa_data
+            return results["summary"], results["qa"]
 
         except Exception as e:
             error_msg = f"Content generation failed: {str(e)}"
             return error_msg, {"error": error_msg}
 
+    @classmethod
+    def collect_study_text(cls, sections):
+        """
+        Pull sections from DocumentProcessor.iter_sections until the usable-text limit of
+        _preprocess_study_text is reached; the rest of the document is never extracted. The
+        extractive pre-summary then picks what goes into the prompts.
+        """
+        return DocumentProcessor.collect_sections(sections, cls._max_usable_chars())
+
     # ── Private helpers ───────────────────────────────────────────────────
 
     @classmethod
     def _preprocess_study_text(cls, text):
-        """Select up to 30 good paragraphs (free tier limit)."""
+        """Good paragraphs up to the usable-text limit; _condense_study_text ranks them."""
         if not text:
             return ""
+        max_chars = cls._max_usable_chars()
 
         paragraphs = [p.strip() for p in text.split("\n\n") if p.strip()]
         good = [p for p in paragraphs if len(p) >= 80 and len(p.split()) >= 12]
-        selected = good[:30]
 
-        if not selected:
-            return text[:cls.MAX_STUDY_CHARS]
+        if not good:
+            return text[:max_chars]
+
+        selected, total = [], 0
+        for paragraph in good:
+            total += len(paragraph) + (2 if selected else 0)
+            if selected and total > max_chars:
+                break
+            selected.append(paragraph)
 
         return "\n\n".join(selected)
 
     @classmethod
-    def _generate_coherent_summary(cls, study_text, context_text):
-        """Generate a plain-English, section-by-section summary."""
+    def _max_usable_chars(cls):
+        # The extractive pre-summary ranks the whole document; without it the free tier limit applies
+        return cls.MAX_EXTRACT_CHARS if ExtractiveSummarizer.enabled() else cls.MAX_STUDY_CHARS
+
+    @classmethod
+    def _generate_content(cls, prompt, session=None, call_type=None):
+        """Single Gemini call on the model routed for call_type (see GeminiConfig.route); gives up after CALL_TIMEOUT"""
+        return GeminiConfig.generate(
+            call_type, cls._model, prompt, session, request_options={"timeout": cls.CALL_TIMEOUT}
+        )
+
+    @classmethod
+    def _pack_study_text(cls, study_text, budget_name, context_text=""):
+        """Whole paragraphs up to the tier's token budget, those matching past questions first"""
+        budget = settings.PROMPT_TOKEN_BUDGETS[cls.TIER][budget_name]
+        sections = PromptPacker.split_sections(study_text, budget)
+        return PromptPacker.pack(sections, budget, context_text, label=f"{cls.TIER} {budget_name.lower()}")["text"]
+
+    @classmethod
+    def _condense_study_text(cls, processed_text, context_text=""):
+        """The most informative paragraphs of the whole document within the EXTRACT budget"""
+        if not ExtractiveSummarizer.enabled():
+            return processed_text
+        budget = settings.PROMPT_TOKEN_BUDGETS[cls.TIER]["EXTRACT"]
+        return ExtractiveSummarizer.select(
+            processed_text.split("\n\n"), budget, context_text, label=f"{cls.TIER} study text"
+        )
+
+    @classmethod
+    def _study_notes(cls, study_text, budget_name, context_text="", session=None):
+        """The study-notes field of a prompt: the session's shared context, or the packed text"""
+        if session:
+            return session.reference
+        return cls._pack_study_text(study_text, budget_name, context_text)
+
+    @classmethod
+    def _pack_context_text(cls, context_text):
+        budget = settings.PROMPT_TOKEN_BUDGETS[cls.TIER]["CONTEXT"]
+        sections = PromptPacker.split_sections(context_text, budget)
+        return PromptPacker.pack(sections, budget, label=f"{cls.TIER} past questions")["text"]
+
+    @classmethod
+    def _generate_coherent_summary(cls, study_text, context_text, on_delta=None, session=None):
+        """Generate a plain-English, section-by-section summary. Streams deltas to on_delta when given."""
         try:
             if context_text:
                 prompt = _SUMMARY_WITH_CONTEXT.format(
-                    study_text=study_text[:cls.MAX_STUDY_CHARS],
-                    context_text=context_text[:cls.MAX_CONTEXT_CHARS],
+                    study_text=cls._study_notes(study_text, "STUDY", context_text, session),
+                    context_text=cls._pack_context_text(context_text),
                 )
             else:
                 prompt = _SUMMARY_NO_CONTEXT.format(
-                    study_text=study_text[:cls.MAX_STUDY_CHARS],
+                    study_text=cls._study_notes(study_text, "STUDY", session=session),
                 )
 
-            response = cls._model.generate_content(prompt)
+            if on_delta:
+                # Same prompt and post-processing; the text is the chunks joined
+                text = GeminiConfig.stream(
+                    "summary", cls._model, prompt, on_delta, session,
+                    request_options={"timeout": cls.CALL_TIMEOUT},
+                )
+            else:
+                text = cls._generate_content(prompt, session, "summary").text
 
-            if response.text:
-                summary = response.text.strip()
+            if text:
+                summary = text.strip()
                 if len(summary.split()) < 30:
                     # Fallback: first few meaningful sentences
                     sentences = [s.strip() for s in study_text.split(".") if len(s.strip()) > 25]
@@ -324,7 +427,7 @@ class AIProcessor:
             return f"Summary generation issue: {str(e)}"
 
     @classmethod
-    def _generate_meaningful_questions(cls, study_text, context_text):
+    def _generate_meaningful_questions(cls, study_text, context_text, session=None):
         """Generate exam-style Q&A pairs with a robust parser."""
         try:
             num_q = cls.NUM_QUESTIONS
@@ -332,19 +435,19 @@ class AIProcessor:
             if context_text:
                 prompt = _QA_WITH_CONTEXT.format(
                     num_questions=num_q,
-                    study_text=study_text[:40_000],
-                    context_text=context_text[:cls.MAX_CONTEXT_CHARS],
+                    study_text=cls._study_notes(study_text, "QA_STUDY", context_text, session),
+                    context_text=cls._pack_context_text(context_text),
                 )
             else:
                 prompt = _QA_NO_CONTEXT.format(
                     num_questions=num_q,
-                    study_text=study_text[:40_000],
+                    study_text=cls._study_notes(study_text, "QA_STUDY", session=session),
                 )
 
-            response = cls._model.generate_content(prompt)
+            text = cls._generate_content(prompt, session, "qa").text
 
-            if response.text:
-                qa_pairs = cls._parse_qa_response(response.text)
+            if text:
+                qa_pairs = cls._parse_qa_response(text)
                 return {
                     "total_questions": len(qa_pairs),
                     "context_used":    bool(context_text),
@@ -369,37 +472,13 @@ class AIProcessor:
     @classmethod
     def _parse_qa_response(cls, response_text):
         """
-        Robust regex-based parser.
-        Matches lines that start with Q<number>: or A<number>:
-        Ignores any prose that happens to start with Q or A (e.g. prompt echoes).
+        Q<number>: / A<number>: pairs of a complete response (see QAStreamParser), by number.
+        Only lines that start with a header count, so prompt echoes are never parsed.
         """
-        # Strip bold/italic markers some models add  (**Q1:** → Q1:)
-        text = re.sub(r"\*+", "", response_text)
-
-        question_re = re.compile(
-            r"^Q(\d+)\s*[:\.\)]\s*(.+?)(?=^Q\d+\s*[:\.\)]|^A\d+\s*[:\.\)]|\Z)",
-            re.MULTILINE | re.DOTALL,
-        )
-        answer_re = re.compile(
-            r"^A(\d+)\s*[:\.\)]\s*(.+?)(?=^Q\d+\s*[:\.\)]|^A\d+\s*[:\.\)]|\Z)",
-            re.MULTILINE | re.DOTALL,
-        )
-
-        questions = {int(m.group(1)): m.group(2).strip() for m in question_re.finditer(text)}
-        answers   = {int(m.group(1)): m.group(2).strip() for m in answer_re.finditer(text)}
-
-        pairs = []
-        for idx in sorted(questions):
-            if idx in answers:
-                pairs.append({
-                    "id":         idx,
-                    "question":   questions[idx],
-                    "answer":     answers[idx],
-                    "type":       "concept_based",
-                    "difficulty": "medium",
-                })
+        pairs = sorted(QAStreamParser.parse(response_text), key=lambda pair: pair["id"])
 
         if not pairs:
+            LLMMetrics.fallback("qa")
             pairs = cls._generate_fallback_questions(response_text)
 
         return pairs[:cls.NUM_QUESTIONS]
@@ -0,0 +1,198 @@
+import asyncio
+import contextlib
+import contextvars
+import functools
+import os
+import threading
+
+from django.conf import settings
+
+# Models whose in-flight slot the current request already holds (GeminiClient.slot)
+_held_slots = contextvars.ContextVar("gemini_client_slots", default=frozenset())
+
+
+class GeminiClient:
+    """
+    Process-wide facade for Gemini calls.
+
+    Every call runs on one long-lived event loop (a daemon thread), through the async gRPC
+    client, so its channel is created once and reused, and a blocking caller on the solo
+    Celery pool can still overlap several requests (generate_many, or calls from the
+    ParallelGeneration threads). A semaphore per model caps how many requests are in flight:
+    GEMINI_CLIENT['MAX_IN_FLIGHT'], overridable per model in MODEL_MAX_IN_FLIGHT.
+
+    Models are the shared instances from GeminiConfig.get_model (anything with
+    generate_content works; sync-only models run in the loop's default executor).
+    """
+
+    _loop = None
+    _loop_pid = None
+    _lock = threading.Lock()
+    _semaphores = {}
+    _in_flight = {}  # model_name -> requests holding a slot; only changed on the loop thread
+
+    # ── Config ────────────────────────────────────────────────────────────
+
+    @classmethod
+    def _config(cls):
+        return getattr(settings, "GEMINI_CLIENT", {})
+
+    @classmethod
+    def max_in_flight(cls, model_name):
+        config = cls._config()
+        return config.get("MODEL_MAX_IN_FLIGHT", {}).get(model_name, config.get("MAX_IN_FLIGHT", 8))
+
+    # ── Public API ────────────────────────────────────────────────────────
+
+    @classmethod
+    def generate(cls, model, contents, **kwargs):
+        """Blocking call for sync code (processors, quiz generators, Celery tasks)"""
+        return cls._submit(cls._generate(model, contents, kwargs)).result()
+
+    @classmethod
+    async def generate_async(cls, model, contents, **kwargs):
+        """Awaitable from any event loop; the request itself runs on the client's loop"""
+        return await asyncio.wrap_future(cls._submit(cls._generate(model, contents, kwargs)))
+
+    @classmethod
+    def generate_many(cls, model, prompts, **kwargs):
+        """
+        Send several prompts at once (bounded by the model's semaphore) and block until all finish.
+        Results keep prompt order; a failed call is returned as its exception.
+        """
+        async def gather():
+            return await asyncio.gather(
+                *(cls._generate(model, prompt, kwargs) for prompt in prompts), return_exceptions=True
+            )
+
+        return cls._submit(gather()).result()
+
+    @classmethod
+    def stream(cls, model, contents, on_text, **kwargs):
+        """
+        Blocking streaming call: on_text(delta) is called with each chunk as it arrives.
+        Returns the full text, which is what the non-streaming call's response.text gives;
+        a cached answer is delivered as a single delta and returned as a CachedText.
+        """
+        return cls._submit(cls._stream(model, contents, on_text, kwargs)).result()
+
+    @classmethod
+    @contextlib.asynccontextmanager
+    async def slot(cls, model_name):
+        """
+        One of the model's in-flight slots, for code on the client's loop. Reentrant within a
+        request, so a wrapper that takes the slot itself (RateLimitedModel) never waits on its own.
+        """
+        held = _held_slots.get()
+        if model_name in held:
+            yield
+            return
+        async with cls._semaphore(model_name):
+            token = _held_slots.set(held | {model_name})
+            cls._in_flight[model_name] = cls._in_flight.get(model_name, 0) + 1
+            try:
+                yield
+            finally:
+                cls._in_flight[model_name] -= 1
+                _held_slots.reset(token)
+
+    @classmethod
+    def in_flight(cls):
+        """{model_name: requests currently in flight}"""
+        return dict(cls._in_flight)
+
+    # ── Private helpers ───────────────────────────────────────────────────
+
+    @classmethod
+    def _submit(cls, coroutine):
+        """Schedule on the client's loop, in a copy of the caller's context (LLMResponseCache.bypass, for one)"""
+        return asyncio.run_coroutine_threadsafe(_in_context(contextvars.copy_context(), coroutine), cls._get_loop())
+
+    @classmethod
+    async def _generate(cls, model, contents, kwargs):
+        async with cls._slot_for(model):
+            if hasattr(model, "generate_content_async"):
+                return await model.generate_content_async(contents, **kwargs)
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(None, functools.partial(model.generate_content, contents, **kwargs))
+
+    @classmethod
+    async def _stream(cls, model, contents, on_text, kwargs):
+        loop = asyncio.get_running_loop()
+        cached = None
+        if hasattr(model, "cached_text"):
+            # Cache reads and writes block (Redis): like on_text, they run off the loop
+            cached = await loop.run_in_executor(
+                None, functools.partial(contextvars.copy_context().run, model.cached_text, contents, **kwargs)
+            )
+        if cached is not None:
+            await loop.run_in_executor(None, on_text, cached)
+            return cached
+
+        parts = []
+        async with cls._slot_for(model):
+            if hasattr(model, "generate_content_async"):
+                response = await model.generate_content_async(contents, stream=True, **kwargs)
+                async for chunk in response:
+                    delta = _chunk_text(chunk)
+                    if delta:
+                        parts.append(delta)
+                        # on_text may block (cache writes): keep the loop free for other requests
+                        await loop.run_in_executor(None, on_text, delta)
+            else:
+                def consume():
+                    for chunk in model.generate_content(contents, stream=True, **kwargs):
+                        delta = _chunk_text(chunk)
+                        if delta:
+                            parts.append(delta)
+                            on_text(delta)
+
+                await loop.run_in_executor(None, consume)
+
+        text = "".join(parts)
+        if text and hasattr(model, "remember"):
+            await loop.run_in_executor(
+                None, functools.partial(contextvars.copy_context().run, model.remember, contents, text, **kwargs)
+            )
+        return text
+
+    @classmethod
+    def _slot_for(cls, model):
+        # A rate-limited model takes the slot itself once it has quota, so waiting for quota holds no slot
+        if getattr(model, "acquires_slot", False):
+            return contextlib.nullcontext()
+        return cls.slot(getattr(model, "model_name", "model"))
+
+    @classmethod
+    def _semaphore(cls, model_name):
+        # Only touched on the client's loop thread, so no lock is needed
+        if model_name not in cls._semaphores:
+            cls._semaphores[model_name] = asyncio.Semaphore(cls.max_in_flight(model_name))
+        return cls._semaphores[model_name]
+
+    @classmethod
+    def _get_loop(cls):
+        """Start the loop thread on first use (again after a fork: threads do not survive it)"""
+        with cls._lock:
+            if cls._loop is None or cls._loop_pid != os.getpid():
+                loop = asyncio.new_event_loop()
+                threading.Thread(target=loop.run_forever, name="gemini-client", daemon=True).start()
+                cls._loop, cls._loop_pid = loop, os.getpid()
+                cls._semaphores = {}
+                cls._in_flight = {}
+            return cls._loop
+
+
+async def _in_context(context, coroutine):
+    # The task running this has its own context copy: setting the caller's values here stays local to it
+    for var, value in context.items():
+        var.set(value)
+    return await coroutine
+
+
+def _chunk_text(chunk):
+    # Chunks without text parts (e.g. the final one carrying only finish_reason) raise on .text
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
@@ -1,6 +1,25 @@
+import contextlib
 import google.generativeai as genai
 import os
+import threading
+import time
 from django.conf import settings
+from google.api_core import exceptions as google_exceptions
+from .fake_backends import FakeGenerativeModel, prompt_text
+from .gemini_client import GeminiClient
+from .llm_cache import CachedModel
+from .llm_cassettes import CassetteModel
+from .llm_metrics import LLMMetrics
+from .rate_limiter import RateLimiter
+from .token_budget import TokenEstimator
+
+# Errors after which a routed call moves on to the route's next model
+FALLBACK_ERRORS = (
+    google_exceptions.ResourceExhausted,
+    google_exceptions.ServiceUnavailable,
+    google_exceptions.DeadlineExceeded,
+    TimeoutError,
+)
 
 class GeminiConfig:
     """
@@ -8,6 +27,10 @@ class GeminiConfig:
     """
     
     _configured = False
+    _models = {}
+    _models_lock = threading.Lock()
+    _served = {}  # (call_type, model_name) -> {"calls", "fallbacks"}
+    _served_lock = threading.Lock()
     
     @classmethod
     def configure(cls):
@@ -22,7 +45,7 @@ class GeminiConfig:
             if not api_key:
                 raise ValueError("GEMINI_API_KEY not found in environment variables.")
             
-            genai.configure(api_key=api_key)
+            genai.configure(api_key=api_key, transport=settings.GEMINI_CLIENT.get('TRANSPORT'))
             cls._configured = True
             print("Gemini API configured successfully!")
             
@@ -32,8 +55,148 @@ class GeminiConfig:
 
     @classmethod
     def get_model(cls, model_name="gemini-2.5-flash"):
-        """Get Gemini model instance"""
-        if not cls._configured:
-            cls.configure()
-        
-        return genai.GenerativeModel(model_name)
\ No newline at end of file
+        """
+        Get the shared Gemini model instance (one per model name and process, so every
+        processor reuses the same client channels; responses are cached, see LLMResponseCache).
+        Send requests through GeminiClient to respect the in-flight limits.
+        The model comes from the backend selected by LLM_BACKEND['BACKEND'] (see LLM_BACKENDS).
+        """
+        # Called from ParallelGeneration threads: without the lock two of them can each build the model
+        with cls._models_lock:
+            if model_name not in cls._models:
+                cls._models[model_name] = CachedModel(get_llm_backend()(model_name))
+            return cls._models[model_name]
+
+    @classmethod
+    def backend_name(cls):
+        return settings.LLM_BACKEND['BACKEND']
+
+    # ── Routing ───────────────────────────────────────────────────────────
+
+    @classmethod
+    def route(cls, call_type, prompt_tokens):
+        """
+        Model names for a call, in fallback order: the first rule of MODEL_ROUTING['ROUTES'][call_type]
+        whose MAX_TOKENS (none: any size) the prompt fits, else MODEL_ROUTING['DEFAULT'].
+        """
+        config = settings.MODEL_ROUTING
+        for rule in config['ROUTES'].get(call_type, []):
+            if rule.get('MAX_TOKENS') is None or prompt_tokens <= rule['MAX_TOKENS']:
+                return list(rule['MODELS'])
+        return list(config['DEFAULT'])
+
+    @classmethod
+    def generate(cls, call_type, model, contents, session=None, **kwargs):
+        """
+        GeminiClient.generate on the models routed for call_type and the prompt's size, moving
+        to the next one on a rate limit, overload or timeout. model is the caller's own model
+        (the session's, if given), used alone when routing is off or the session is pinned to
+        it: a Gemini context cache only exists for the model it was created for. Every call is
+        recorded once in LLMMetrics, with the model that served it and the attempts it took.
+        """
+        def attempt(routed_model):
+            return GeminiClient.generate(routed_model, contents, **kwargs)
+
+        with cls._using(session):
+            return cls._routed(call_type, model, contents, session, attempt)
+
+    @classmethod
+    def stream(cls, call_type, model, contents, on_text, session=None, **kwargs):
+        """GeminiClient.stream with the same routing; falls back only until the first chunk arrived"""
+        started = []
+
+        def relay(delta):
+            started.append(True)
+            on_text(delta)
+
+        def attempt(routed_model):
+            return GeminiClient.stream(routed_model, contents, relay, **kwargs)
+
+        with cls._using(session):
+            return cls._routed(call_type, model, contents, session, attempt, retryable=lambda: not started)
+
+    @classmethod
+    def routing_stats(cls):
+        """{call_type: {model_name: {"calls", "fallbacks"}}}: which models served which calls"""
+        with cls._served_lock:
+            stats = {}
+            for (call_type, model_name), counter in cls._served.items():
+                stats.setdefault(call_type, {})[model_name] = dict(counter)
+            return stats
+
+    @classmethod
+    def reset_routing_stats(cls):
+        with cls._served_lock:
+            cls._served = {}
+
+    @staticmethod
+    def _using(session):
+        # A session's provider cache is kept until the calls using it are done (ContextSession.in_use)
+        return session.in_use() if session else contextlib.nullcontext()
+
+    @classmethod
+    def _routed(cls, call_type, model, contents, session, attempt, retryable=lambda: True):
+        if session:
+            model = session.model
+        if (session and session.pinned) or not settings.MODEL_ROUTING['ENABLED']:
+            models = [model]
+        else:
+            models = [cls.get_model(name) for name in cls.route(call_type, TokenEstimator.estimate(prompt_text(contents)))]
+
+        started = time.monotonic()
+        for position, routed_model in enumerate(models):
+            model_name = getattr(routed_model, "model_name", "model")
+            try:
+                result = attempt(routed_model)
+            except FALLBACK_ERRORS as e:
+                if position == len(models) - 1 or not retryable():
+                    LLMMetrics.record(call_type, model_name, contents, None, started, position + 1, error=e)
+                    raise
+                cls._record(call_type, model_name, "fallbacks")
+                print(f"{call_type} call: {model_name} unavailable ({type(e).__name__}), "
+                      f"falling back to {getattr(models[position + 1], 'model_name', 'model')}")
+                continue
+            except Exception as e:
+                LLMMetrics.record(call_type, model_name, contents, None, started, position + 1, error=e)
+                raise
+            cls._record(call_type, model_name, "calls")
+            LLMMetrics.record(call_type, model_name, contents, result, started, position + 1)
+            return result
+
+    @classmethod
+    def _record(cls, call_type, model_name, counter):
+        with cls._served_lock:
+            served = cls._served.setdefault((call_type, model_name), {"calls": 0, "fallbacks": 0})
+            served[counter] += 1
+
+
+# ── Backends ─────────────────────────────────────────────────────────────────
+
+def _gemini_model(model_name):
+    GeminiConfig.configure()
+    return RateLimiter.wrap(genai.GenerativeModel(model_name))
+
+
+def _recording_model(model_name):
+    return CassetteModel(model_name, 'record', _gemini_model(model_name))
+
+
+def _replay_model(model_name):
+    return CassetteModel(model_name, 'replay')
+
+
+# name -> factory(model_name) returning a model with generate_content(_async) and model_name
+LLM_BACKENDS = {
+    'gemini': _gemini_model,
+    'fake': FakeGenerativeModel,
+    'record': _recording_model,
+    'replay': _replay_model,
+}
+
+
+def get_llm_backend(name=None):
+    """Return the model factory selected by LLM_BACKEND['BACKEND'] (or by name)"""
+    name = (name or GeminiConfig.backend_name()).lower()
+    if name not in LLM_BACKENDS:
+        raise Exception(f"Unknown LLM backend: {name} (expected one of {', '.join(LLM_BACKENDS)})")
+    return LLM_BACKENDS[name]
@@ -0,0 +1,320 @@
+import asyncio
+import contextvars
+import dataclasses
+import functools
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class _SharedResponseCache:
+    """
+    Shared tier: one plain entry per response, expiring after TIMEOUT. There is no index to keep
+    in step across threads and workers: a read is one GET and a write one SET, and total size is
+    left to the cache's own eviction (Redis maxmemory with an LRU/LFU policy in production).
+    """
+
+    @staticmethod
+    def _config():
+        return getattr(settings, "LLM_CACHE", {})
+
+    @classmethod
+    def _cache(cls):
+        return caches[cls._config().get("ALIAS", "default")]
+
+    @classmethod
+    def get(cls, key):
+        """Return cached text or None; never raises"""
+        try:
+            return cls._cache().get(key)
+        except Exception as e:
+            print(f"LLM response cache read failed: {str(e)}")
+            return None
+
+    @classmethod
+    def set(cls, key, text):
+        """Store text unless it is larger than MAX_ENTRY_BYTES"""
+        config = cls._config()
+        if len(text.encode("utf-8")) > config.get("MAX_ENTRY_BYTES", 1024 * 1024):
+            return
+        try:
+            cls._cache().set(key, text, config.get("TIMEOUT"))
+        except Exception as e:
+            print(f"LLM response cache write failed: {str(e)}")
+
+
+class _MemoryLRU:
+    """In-process tier: bounded by entry count and bytes, entries expire with the shared TTL"""
+
+    def __init__(self):
+        self.entries = OrderedDict()  # key -> (expires_at, text, size)
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires_at, text, _ = entry
+            if expires_at is not None and expires_at < time.monotonic():
+                self._discard(key)
+                return None
+            self.entries.move_to_end(key)
+            return text
+
+    def set(self, key, text, timeout, max_entries, max_bytes):
+        size = len(text.encode("utf-8"))
+        if size > max_bytes:
+            return
+        expires_at = time.monotonic() + timeout if timeout else None
+        with self.lock:
+            self._discard(key)
+            self.entries[key] = (expires_at, text, size)
+            self.bytes += size
+            while len(self.entries) > max_entries or self.bytes > max_bytes:
+                self._discard(next(iter(self.entries)))
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.bytes = 0
+
+    def _discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry[2]
+
+
+class CachedResponse:
+    """Stands in for a GenerateContentResponse served from the cache (callers only read .text)"""
+
+    def __init__(self, text):
+        self.text = text
+
+
+# Depth of LLMResponseCache.bypass() blocks around the current call
+_bypass_depth = contextvars.ContextVar("llm_cache_bypass", default=0)
+
+
+class CachedText(str):
+    """The text of a streamed call served from the cache (GeminiClient.stream returns it as is)"""
+
+
+class LLMResponseCache:
+    """
+    Two-tier cache of Gemini responses: an in-process LRU in front of the shared cache
+    (Redis in production), so a retried task or a handout another student already uploaded
+    does not pay for the same prompt twice.
+
+    Keys combine the model name, a hash of the normalised prompt and the generation config.
+    Only plain-text prompts with non-empty answers are cached; a streamed answer is stored under
+    the key of the same non-streaming call (CachedModel.remember) and replayed as one delta.
+    """
+
+    KEY_VERSION = 1
+
+    _memory = _MemoryLRU()
+    _counters = {"memory_hits": 0, "shared_hits": 0, "misses": 0}
+    _counters_lock = threading.Lock()
+
+    # ── Config ────────────────────────────────────────────────────────────
+
+    @classmethod
+    def _config(cls):
+        return getattr(settings, "LLM_CACHE", {})
+
+    @classmethod
+    def enabled(cls):
+        return cls._config().get("ENABLED", True) and not _bypass_depth.get()
+
+    @classmethod
+    @contextmanager
+    def bypass(cls):
+        """
+        Skip the cache (both reads and writes) for calls made inside the block, and in threads
+        and GeminiClient requests started from it; other threads and tasks keep using it.
+        """
+        token = _bypass_depth.set(_bypass_depth.get() + 1)
+        try:
+            yield
+        finally:
+            _bypass_depth.reset(token)
+
+    # ── Keys ──────────────────────────────────────────────────────────────
+
+    @staticmethod
+    def normalize_prompt(prompt):
+        """Ignore differences that do not change what the model sees: line endings, trailing spaces, NFC"""
+        prompt = unicodedata.normalize("NFC", prompt).replace("\r\n", "\n").replace("\r", "\n")
+        return re.sub(r"[ \t]+\n", "\n", prompt).strip()
+
+    @classmethod
+    def make_key(cls, model_name, prompt, generation_config=None):
+        config = json.dumps(generation_config or {}, sort_keys=True, default=str)
+        digest = hashlib.sha256(f"{cls.normalize_prompt(prompt)}\x00{config}".encode("utf-8")).hexdigest()
+        return f"llm:v{cls.KEY_VERSION}:{model_name}:{digest}"
+
+    # ── Public API ────────────────────────────────────────────────────────
+
+    @classmethod
+    def get(cls, key):
+        """Return cached text or None; memory first, then the shared tier (which refills memory)"""
+        text = cls._memory.get(key)
+        if text is not None:
+            cls._count("memory_hits")
+            return text
+
+        text = _SharedResponseCache.get(key)
+        if text is not None:
+            cls._count("shared_hits")
+            cls._remember(key, text)
+            return text
+
+        cls._count("misses")
+        return None
+
+    @classmethod
+    def set(cls, key, text):
+        if not text:
+            return
+        cls._remember(key, text)
+        _SharedResponseCache.set(key, text)
+
+    @classmethod
+    def stats(cls):
+        """Hit rate of this process, across both tiers"""
+        with cls._counters_lock:
+            counters = dict(cls._counters)
+        lookups = sum(counters.values())
+        hits = counters["memory_hits"] + counters["shared_hits"]
+        return {
+            **counters,
+            "hit_rate":        hits / lookups if lookups else 0.0,
+            "memory_entries":  len(cls._memory.entries),
+            "memory_bytes":    cls._memory.bytes,
+        }
+
+    @classmethod
+    def clear(cls):
+        """Empty this process's tier and counters; shared entries expire with TIMEOUT"""
+        cls._memory.clear()
+        with cls._counters_lock:
+            cls._counters.update(memory_hits=0, shared_hits=0, misses=0)
+
+    # ── Private helpers ───────────────────────────────────────────────────
+
+    @classmethod
+    def _remember(cls, key, text):
+        config = cls._config()
+        cls._memory.set(
+            key, text,
+            timeout=config.get("TIMEOUT"),
+            max_entries=config.get("MEMORY_MAX_ENTRIES", 256),
+            max_bytes=config.get("MEMORY_MAX_BYTES", 32 * 1024 * 1024),
+        )
+
+    @classmethod
+    def _count(cls, name):
+        with cls._counters_lock:
+            cls._counters[name] += 1
+
+
+class CachedModel:
+    """
+    Wraps a genai.GenerativeModel so generate_content() is served from LLMResponseCache.
+    Everything else (model_name, count_tokens, ...) is passed through to the wrapped model.
+    """
+
+    def __init__(self, model, context_key=None):
+        self._wrapped = model
+        # Identifies provider-side cached context the prompts refer to (see ContextSession)
+        self._context_key = context_key
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def generate_content(self, contents, **kwargs):
+        key = self._key(contents, kwargs)
+        if key is None:
+            return self._wrapped.generate_content(contents, **kwargs)
+
+        text = LLMResponseCache.get(key)
+        if text is not None:
+            return CachedResponse(text)
+        return self._store(key, self._wrapped.generate_content(contents, **kwargs))
+
+    async def generate_content_async(self, contents, **kwargs):
+        """
+        Same as generate_content for the async client; sync-only models run in the default executor.
+        Cache reads and writes (Redis in production) also run there, so the GeminiClient loop keeps
+        serving the other requests in flight while they wait.
+        """
+        loop = asyncio.get_running_loop()
+        key = self._key(contents, kwargs)
+        if key is not None:
+            text = await loop.run_in_executor(None, LLMResponseCache.get, key)
+            if text is not None:
+                return CachedResponse(text)
+
+        if hasattr(self._wrapped, "generate_content_async"):
+            response = await self._wrapped.generate_content_async(contents, **kwargs)
+        else:
+            response = await loop.run_in_executor(
+                None, functools.partial(self._wrapped.generate_content, contents, **kwargs)
+            )
+        if key is None:
+            return response
+        return await loop.run_in_executor(None, self._store, key, response)
+
+    def cached_text(self, contents, **kwargs):
+        """Cached answer for a (streaming) call, or None; same key as the non-streaming call"""
+        key = self._key(contents, kwargs)
+        text = LLMResponseCache.get(key) if key is not None else None
+        return CachedText(text) if text is not None else None
+
+    def remember(self, contents, text, **kwargs):
+        """Store the joined text of a streamed answer under the non-streaming key"""
+        key = self._key(contents, kwargs)
+        if key is not None:
+            LLMResponseCache.set(key, text)
+
+    def _key(self, contents, kwargs):
+        """Cache key for this call, or None when it must not be cached"""
+        if kwargs.get("stream") or not isinstance(contents, str) or not LLMResponseCache.enabled():
+            return None
+        model_name = getattr(self._wrapped, "model_name", "model")
+        return LLMResponseCache.make_key(model_name, contents, self._generation_key(kwargs))
+
+    @staticmethod
+    def _store(key, response):
+        try:
+            text = response.text
+        except Exception:
+            # Blocked or empty candidates: nothing worth caching, the caller sees the real response
+            return response
+        LLMResponseCache.set(key, text)
+        return response
+
+    def _generation_key(self, kwargs):
+        """Everything that changes the answer; request_options (timeouts, retries) does not"""
+        return {
+            "model_config":       self._plain(getattr(self._wrapped, "_generation_config", None)),
+            "call_config":        self._plain(kwargs.get("generation_config")),
+            "safety_settings":    kwargs.get("safety_settings") or getattr(self._wrapped, "_safety_settings", None),
+            "system_instruction": getattr(self._wrapped, "_system_instruction", None),
+            "tools":              kwargs.get("tools"),
+            "context":            self._context_key,
+        }
+
+    @staticmethod
+    def _plain(config):
+        return dataclasses.asdict(config) if dataclasses.is_dataclass(config) else config
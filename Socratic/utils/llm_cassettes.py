@@ -0,0 +1,146 @@
+import json
+import os
+import threading
+
+from django.conf import settings
+
+from .fake_backends import prompt_text, simulated_response, simulated_response_async
+from .llm_cache import LLMResponseCache
+
+
+class CassetteMiss(Exception):
+    """Replay found no recorded response for a prompt"""
+
+
+class Cassette:
+    """
+    Recorded responses of one model in LLM_BACKEND['CASSETTE_DIR']/<model>.json, as
+    {key: {"prompt": first PROMPT_PREVIEW characters, "text": response text}}. Keys are
+    LLMResponseCache keys, so prompts match after the same normalisation.
+    """
+
+    PROMPT_PREVIEW = 200
+
+    _cassettes = {}
+    _cassettes_lock = threading.Lock()
+
+    @classmethod
+    def for_model(cls, model_name):
+        """The process-wide cassette of a model (one instance per file, so writes are serialised)"""
+        path = os.path.join(settings.LLM_BACKEND['CASSETTE_DIR'], f"{model_name.split('/')[-1]}.json")
+        with cls._cassettes_lock:
+            if path not in cls._cassettes:
+                cls._cassettes[path] = cls(path)
+            return cls._cassettes[path]
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.entries = {}
+        if os.path.exists(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    @staticmethod
+    def make_key(model_name, prompt, kwargs):
+        return LLMResponseCache.make_key(model_name, prompt, kwargs.get('generation_config'))
+
+    def get(self, key):
+        entry = self.entries.get(key)
+        return entry['text'] if entry else None
+
+    def record(self, key, prompt, text):
+        with self.lock:
+            self.entries[key] = {'prompt': prompt[:self.PROMPT_PREVIEW], 'text': text}
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            # Write to a temp file and swap it in, so a crash never leaves half a cassette
+            with open(f"{self.path}.tmp", 'w') as f:
+                json.dump(self.entries, f, indent=1, sort_keys=True)
+            os.replace(f"{self.path}.tmp", self.path)
+
+
+class CassetteModel:
+    """
+    record (LLM_BACKEND=record): calls the real model and saves every answer, streamed ones
+    included, to the model's cassette.
+    replay (LLM_BACKEND=replay): answers from the cassette only, with the fake backend's llm
+    latency and error injection; a prompt that was never recorded raises CassetteMiss.
+    """
+
+    def __init__(self, model_name, mode, wrapped=None):
+        self.wrapped = wrapped
+        self.mode = mode
+        self.model_name = getattr(wrapped, 'model_name', None) or (
+            model_name if model_name.startswith("models/") else f"models/{model_name}"
+        )
+        self.cassette = Cassette.for_model(self.model_name)
+
+    def __getattr__(self, name):
+        wrapped = self.__dict__.get('wrapped')
+        if wrapped is None:
+            raise AttributeError(name)
+        return getattr(wrapped, name)
+
+    def generate_content(self, contents, stream=False, **kwargs):
+        prompt = prompt_text(contents)
+        key = Cassette.make_key(self.model_name, prompt, kwargs)
+        if self.mode == 'replay':
+            return simulated_response(self._replayed(key, prompt), stream)
+
+        response = self.wrapped.generate_content(contents, stream=stream, **kwargs)
+        if stream:
+            return self._recorded_stream(key, prompt, response)
+        self._record(key, prompt, response)
+        return response
+
+    async def generate_content_async(self, contents, stream=False, **kwargs):
+        prompt = prompt_text(contents)
+        key = Cassette.make_key(self.model_name, prompt, kwargs)
+        if self.mode == 'replay':
+            return await simulated_response_async(self._replayed(key, prompt), stream)
+
+        response = await self.wrapped.generate_content_async(contents, stream=stream, **kwargs)
+        if stream:
+            return self._recorded_async_stream(key, prompt, response)
+        self._record(key, prompt, response)
+        return response
+
+    # ── Private helpers ───────────────────────────────────────────────────
+
+    def _replayed(self, key, prompt):
+        text = self.cassette.get(key)
+        if text is None:
+            raise CassetteMiss(f"No recorded response in {self.cassette.path} for prompt: {prompt[:80]!r}")
+        return text
+
+    def _record(self, key, prompt, response):
+        try:
+            text = response.text
+        except Exception:
+            # Blocked or empty candidates: nothing to replay
+            return
+        if text:
+            self.cassette.record(key, prompt, text)
+
+    def _recorded_stream(self, key, prompt, response):
+        parts = []
+        for chunk in response:
+            parts.append(_chunk_text(chunk))
+            yield chunk
+        if any(parts):
+            self.cassette.record(key, prompt, "".join(parts))
+
+    async def _recorded_async_stream(self, key, prompt, response):
+        parts = []
+        async for chunk in response:
+            parts.append(_chunk_text(chunk))
+            yield chunk
+        if any(parts):
+            self.cassette.record(key, prompt, "".join(parts))
+
+
+def _chunk_text(chunk):
+    try:
+        return chunk.text
+    except ValueError:
+        return ""
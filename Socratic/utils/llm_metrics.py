@@ -0,0 +1,212 @@
+import contextlib
+import contextvars
+import threading
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.conf import settings
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+from google.api_core import exceptions as google_exceptions
+
+from logs.models import LLMCall
+from .fake_backends import prompt_text
+from .llm_cache import CachedResponse, CachedText
+from .token_budget import TokenEstimator
+
+# The document and user model calls are charged to (see LLMMetrics.attribute)
+_attribution = contextvars.ContextVar("llm_metrics_attribution", default=None)
+
+
+class LLMMetrics:
+    """
+    Per-call accounting of model calls: call type, serving model, prompt and response size,
+    token usage (usage_metadata, or an estimate for streams and cached answers), latency,
+    attempts and outcome, charged to the document and user set with attribute(). Non-AI
+    fallbacks are recorded as calls with outcome 'fallback'.
+
+    Records are buffered in memory and appended to the llm_calls table in bulk, every
+    FLUSH_SIZE records or FLUSH_INTERVAL seconds and when an attribute() block ends. Only
+    the thread that opened the block writes: pool threads running its calls (ParallelGeneration)
+    leave their records to it, so they never open a database connection of their own.
+    """
+
+    PERCENTILES = (50, 95, 99)
+    MAX_DAYS = 365
+    LATENCY_SAMPLE = 10_000  # latest calls per call type the percentiles are computed over
+
+    _buffer = []
+    _lock = threading.Lock()
+    _last_flush = time.monotonic()
+
+    # ── Config ────────────────────────────────────────────────────────────
+
+    @staticmethod
+    def _config():
+        return getattr(settings, "LLM_METRICS", {})
+
+    @classmethod
+    def enabled(cls):
+        return cls._config().get("ENABLED", True)
+
+    # ── Recording ─────────────────────────────────────────────────────────
+
+    @classmethod
+    @contextlib.contextmanager
+    def attribute(cls, document_id=None, user_id=None):
+        """Charge the calls made inside the block (and threads started with its context) to a document and user"""
+        token = _attribution.set({"document_id": document_id, "user_id": user_id, "thread": threading.get_ident()})
+        try:
+            yield
+        finally:
+            _attribution.reset(token)
+            cls.flush()
+
+    @classmethod
+    def record(cls, call_type, model_name, contents, result=None, started=None, attempts=1, error=None):
+        """
+        One finished call. result is the response (or the streamed text); error the exception
+        the last attempt raised. started is the time.monotonic() the first attempt began.
+        """
+        if not cls.enabled():
+            return
+        prompt = prompt_text(contents)
+        text = cls._text(result)
+        usage = getattr(result, "usage_metadata", None)
+        prompt_tokens = cls._count(usage, "prompt_token_count")
+        response_tokens = cls._count(usage, "candidates_token_count")
+        estimated = prompt_tokens is None or response_tokens is None
+
+        cls._append(
+            call_type=call_type or "default",
+            model=(model_name or "").split("/")[-1][:64],
+            outcome=cls._outcome(error),
+            error=f"{type(error).__name__}: {error}"[:255] if error else "",
+            latency_ms=int((time.monotonic() - started) * 1000) if started is not None else 0,
+            attempts=attempts,
+            prompt_chars=len(prompt),
+            response_chars=len(text),
+            prompt_tokens=TokenEstimator.estimate(prompt) if prompt_tokens is None else prompt_tokens,
+            response_tokens=TokenEstimator.estimate(text) if response_tokens is None else response_tokens,
+            tokens_estimated=estimated,
+            cached=isinstance(result, (CachedResponse, CachedText)),
+        )
+
+    @classmethod
+    def fallback(cls, call_type):
+        """A non-AI fallback produced call_type's output (the model call failed or was unusable)"""
+        if cls.enabled():
+            cls._append(call_type=call_type, outcome="fallback", attempts=0)
+
+    @classmethod
+    def flush(cls):
+        """Append the buffered records to the table; a failed write is reported and dropped"""
+        with cls._lock:
+            records, cls._buffer = cls._buffer, []
+            cls._last_flush = time.monotonic()
+        if not records:
+            return
+        try:
+            LLMCall.objects.bulk_create(records)
+        except Exception as e:
+            print(f"LLM metrics write failed ({len(records)} records dropped): {str(e)}")
+
+    # ── Reporting ─────────────────────────────────────────────────────────
+
+    @classmethod
+    def summary(cls, days=7, top_users=10):
+        """
+        Latency percentiles (over the latest LATENCY_SAMPLE calls) and outcomes per call type,
+        and the users whose calls used the most (uncached) tokens, over the last days (1 to MAX_DAYS).
+        """
+        days = min(max(1, days), cls.MAX_DAYS)
+        # order_by(): the model's default ordering would split every GROUP BY below
+        calls = LLMCall.objects.filter(created_at__gte=timezone.now() - timedelta(days=days)).order_by()
+        model_calls = calls.exclude(outcome="fallback")
+
+        by_type = {}
+        totals = model_calls.values("call_type").annotate(
+            calls=Count("id"), tokens=Sum(F("prompt_tokens") + F("response_tokens"))
+        )
+        for entry in totals:
+            latencies = np.array(
+                model_calls.filter(call_type=entry["call_type"]).order_by("-created_at")
+                .values_list("latency_ms", flat=True)[:cls.LATENCY_SAMPLE],
+                dtype=np.float64,
+            )
+            by_type[entry["call_type"]] = {
+                "calls": entry["calls"],
+                "tokens": entry["tokens"] or 0,
+                **{f"p{pct}_ms": round(float(np.percentile(latencies, pct)), 1) for pct in cls.PERCENTILES},
+            }
+        for call_type, outcome, count in calls.values_list("call_type", "outcome").annotate(count=Count("id")):
+            by_type.setdefault(call_type, {"calls": 0, "tokens": 0}).setdefault("outcomes", {})[outcome] = count
+
+        users = (
+            calls.filter(cached=False).exclude(outcome="fallback")
+            .values("user_id", "user__email")
+            .annotate(calls=Count("id"), tokens=Sum(F("prompt_tokens") + F("response_tokens")),
+                      documents=Count("document_id", distinct=True))
+            .order_by("-tokens")[:top_users]
+        )
+        top = []
+        for user in users:
+            drivers = (
+                calls.filter(cached=False, user_id=user["user_id"]).exclude(outcome="fallback")
+                .values("call_type")
+                .annotate(tokens=Sum(F("prompt_tokens") + F("response_tokens")))
+                .order_by("-tokens")[:3]
+            )
+            top.append({
+                "user_id": user["user_id"],
+                "email": user["user__email"],
+                "calls": user["calls"],
+                "documents": user["documents"],
+                "tokens": user["tokens"] or 0,
+                "top_call_types": {driver["call_type"]: driver["tokens"] for driver in drivers},
+            })
+
+        return {"days": days, "call_types": by_type, "top_users": top}
+
+    # ── Private helpers ───────────────────────────────────────────────────
+
+    @classmethod
+    def _append(cls, **fields):
+        attribution = _attribution.get() or {}
+        record = LLMCall(document_id=attribution.get("document_id"), user_id=attribution.get("user_id"), **fields)
+        config = cls._config()
+        with cls._lock:
+            cls._buffer.append(record)
+            due = attribution.get("thread", threading.get_ident()) == threading.get_ident() and (
+                len(cls._buffer) >= config.get("FLUSH_SIZE", 50)
+                or time.monotonic() - cls._last_flush >= config.get("FLUSH_INTERVAL", 30)
+            )
+        if due:
+            cls.flush()
+
+    @staticmethod
+    def _text(result):
+        if isinstance(result, str):
+            return result
+        try:
+            return (result.text or "") if result is not None else ""
+        except Exception:
+            # Blocked or empty candidates
+            return ""
+
+    @staticmethod
+    def _count(usage, field):
+        # Only the API's integer counts; fake, cached and streamed responses are estimated
+        count = getattr(usage, field, None)
+        return count if isinstance(count, int) else None
+
+    @staticmethod
+    def _outcome(error):
+        if error is None:
+            return "ok"
+        if isinstance(error, google_exceptions.ResourceExhausted):
+            return "rate_limited"
+        if isinstance(error, (google_exceptions.DeadlineExceeded, TimeoutError)):
+            return "timeout"
+        return "error"
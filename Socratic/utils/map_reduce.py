@@ -0,0 +1,243 @@
+import contextvars
+import hashlib
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .gemini_config import GeminiConfig
+
+
+# ── Prompt templates ────────────────────────────────────────────────────────
+
+_MAP_SUMMARY = """
+You are a friendly university tutor explaining study material to a student in plain, simple English.
+
+The notes below are PART {part} of {parts} (pages {page_range}) of a longer document.
+Write study-guide sections for EVERY heading and sub-heading in this part only.
+
+WRITING RULES (follow every single one):
+- After every technical term, add a plain-English explanation in parentheses.
+- NEVER copy a sentence word-for-word from the notes. Always rephrase in your own words.
+- For every numbered list in the notes, keep the numbers AND explain what each item means in simple terms.
+- Use real-world analogies and everyday examples wherever possible.
+- Do NOT write an introduction, a conclusion or a key-terms table — other parts are summarised separately.
+
+OUTPUT FORMAT — use exactly this markdown structure for each section:
+
+## [Section heading that matches the notes]
+
+[2-3 sentence plain-English overview of what this section is about and why it matters]
+
+### Key Concepts
+- **[Term]**: [Plain-English explanation in 1-3 sentences. Include an analogy if it helps.]
+
+### Why This Matters
+[1-2 sentences on how this topic is used in the real world or why it appears in exams]
+
+---
+
+STUDY NOTES (part {part} of {parts}):
+{study_text}
+
+Write the sections for this part now, starting with its first heading:
+"""
+
+_REDUCE_SUMMARY = """
+You are a friendly university tutor assembling ONE complete study guide from partial guides.
+
+Below are study-guide sections written separately for consecutive parts of the same document, in order.
+
+MERGING RULES (follow every single one):
+- Keep EVERY section, in the original order. Do not drop or shorten sections.
+- Merge sections that repeat the same heading into one, keeping all distinct key concepts.
+- Keep the plain-English explanations, analogies and the markdown structure (## heading, ### Key Concepts, ### Why This Matters, ---).
+{final_rules}
+{context_block}
+PARTIAL STUDY GUIDES (in document order):
+{partials}
+
+Write the merged study guide now, starting with the first section:
+"""
+
+_FINAL_RULES = """- After all sections, add:
+
+## Quick Reference: Key Terms
+| Term | What it actually means |
+|------|------------------------|
+| [term] | [one plain-English sentence] |
+"""
+
+_INTERMEDIATE_RULES = "- Do NOT add an introduction, a conclusion or a key-terms table — more parts will be merged later.\n"
+
+_CONTEXT_BLOCK = """
+PAST EXAM QUESTIONS (give the topics these ask about extra depth and clarity):
+{context_text}
+"""
+
+
+class ChunkSummaryError(Exception):
+    """One or more chunks could not be summarised; finished chunks are cached for the retry"""
+
+
+class MapReduceSummarizer:
+    """
+    Summarise documents larger than a single prompt: each page-range chunk is summarised
+    on its own (map, at most CONCURRENCY calls in flight) and the partial guides are merged
+    into the final study guide (reduce, hierarchically if they do not fit one prompt).
+    Chunk and merge results are cached by prompt hash, so a retried task only pays for
+    the calls that failed.
+    """
+
+    PROMPT_VERSION = 1
+    SEPARATOR = "\n\n"
+
+    def __init__(self, model, max_prompt_chars, max_context_chars, request_timeout=None):
+        self.model = model
+        self.max_prompt_chars = max_prompt_chars
+        self.max_context_chars = max_context_chars
+        self.request_timeout = request_timeout
+        self.config = settings.SUMMARY_MAP_REDUCE
+
+    # ── Public API ────────────────────────────────────────────────────────
+
+    def summarize(self, chunks, context_text=""):
+        """chunks: dicts with 'text' and 'page_range' (as from extract_text_from_pdf_chunked)"""
+        if not chunks:
+            raise ChunkSummaryError("No chunks to summarise")
+
+        parts = len(chunks)
+        prompts = [
+            _MAP_SUMMARY.format(
+                part=index + 1,
+                parts=parts,
+                page_range=chunk.get('page_range') or 'n/a',
+                study_text=chunk['text'][:self.max_prompt_chars],
+            )
+            for index, chunk in enumerate(chunks)
+        ]
+        print(f"Map-reduce summary: {parts} chunks, {self.config['CONCURRENCY']} concurrent calls")
+
+        partials = self._run_all(prompts, stage="map")
+        return self._reduce(partials, context_text)
+
+    @classmethod
+    def group_sections(cls, sections, max_chars):
+        """Pack iter_sections output into chunks of up to max_chars (for files without page-range chunking)"""
+        chunks = []
+        texts, first_page, last_page, size = [], None, None, 0
+
+        def flush():
+            page_range = f"{first_page}-{last_page}" if first_page else None
+            text = cls.SEPARATOR.join(texts)
+            chunks.append({'text': text, 'page_range': page_range, 'char_count': len(text)})
+
+        for section in sections:
+            start, _, end = (section.get('page_range') or '').partition('-')
+            if texts and size + len(section['text']) > max_chars:
+                flush()
+                texts, first_page, size = [], None, 0
+            texts.append(section['text'])
+            size += len(section['text']) + len(cls.SEPARATOR)
+            if start:
+                first_page = first_page or start
+                last_page = end or start
+
+        if texts:
+            flush()
+        return chunks
+
+    # ── Reduce ────────────────────────────────────────────────────────────
+
+    def _reduce(self, partials, context_text):
+        context_block = (
+            _CONTEXT_BLOCK.format(context_text=context_text[:self.max_context_chars]) if context_text else ""
+        )
+        budget = self.max_prompt_chars
+
+        # Merge neighbouring partials level by level until they fit a single prompt
+        while len(partials) > 1 and len(self.SEPARATOR.join(partials)) > budget:
+            groups = self._pack(partials, budget)
+            if len(groups) == len(partials):
+                # Every partial alone fills the budget: merge pairs so the tree still shrinks.
+                # Merge prompts are never truncated (that would drop sections); the budget is soft.
+                groups = [partials[i:i + 2] for i in range(0, len(partials), 2)]
+            print(f"Map-reduce summary: merging {len(partials)} partial guides into {len(groups)}")
+            prompts = [
+                _REDUCE_SUMMARY.format(
+                    final_rules=_INTERMEDIATE_RULES,
+                    context_block="",
+                    partials=self.SEPARATOR.join(group),
+                )
+                for group in groups
+            ]
+            partials = self._run_all(prompts, stage="merge")
+
+        prompt = _REDUCE_SUMMARY.format(
+            final_rules=_FINAL_RULES,
+            context_block=context_block,
+            partials=self.SEPARATOR.join(partials),
+        )
+        return self._run_all([prompt], stage="reduce")[0]
+
+    def _pack(self, partials, budget):
+        groups, current, size = [], [], 0
+        for partial in partials:
+            if current and size + len(partial) > budget:
+                groups.append(current)
+                current, size = [], 0
+            current.append(partial)
+            size += len(partial) + len(self.SEPARATOR)
+        if current:
+            groups.append(current)
+        return groups
+
+    # ── LLM calls ─────────────────────────────────────────────────────────
+
+    def _run_all(self, prompts, stage):
+        """Run prompts with bounded concurrency; results keep prompt order"""
+        workers = max(1, min(self.config['CONCURRENCY'], len(prompts)))
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            # Each call runs in a copy of the caller's context, so it is charged to its document (LLMMetrics)
+            futures = [executor.submit(contextvars.copy_context().run, self._call_safely, prompt) for prompt in prompts]
+            outcomes = [future.result() for future in futures]
+
+        failures = [outcome for outcome in outcomes if isinstance(outcome, Exception)]
+        if failures:
+            raise ChunkSummaryError(
+                f"{len(failures)} of {len(prompts)} {stage} calls failed "
+                f"({len(prompts) - len(failures)} cached for retry): {failures[0]}"
+            )
+        return outcomes
+
+    def _call_safely(self, prompt):
+        try:
+            return self._call(prompt)
+        except Exception as e:
+            return e
+
+    def _call(self, prompt):
+        cache = caches[self.config['CACHE_ALIAS']]
+        key = self._cache_key(prompt)
+
+        cached = cache.get(key)
+        if cached is not None:
+            return cached
+
+        if self.request_timeout:
+            response = GeminiConfig.generate(
+                "summary_chunk", self.model, prompt, request_options={'timeout': self.request_timeout}
+            )
+        else:
+            response = GeminiConfig.generate("summary_chunk", self.model, prompt)
+        text = (response.text or "").strip()
+        if not text:
+            raise Exception("Empty response from model")
+
+        cache.set(key, text, self.config['CACHE_TIMEOUT'])
+        return text
+
+    def _cache_key(self, prompt):
+        model_name = getattr(self.model, 'model_name', 'model')
+        digest = hashlib.sha256(prompt.encode('utf-8')).hexdigest()
+        return f"summary-chunk:v{self.PROMPT_VERSION}:{model_name}:{digest}"
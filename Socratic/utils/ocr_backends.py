@@ -0,0 +1,232 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import nullcontext
+
+import numpy as np
+import pytesseract
+import requests
+from django.conf import settings
+from PIL import Image, ImageOps
+
+from .fake_backends import FakeCalls, FakeResponses
+
+
+class OCRBackend:
+    """
+    Base class for OCR engines used by DocumentProcessor for image uploads.
+    recognize() takes a file path or binary file object and returns the raw recognised text.
+    """
+
+    name = None
+
+    def __init__(self, config):
+        self.config = config
+
+    def recognize(self, source, file_type='PNG'):
+        raise NotImplementedError
+
+    def recognize_batch(self, sources, file_type='PNG'):
+        """Recognise several images (e.g. rendered PDF pages); texts come back in input order"""
+        workers = min(self.config['WORKERS'], len(sources))
+        if workers <= 1:
+            return [self.recognize(source, file_type) for source in sources]
+
+        # Network-bound by default: overlap the requests in threads
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(lambda source: self.recognize(source, file_type), sources))
+
+
+class OCRSpaceBackend(OCRBackend):
+    """Hosted OCR.space API (needs OCR_API_KEY)"""
+
+    name = 'ocrspace'
+    API_URL = 'https://api.ocr.space/parse/image'
+
+    def recognize(self, source, file_type='PNG'):
+        print(f"Starting OCR.space OCR for: {source}")
+
+        api_key = os.getenv('OCR_API_KEY')
+        if not api_key:
+            raise Exception("OCR_API_KEY not found in environment variables")
+
+        # Prepare the image (buffers are uploaded as-is, named so OCR.space can detect the type;
+        # the caller keeps ownership of a buffer, so only files opened here are closed)
+        if isinstance(source, (str, os.PathLike)):
+            image_file = open(source, 'rb')
+            upload_name = os.path.basename(source)
+        else:
+            image_file = nullcontext(source)
+            source.seek(0)
+            upload_name = f"upload.{file_type.lower()}"
+
+        with image_file as f:
+            files = {'file': (upload_name, f)}
+
+            payload = {
+                'apikey': api_key,
+                'language': self.config['LANGUAGE'],
+                'isOverlayRequired': False,
+                'detectOrientation': True,
+                'scale': True,
+                'OCREngine': 2
+            }
+
+            try:
+                response = requests.post(self.API_URL, files=files, data=payload, timeout=self.config['TIMEOUT'])
+            except requests.Timeout:
+                raise Exception(f"OCR.space timed out after {self.config['TIMEOUT']}s")
+
+            result = response.json()
+
+        if result.get('IsErroredOnProcessing'):
+            raise Exception(f"OCR.space error: {result.get('ErrorMessage', 'Unknown error')}")
+
+        # Extract text
+        text = result.get('ParsedResults', [{}])[0].get('ParsedText', '')
+        if text:
+            print(f"OCR.space extracted {len(text)} characters")
+        return text
+
+
+class TesseractBackend(OCRBackend):
+    """
+    Local Tesseract via pytesseract (needs the tesseract binary on the worker).
+    Images are normalised before recognition: grayscale, downscaled to TARGET_DPI and deskewed.
+    Tall scans are cut into horizontal strips at blank rows and recognised in a process pool.
+    """
+
+    name = 'tesseract'
+
+    INK_THRESHOLD = 128
+    SKEW_MAX_ANGLE = 5.0
+    SKEW_STEP = 0.5
+    SKEW_SAMPLE_SIZE = 800
+    ASSUMED_DPI = 300
+
+    def recognize(self, source, file_type='PNG'):
+        print(f"Starting Tesseract OCR for: {source}")
+        text = self.recognize_batch([source], file_type)[0]
+        if text:
+            print(f"Tesseract extracted {len(text)} characters")
+        return text
+
+    def recognize_batch(self, sources, file_type='PNG'):
+        """CPU-bound: the tiles of every image share one process pool"""
+        tiles, owners = [], []
+        for index, source in enumerate(sources):
+            if hasattr(source, 'seek'):
+                source.seek(0)
+            with Image.open(source) as image:
+                prepared = self.preprocess(image)
+            for top, bottom in self.tile_bounds(prepared):
+                tiles.append(prepared.crop((0, top, prepared.width, bottom)))
+                owners.append(index)
+
+        language = self.config['LANGUAGE']
+        workers = min(self.config['WORKERS'], len(tiles))
+
+        if workers > 1:
+            print(f"Tesseract OCR: {len(sources)} images, {len(tiles)} tiles on {workers} workers")
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                tile_texts = list(executor.map(_recognize_tile, tiles, [language] * len(tiles)))
+        else:
+            tile_texts = [_recognize_tile(tile, language) for tile in tiles]
+
+        texts = [[] for _ in sources]
+        for index, tile_text in zip(owners, tile_texts):
+            if tile_text.strip():
+                texts[index].append(tile_text.strip("\n"))
+        return ["\n".join(parts) for parts in texts]
+
+    # ── Preprocessing ─────────────────────────────────────────────────────
+
+    def preprocess(self, image):
+        """Grayscale, downscale to the target DPI and deskew"""
+        image = ImageOps.exif_transpose(image)
+        gray = image.convert('L')
+
+        # Phone photos and 600 DPI scans carry far more pixels than Tesseract needs
+        source_dpi = image.info.get('dpi', (self.ASSUMED_DPI, self.ASSUMED_DPI))[0] or self.ASSUMED_DPI
+        scale = self.config['TARGET_DPI'] / float(source_dpi)
+        if scale < 1:
+            gray = gray.resize((max(1, round(gray.width * scale)), max(1, round(gray.height * scale))), Image.LANCZOS)
+
+        angle = self.estimate_skew(gray)
+        if angle:
+            gray = gray.rotate(angle, resample=Image.BICUBIC, expand=True, fillcolor=255)
+        return gray
+
+    def estimate_skew(self, gray):
+        """
+        Projection-profile deskew: rotate a thumbnail of the ink mask through small angles and keep
+        the one whose row sums change most sharply (text lines aligned with the pixel rows).
+        Returns the counter-clockwise correction in degrees.
+        """
+        sample = gray.copy()
+        sample.thumbnail((self.SKEW_SAMPLE_SIZE, self.SKEW_SAMPLE_SIZE))
+        ink = Image.fromarray(((np.asarray(sample) < self.INK_THRESHOLD) * 255).astype(np.uint8))
+
+        best_angle, best_score = 0.0, None
+        for angle in np.arange(-self.SKEW_MAX_ANGLE, self.SKEW_MAX_ANGLE + self.SKEW_STEP / 2, self.SKEW_STEP):
+            profile = np.asarray(ink.rotate(angle, resample=Image.NEAREST, fillcolor=0), dtype=np.float64).sum(axis=1)
+            score = np.square(np.diff(profile)).sum()
+            if best_score is None or score > best_score:
+                best_angle, best_score = float(angle), score
+        return best_angle
+
+    # ── Tiling ────────────────────────────────────────────────────────────
+
+    def tile_bounds(self, gray):
+        """
+        Split a tall page into (top, bottom) strips of roughly TILE_HEIGHT rows.
+        Each cut is moved to the emptiest row near the nominal boundary so no text line is sliced.
+        """
+        tile_height = self.config['TILE_HEIGHT']
+        height = gray.height
+        if height <= tile_height * 1.5:
+            return [(0, height)]
+
+        ink_rows = (np.asarray(gray) < self.INK_THRESHOLD).sum(axis=1)
+        window = tile_height // 4
+        bounds, top = [], 0
+
+        while height - top > tile_height * 1.5:
+            target = top + tile_height
+            lo, hi = target - window, target + window
+            candidates = ink_rows[lo:hi]
+            emptiest = np.flatnonzero(candidates == candidates.min()) + lo
+            cut = int(emptiest[np.argmin(np.abs(emptiest - target))])
+            bounds.append((top, cut))
+            top = cut
+
+        bounds.append((top, height))
+        return bounds
+
+
+class FakeOCRBackend(OCRBackend):
+    """Offline stand-in for load tests: lecture-note text per image after FAKE_BACKENDS['LATENCY']['ocr']"""
+
+    name = 'fake'
+
+    def recognize(self, source, file_type='PNG'):
+        FakeCalls.call('ocr')
+        seed = source if isinstance(source, (str, os.PathLike)) else id(source)
+        return FakeResponses.lecture_text(str(seed))
+
+
+OCR_BACKENDS = {backend.name: backend for backend in (OCRSpaceBackend, TesseractBackend, FakeOCRBackend)}
+
+
+def get_ocr_backend(name=None):
+    """Return the OCR backend selected by OCR_CONFIG['BACKEND'] (or by name)"""
+    config = settings.OCR_CONFIG
+    name = (name or config['BACKEND']).lower()
+    if name not in OCR_BACKENDS:
+        raise Exception(f"Unknown OCR backend: {name} (expected one of {', '.join(OCR_BACKENDS)})")
+    return OCR_BACKENDS[name](config)
+
+
+# ── Process-pool worker ───────────────────────────────────────────────────
+
+def _recognize_tile(tile, language):
+    return pytesseract.image_to_string(tile, lang=language)
@@ -0,0 +1,46 @@
+import contextvars
+import time
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+
+class ParallelGeneration:
+    """
+    Run independent LLM generations (summary, Q&A, flashcards) at the same time so a stage
+    takes as long as its slowest call instead of the sum of all of them.
+    Every call is isolated: if it raises or overruns its timeout, its fallback is used and
+    the other results are kept.
+    """
+
+    @staticmethod
+    def run(calls, propagate=()):
+        """
+        calls: {name: (fn, fallback, timeout)}. fn() produces the result, fallback(error) the
+        value to use instead when fn fails; timeout is in seconds from the start of the batch
+        (None waits as long as fn takes). Exceptions listed in propagate are re-raised.
+        Returns {name: result}.
+        """
+        executor = ThreadPoolExecutor(max_workers=max(1, len(calls)), thread_name_prefix='generation')
+        started = time.monotonic()
+        # Calls run in a copy of the caller's context (LLMMetrics attribution, for one)
+        futures = {name: executor.submit(contextvars.copy_context().run, fn) for name, (fn, _, _) in calls.items()}
+
+        try:
+            results = {}
+            for name, (_, fallback, timeout) in calls.items():
+                remaining = None if timeout is None else max(0.0, started + timeout - time.monotonic())
+                try:
+                    results[name] = futures[name].result(timeout=remaining)
+                except FutureTimeoutError:
+                    print(f"Generation '{name}' timed out after {timeout}s; using fallback")
+                    results[name] = fallback(f"timed out after {timeout}s")
+                except propagate:
+                    raise
+                except Exception as e:
+                    print(f"Generation '{name}' failed: {str(e)}; using fallback")
+                    results[name] = fallback(str(e))
+
+            print(f"Parallel generation of {', '.join(calls)} finished in {time.monotonic() - started:.1f}s")
+            return results
+        finally:
+            # Never block on a call that overran: its thread finishes (or hits the client timeout) on its own
+            executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,167 @@
+import hashlib
+import io
+from collections import Counter
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import caches
+
+from .token_budget import PromptPacker, TokenEstimator
+
+
+class PassageIndex:
+    """
+    In-process BM25 index over the passages of one document's summary, used to give each
+    quiz prompt the passages about its own questions instead of the packed summary.
+
+    Postings are stored CSR-style in flat NumPy arrays: the postings of term t are
+    doc_ids[offsets[t]:offsets[t + 1]] with term frequencies tfs[...]. An index serialises
+    to one compressed .npz blob, cached per ProcessingResult (and summary) in
+    QUIZ_RETRIEVAL['CACHE_ALIAS'].
+    """
+
+    VERSION = 1
+
+    def __init__(self, passages, terms, offsets, doc_ids, tfs):
+        self.passages = list(passages)
+        self.vocabulary = {term: position for position, term in enumerate(terms)}
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.lengths = np.array([len(PromptPacker.words(p)) for p in self.passages], dtype=np.float32)
+        self.costs = [TokenEstimator.estimate(passage) for passage in self.passages]
+        document_frequency = np.diff(offsets).astype(np.float32)
+        count = len(self.passages)
+        # BM25 idf, kept positive for terms found in most passages
+        self.idf = np.log(1 + (count - document_frequency + 0.5) / (document_frequency + 0.5))
+
+    # ── Config ────────────────────────────────────────────────────────────
+
+    @staticmethod
+    def _config():
+        return getattr(settings, "QUIZ_RETRIEVAL", {})
+
+    @classmethod
+    def enabled(cls):
+        return cls._config().get("ENABLED", True)
+
+    # ── Public API ────────────────────────────────────────────────────────
+
+    @classmethod
+    def for_result(cls, processing_result):
+        """
+        The index of a result's summary, or None when retrieval is off or the whole summary
+        fits the quiz context budget (then every prompt shares the summary instead).
+        """
+        text = processing_result.summary or ""
+        if not cls.enabled() or TokenEstimator.estimate(text) <= settings.PROMPT_TOKEN_BUDGETS['quiz']['CONTEXT']:
+            return None
+
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+        key = f"passage-index:v{cls.VERSION}:{processing_result.id}:{digest}"
+        try:
+            blob = cls._cache().get(key)
+            if blob is not None:
+                return cls.from_bytes(blob)
+        except Exception as e:
+            print(f"Passage index cache read failed: {str(e)}")
+
+        index = cls.build(text)
+        try:
+            cls._cache().set(key, index.to_bytes(), cls._config().get("CACHE_TIMEOUT", 60 * 60 * 24 * 7))
+        except Exception as e:
+            print(f"Passage index cache write failed: {str(e)}")
+        return index
+
+    @classmethod
+    def build(cls, text):
+        passages = [
+            passage.strip()
+            for passage in PromptPacker.split_sections(text, cls._config().get("PASSAGE_TOKENS", 300))
+            if PromptPacker.words(passage)
+        ]
+        postings = {}  # term -> [(passage, tf)]
+        for position, passage in enumerate(passages):
+            for term, count in Counter(PromptPacker.words(passage)).items():
+                postings.setdefault(term, []).append((position, count))
+
+        terms = sorted(postings)
+        offsets = np.zeros(len(terms) + 1, dtype=np.int32)
+        offsets[1:] = np.cumsum([len(postings[term]) for term in terms])
+        doc_ids = np.fromiter((p for term in terms for p, _ in postings[term]), dtype=np.int32, count=offsets[-1])
+        tfs = np.fromiter((c for term in terms for _, c in postings[term]), dtype=np.uint16, count=offsets[-1])
+        return cls(passages, terms, offsets, doc_ids, tfs)
+
+    def scores(self, query):
+        """BM25 score of every passage for query"""
+        config = self._config()
+        k1, b = config.get("K1", 1.2), config.get("B", 0.75)
+        scores = np.zeros(len(self.passages), dtype=np.float32)
+        if not self.passages:
+            return scores
+
+        norms = k1 * (1 - b + b * self.lengths / max(1.0, float(self.lengths.mean())))
+        for term in set(PromptPacker.words(query)):
+            position = self.vocabulary.get(term)
+            if position is None:
+                continue
+            start, end = self.offsets[position], self.offsets[position + 1]
+            docs = self.doc_ids[start:end]
+            tf = self.tfs[start:end].astype(np.float32)
+            scores[docs] += self.idf[position] * tf * (k1 + 1) / (tf + norms[docs])
+        return scores
+
+    def search(self, query, k):
+        """Positions of the k best passages with a positive score, best first"""
+        scores = self.scores(query)
+        ranked = np.argsort(-scores, kind="stable")[:k]
+        return [int(position) for position in ranked if scores[position] > 0]
+
+    def context(self, questions_text, budget=None):
+        """
+        The CONTEXT of a quiz prompt: the TOP_K passages of every question (one per line),
+        best-ranked first across questions, within budget tokens and in document order.
+        """
+        budget = budget or settings.PROMPT_TOKEN_BUDGETS['quiz']['CONTEXT']
+        top_k = self._config().get("TOP_K", 4)
+        rankings = [self.search(line, top_k) for line in questions_text.split("\n") if line.strip()]
+
+        chosen, used = set(), 0
+        for rank in range(top_k):
+            for ranking in rankings:
+                if rank < len(ranking) and ranking[rank] not in chosen:
+                    cost = self.costs[ranking[rank]] + 1
+                    if used + cost <= budget:
+                        chosen.add(ranking[rank])
+                        used += cost
+        if not chosen:
+            # No question shares a word with the summary: its opening passages
+            chosen = set(range(min(top_k, len(self.passages))))
+        return "\n\n".join(self.passages[position] for position in sorted(chosen))
+
+    # ── Serialisation ─────────────────────────────────────────────────────
+
+    def to_bytes(self):
+        terms = sorted(self.vocabulary, key=self.vocabulary.get)
+        buffer = io.BytesIO()
+        np.savez_compressed(
+            buffer,
+            passages=np.array(self.passages, dtype=np.str_),
+            terms=np.array(terms, dtype=np.str_),
+            offsets=self.offsets, doc_ids=self.doc_ids, tfs=self.tfs,
+        )
+        return buffer.getvalue()
+
+    @classmethod
+    def from_bytes(cls, blob):
+        with np.load(io.BytesIO(blob), allow_pickle=False) as data:
+            return cls(
+                data["passages"].tolist(), data["terms"].tolist(),
+                data["offsets"], data["doc_ids"], data["tfs"],
+            )
+
+    # ── Private helpers ───────────────────────────────────────────────────
+
+    @classmethod
+    def _cache(cls):
+        return caches[cls._config().get("CACHE_ALIAS", "extraction")]
@@ -0,0 +1,238 @@
+import os
+import platform
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files import File
+from django.db import connections
+from django.db.models.signals import post_save
+
+from ..models import ProcessingResult
+from .fake_backends import FakeCalls
+from .gemini_config import GeminiConfig
+from .file_helpers import _save_uploaded_file_to_storage
+from .llm_cache import LLMResponseCache
+
+
+TERMINAL_STATUSES = ('COMPLETED', 'FAILED')
+
+
+class StageTimeline:
+    """
+    When each ProcessingResult entered each processing stage. In eager mode stage changes are
+    recorded as they are saved (post_save); with real workers the driver polls the database,
+    so stage boundaries are accurate to POLL_INTERVAL.
+    """
+
+    def __init__(self):
+        self.events = {}  # result id -> [(stage, monotonic time)]
+        self.lock = threading.Lock()
+
+    def start(self, result_id):
+        with self.lock:
+            self.events[str(result_id)] = [('queued', time.monotonic())]
+
+    def observe(self, result_id, stage):
+        if stage == 'pending':
+            return
+        with self.lock:
+            events = self.events.get(str(result_id))
+            if events is not None and events[-1][0] != stage:
+                events.append((stage, time.monotonic()))
+
+    def durations(self, result_id):
+        """{stage: seconds} for every stage that was left again (the terminal one has no duration)"""
+        events = self.events.get(str(result_id), [])
+        return {stage: end - start for (stage, start), (_, end) in zip(events, events[1:])}
+
+    def elapsed(self, result_id):
+        events = self.events.get(str(result_id), [])
+        return events[-1][1] - events[0][1] if len(events) > 1 else None
+
+    # ── Eager mode ────────────────────────────────────────────────────────
+
+    def _on_save(self, sender, instance, **kwargs):
+        self.observe(instance.id, instance.processing_stage)
+
+    def connect(self):
+        post_save.connect(self._on_save, sender=ProcessingResult, weak=False, dispatch_uid=id(self))
+
+    def disconnect(self):
+        post_save.disconnect(sender=ProcessingResult, dispatch_uid=id(self))
+
+
+class PipelineLoadTest:
+    """
+    Pushes N documents through process_document_task and reports throughput and latency
+    percentiles per stage. 'eager' runs the task in this process (CONCURRENCY threads);
+    'celery' dispatches to the real workers and polls their progress. Run it against the
+    fake or replay backends (LLM_BACKEND, OCR_BACKEND, TTS_BACKEND) to measure the worker
+    itself without paying for, or being rate limited by, Gemini, OCR.space and gTTS.
+    """
+
+    POLL_INTERVAL = 0.5
+    PERCENTILES = (50, 90, 95, 99)
+    USERNAME = 'loadtest'
+
+    @classmethod
+    def run(cls, documents, count, mode='eager', concurrency=1, premium=False, timeout=3600, keep=False):
+        """documents: [(name, path, file_type)] as from BenchmarkCorpus.build, used round-robin"""
+        from ..tasks import process_document_task
+
+        user = cls._user(premium)
+        jobs = [cls._submit_job(user, documents[index % len(documents)], index, premium) for index in range(count)]
+        timeline = StageTimeline()
+        FakeCalls.reset()
+        GeminiConfig.reset_routing_stats()
+
+        started = time.monotonic()
+        if mode == 'eager':
+            timeline.connect()
+            try:
+                with ThreadPoolExecutor(max_workers=max(1, concurrency)) as executor:
+                    list(executor.map(lambda job: cls._run_eager(process_document_task, job, timeline), jobs))
+            finally:
+                timeline.disconnect()
+        elif mode == 'celery':
+            for job in jobs:
+                timeline.start(job['result'].id)
+                process_document_task.delay(*job['args'])
+            cls._poll(jobs, timeline, started + timeout)
+        else:
+            raise Exception(f"Unknown load test mode: {mode} (expected eager or celery)")
+        wall = time.monotonic() - started
+
+        report = cls._report(jobs, timeline, wall)
+        report['meta'] = cls._meta(mode, count, concurrency, premium)
+        if not keep:
+            for job in jobs:
+                job['result'].refresh_from_db()
+                job['result'].delete()
+        return report
+
+    # ── Jobs ──────────────────────────────────────────────────────────────
+
+    @classmethod
+    def _user(cls, premium):
+        user, _ = get_user_model().objects.get_or_create(
+            username=cls.USERNAME, defaults={'email': f"{cls.USERNAME}@example.com"}
+        )
+        user.premium_user = premium
+        user.user_type = 'premium' if premium else 'free'
+        user.save(update_fields=['premium_user', 'user_type'])
+        return user
+
+    @staticmethod
+    def _submit_job(user, document, index, premium):
+        """Upload a fresh copy (the task deletes its upload) and create the PENDING result, as the view does"""
+        name, path, _ = document
+        filename = os.path.basename(path)
+        with open(path, 'rb') as f:
+            storage_path = _save_uploaded_file_to_storage(File(f, name=filename))
+        title = f"Load test {index + 1} ({name})"
+        result = ProcessingResult.objects.create(
+            user=user, document_title=title, original_filename=filename,
+            is_premium_generation=premium, status='PENDING',
+        )
+        return {'name': name, 'result': result, 'args': (result.id, user.id, storage_path, None, filename, title)}
+
+    @staticmethod
+    def _run_eager(task, job, timeline):
+        timeline.start(job['result'].id)
+        try:
+            task.apply(args=job['args'], throw=False)
+        except Exception as e:
+            print(f"Load test job {job['name']} raised: {str(e)}")
+        finally:
+            connections.close_all()
+
+    @classmethod
+    def _poll(cls, jobs, timeline, deadline):
+        pending = {str(job['result'].id) for job in jobs}
+        while pending and time.monotonic() < deadline:
+            rows = ProcessingResult.objects.filter(id__in=pending).values_list('id', 'processing_stage', 'status')
+            for result_id, stage, status in rows:
+                timeline.observe(result_id, stage)
+                if status in TERMINAL_STATUSES:
+                    pending.discard(str(result_id))
+            if pending:
+                time.sleep(cls.POLL_INTERVAL)
+        if pending:
+            print(f"Load test timed out with {len(pending)} documents still processing")
+
+    # ── Report ────────────────────────────────────────────────────────────
+
+    @classmethod
+    def _report(cls, jobs, timeline, wall):
+        statuses = dict(
+            ProcessingResult.objects.filter(id__in=[job['result'].id for job in jobs]).values_list('id', 'status')
+        )
+        completed = [job for job in jobs if statuses.get(job['result'].id) == 'COMPLETED']
+
+        stages = {}
+        for job in jobs:
+            for stage, seconds in timeline.durations(job['result'].id).items():
+                stages.setdefault(stage, []).append(seconds)
+        end_to_end = [timeline.elapsed(job['result'].id) for job in completed]
+
+        report = {
+            'throughput': {
+                'documents': len(jobs),
+                'completed': len(completed),
+                'failed': sum(1 for job in jobs if statuses.get(job['result'].id) == 'FAILED'),
+                'wall_seconds': round(wall, 3),
+                'documents_per_minute': round(len(completed) / wall * 60, 2) if wall else 0.0,
+            },
+            'end_to_end': cls.summarize([seconds for seconds in end_to_end if seconds is not None]),
+            'stages': {stage: cls.summarize(values) for stage, values in stages.items()},
+            'fake_calls': FakeCalls.stats(),
+            'models': GeminiConfig.routing_stats(),
+            'llm_cache': LLMResponseCache.stats(),
+        }
+
+        print(f"{len(completed)}/{len(jobs)} documents completed in {wall:.1f}s "
+              f"({report['throughput']['documents_per_minute']} documents/minute)")
+        for stage, result in [('end_to_end', report['end_to_end'])] + list(report['stages'].items()):
+            if result['count']:
+                print(f"{stage:<20} n={result['count']:<5} " + " ".join(
+                    f"p{pct}={result[f'p{pct}']:.2f}s" for pct in cls.PERCENTILES
+                ) + f" max={result['max']:.2f}s")
+        return report
+
+    @classmethod
+    def summarize(cls, values):
+        """Count, mean, max and PERCENTILES (linear interpolation) of a list of seconds"""
+        values = sorted(values)
+        summary = {'count': len(values)}
+        if not values:
+            return summary
+        summary['mean'] = round(sum(values) / len(values), 4)
+        summary['max'] = round(values[-1], 4)
+        for pct in cls.PERCENTILES:
+            position = (len(values) - 1) * pct / 100
+            lower = int(position)
+            upper = min(lower + 1, len(values) - 1)
+            summary[f'p{pct}'] = round(values[lower] + (values[upper] - values[lower]) * (position - lower), 4)
+        return summary
+
+    @staticmethod
+    def _meta(mode, count, concurrency, premium):
+        return {
+            'timestamp': datetime.now(timezone.utc).isoformat(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+            'mode': mode,
+            'documents': count,
+            'concurrency': concurrency if mode == 'eager' else None,
+            'premium': premium,
+            'backends': {
+                'llm': settings.LLM_BACKEND['BACKEND'],
+                'ocr': settings.OCR_CONFIG['BACKEND'],
+                'tts': settings.TTS_CONFIG['BACKEND'],
+            },
+            'fake_backends': settings.FAKE_BACKENDS,
+        }
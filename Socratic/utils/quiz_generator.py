@@ -1,14 +1,56 @@
+import contextlib
+import json
+import os
 import random
 import re
 from django.utils import timezone
 from ..models import ProcessingResult
 from Quiz.models import Quiz, Question
 from django.utils import timezone
+from django.conf import settings
+from .context_session import ContextSessions
+from .gemini_config import GeminiConfig
+from .llm_metrics import LLMMetrics
+from .parallel_generation import ParallelGeneration
+from .passage_index import PassageIndex
+from .token_budget import PromptPacker, TokenEstimator
+
+_BATCH_QUIZ = """
+Write multiple choice quiz material for EVERY numbered question below, based on the context.
+
+CONTEXT: {context}
+
+QUESTIONS:
+{questions}
+
+For each question provide:
+1. "answer": a SHORT but DETAILED correct answer
+   - 2-4 sentences maximum, accurate and based on the context, in clear direct language
+   - Do NOT use phrases like "According to the context" or "Based on the text"
+   - Do NOT copy exact sentences from the context - paraphrase and summarize
+2. "distractors": exactly 3 plausible but INCORRECT options
+   - Related to the topic but factually wrong, plausible enough to challenge someone who doesn't know the answer
+   - Different from each other and from the correct answer, about the same length as the answer
+   - Good distractors: common misconceptions, related but different concepts, partially correct
+     but incomplete answers, reversed versions of the correct concept, overgeneralizations
+3. "explanation": 1-3 sentences on why the answer is correct, clearly linked to the context
+
+Return ONLY a JSON array with one object per question, in the same order, no other text:
+[{{"id": 1, "answer": "...", "distractors": ["...", "...", "..."], "explanation": "..."}}]
+"""
+
+_DEFAULT_EXPLANATION = "This answer is correct based on established knowledge and principles related to the topic."
+
 
 class AIPoweredQuizGenerator:
     """
     Uses your existing AI processors to generate intelligent quizzes
     """
+
+    # Batch mode asks for answers, distractors and explanations of BATCH_SIZE questions
+    # in one structured call instead of up to three calls per question
+    BATCH_MODE = os.getenv('QUIZ_BATCH_MODE', 'true').lower() == 'true'
+    BATCH_SIZE = int(os.getenv('QUIZ_BATCH_SIZE', 10))
     
     @staticmethod
     def generate_quiz_from_processing_result(processing_result):
@@ -32,45 +74,27 @@ class AIPoweredQuizGenerator:
                 created_at=timezone.now()
             )
             
-            # Generate questions with AI-generated answers
-            for i, qa_pair in enumerate(qa_pairs[:20]):
-                question_text = qa_pair.get('question', '')
-                
-                if question_text:
-                    # Generate new concise answer using AI
-                    concise_answer = AIPoweredQuizGenerator._generate_concise_answer(
-                        question_text,
-                        summary,
-                        processing_result.user.premium_user
-                    )
-                    
-                    if concise_answer:
-                        # Use AI to generate intelligent distractors
-                        options = AIPoweredQuizGenerator._generate_ai_distractors(
-                            question_text, 
-                            concise_answer,
-                            summary,
-                            processing_result.user.premium_user
-                        )
-
-                        explanation = AIPoweredQuizGenerator._generate_explanation(
-                            question_text,
-                            concise_answer,
-                            summary,
-                            processing_result.user.premium_user
-                        )
-                        
-                        # Create the question
-                        Question.objects.create(
-                            quiz=quiz,
-                            text=question_text,
-                            answer=concise_answer,
-                            explanation=explanation,
-                            option_1=options[0],
-                            option_2=options[1],
-                            option_3=options[2],
-                            option_4=options[3],
-                        )
+            # Generate AI answers, distractors and explanations, then insert the questions in one query
+            questions = [qa_pair.get('question', '') for qa_pair in qa_pairs[:20]]
+            questions = [question_text for question_text in questions if question_text]
+            items = AIPoweredQuizGenerator._generate_quiz_items(
+                questions, PassageIndex.for_result(processing_result) or summary,
+                processing_result.user.premium_user,
+            )
+
+            Question.objects.bulk_create([
+                Question(
+                    quiz=quiz,
+                    text=question_text,
+                    answer=item['answer'],
+                    explanation=item['explanation'],
+                    option_1=item['options'][0],
+                    option_2=item['options'][1],
+                    option_3=item['options'][2],
+                    option_4=item['options'][3],
+                )
+                for question_text, item in zip(questions, items)
+            ])
             
             processing_result.quiz_generated = True
             processing_result.save()
@@ -82,7 +106,206 @@ class AIPoweredQuizGenerator:
             raise
 
     @staticmethod
-    def _generate_concise_answer(question, context, is_premium_user):
+    def _get_ai_processor(is_premium_user):
+        if is_premium_user:
+            from .ai_processor import PremiumAIProcessor as AIProcessor
+        else:
+            from .free_ai_processor import AIProcessor
+        if not AIProcessor._models_loaded:
+            AIProcessor.load_models()
+        return AIProcessor
+
+    @staticmethod
+    def _generate_quiz_items(questions, context, is_premium_user, with_explanations=True):
+        """
+        Answer, shuffled options and explanation for each question (same order).
+        Batch mode: one structured call per BATCH_SIZE questions, the batches in parallel.
+        Otherwise the per-question calls are used (explanations only if with_explanations).
+        context is the summary, or its PassageIndex when the summary exceeds the quiz budget.
+        """
+        ai_processor = AIPoweredQuizGenerator._get_ai_processor(is_premium_user)
+
+        if isinstance(context, PassageIndex):
+            # Every prompt gets the passages about its own questions: nothing to share
+            sessions = contextlib.nullcontext()
+        else:
+            # The summary is packed once for all questions and shared by every quiz prompt
+            quiz_context = AIPoweredQuizGenerator._pack_context(context, "\n".join(questions))
+            session_model = AIPoweredQuizGenerator._session_model(ai_processor, quiz_context)
+            sessions = ContextSessions.open(session_model, quiz_context, label="quiz context")
+        with sessions as session:
+            if not AIPoweredQuizGenerator.BATCH_MODE:
+                items = []
+                for question_text in questions:
+                    answer = AIPoweredQuizGenerator._generate_concise_answer(
+                        question_text, context, is_premium_user, session
+                    )
+                    items.append({
+                        'answer': answer,
+                        'options': AIPoweredQuizGenerator._generate_ai_distractors(
+                            question_text, answer, context, is_premium_user, session
+                        ),
+                        'explanation': AIPoweredQuizGenerator._generate_explanation(
+                            question_text, answer, context, is_premium_user, session
+                        ) if with_explanations else None,
+                    })
+                return items
+
+            size = max(1, AIPoweredQuizGenerator.BATCH_SIZE)
+            batches = [questions[start:start + size] for start in range(0, len(questions), size)]
+            raw_items = AIPoweredQuizGenerator._run_batches(ai_processor, batches, context, session)
+
+            # A failed call (or a response without one usable item) is retried once in two halves,
+            # so one bad response does not give a whole batch the canned fallbacks
+            failed = [index for index, batch_items in enumerate(raw_items) if not any(batch_items)]
+            if failed:
+                splits = {index: AIPoweredQuizGenerator._halves(batches[index]) for index in failed}
+                halves = [half for index in failed for half in splits[index]]
+                print(f"Quiz generation: retrying {len(failed)} failed batches as {len(halves)} calls")
+                retried = iter(AIPoweredQuizGenerator._run_batches(ai_processor, halves, context, session))
+                for index in failed:
+                    raw_items[index] = [raw_item for _ in splits[index] for raw_item in next(retried)]
+        print(f"Quiz generation: {len(questions)} questions in {len(batches)} batched calls")
+
+        items = []
+        for batch, batch_items in zip(batches, raw_items):
+            for question_text, raw_item in zip(batch, batch_items):
+                items.append(AIPoweredQuizGenerator._build_quiz_item(question_text, raw_item))
+        return items
+
+    @staticmethod
+    def _halves(batch):
+        middle = (len(batch) + 1) // 2
+        return [half for half in (batch[:middle], batch[middle:]) if half]
+
+    @staticmethod
+    def _run_batches(ai_processor, batches, context, session):
+        """Raw items of each batch (None where missing), the batch calls in parallel; a failed call gives all None"""
+        results = ParallelGeneration.run({
+            f"quiz batch {index + 1}": (
+                lambda batch=batch: AIPoweredQuizGenerator._get_batch_items(ai_processor, batch, context, session),
+                lambda error: [],
+                ai_processor.CALL_TIMEOUT,
+            )
+            for index, batch in enumerate(batches)
+        })
+        return [
+            (list(results[f"quiz batch {index + 1}"]) + [None] * len(batch))[:len(batch)]
+            for index, batch in enumerate(batches)
+        ]
+
+    @staticmethod
+    def _session_model(ai_processor, quiz_context):
+        """
+        The model to open the quiz context session on. A provider-cached session pins every
+        quiz call to its model, so with routing on it is the one the quiz calls route to.
+        """
+        if not settings.MODEL_ROUTING['ENABLED']:
+            return ai_processor._model
+        call_type = 'quiz_batch' if AIPoweredQuizGenerator.BATCH_MODE else 'answer'
+        return GeminiConfig.get_model(GeminiConfig.route(call_type, TokenEstimator.estimate(quiz_context))[0])
+
+    @staticmethod
+    def _pack_context(context, questions_text):
+        """Whole summary sections up to the quiz token budget, those about the questions first"""
+        budget = settings.PROMPT_TOKEN_BUDGETS['quiz']['CONTEXT']
+        sections = PromptPacker.split_sections(context, budget)
+        return PromptPacker.pack(sections, budget, questions_text, label="quiz context")['text']
+
+    @staticmethod
+    def _quiz_context(context, questions_text, session=None):
+        """The CONTEXT field of a quiz prompt: the session's shared context, the passages retrieved for the questions, or the packed summary"""
+        if session:
+            return session.reference
+        if isinstance(context, PassageIndex):
+            return context.context(questions_text)
+        return AIPoweredQuizGenerator._pack_context(context, questions_text)
+
+    @staticmethod
+    def _get_batch_items(ai_processor, questions, context, session=None):
+        """One structured call for a batch; returns the raw item dicts aligned with questions (None if missing)"""
+        prompt = _BATCH_QUIZ.format(
+            context=AIPoweredQuizGenerator._quiz_context(context, "\n".join(questions), session),
+            questions="\n".join(f"{number}. {question_text}" for number, question_text in enumerate(questions, 1)),
+        )
+        response = GeminiConfig.generate(
+            "quiz_batch", ai_processor._model, prompt, session,
+            generation_config={"response_mime_type": "application/json"},
+            request_options={"timeout": ai_processor.CALL_TIMEOUT},
+        )
+        if not response.text:
+            return []
+        return AIPoweredQuizGenerator._parse_batch_response(response.text, len(questions))
+
+    @staticmethod
+    def _parse_batch_response(response_text, count):
+        text = re.sub(r'^\s*```(?:json)?\s*|\s*```\s*$', '', response_text.strip())
+        try:
+            data = json.loads(text)
+        except ValueError as e:
+            print(f"Batched quiz response is not valid JSON: {e}")
+            return []
+        if isinstance(data, dict):
+            data = next((value for value in data.values() if isinstance(value, list)), [])
+
+        entries = [entry for entry in data if isinstance(entry, dict)]
+        by_id = {}
+        for entry in entries:
+            try:
+                by_id.setdefault(int(entry.get('id')), entry)
+            except (TypeError, ValueError):
+                pass
+
+        if len(by_id) == len(entries):
+            return [by_id.get(number) for number in range(1, count + 1)]
+        # Ids missing or duplicated: trust the order
+        return (entries + [None] * count)[:count]
+
+    @staticmethod
+    def _build_quiz_item(question_text, raw_item):
+        """Validate one batched item; anything missing uses the same fallbacks as the per-question path"""
+        raw_item = raw_item or {}
+        answer = AIPoweredQuizGenerator._clean_answer(raw_item.get('answer'))
+
+        if not answer:
+            answer = AIPoweredQuizGenerator._generate_fallback_answer(question_text)
+            options = AIPoweredQuizGenerator._generate_fallback_distractors(question_text, answer)
+        else:
+            distractors = raw_item.get('distractors')
+            if not isinstance(distractors, list):
+                distractors = []
+            final_distractors = AIPoweredQuizGenerator._validate_distractors(
+                [str(distractor).strip() for distractor in distractors if distractor], answer, question_text
+            )
+            options = [answer] + final_distractors
+            random.shuffle(options)
+
+        explanation = raw_item.get('explanation')
+        if isinstance(explanation, str) and explanation.strip():
+            explanation = explanation.strip()
+        else:
+            LLMMetrics.fallback("explanation")
+            explanation = _DEFAULT_EXPLANATION
+        return {'answer': answer, 'options': options, 'explanation': explanation}
+
+    @staticmethod
+    def _clean_answer(answer):
+        """Strip quotes and keep overlong answers to their first two sentences"""
+        if not isinstance(answer, str) or not answer.strip():
+            return None
+        answer = answer.strip()
+        # Remove any quotation marks or unwanted prefixes
+        answer = re.sub(r'^["\']|["\']$', '', answer)
+        # Ensure it's not too long
+        if len(answer.split()) > 100:
+            # Truncate but maintain coherence
+            sentences = answer.split('. ')
+            if len(sentences) > 2:
+                answer = '. '.join(sentences[:2]) + '.'
+        return answer
+
+    @staticmethod
+    def _generate_concise_answer(question, context, is_premium_user, session=None):
         """
         Generate a short but detailed answer using AI
         """
@@ -97,7 +320,7 @@ class AIPoweredQuizGenerator:
             Based on the context below, provide a SHORT but DETAILED answer to the question.
             
             QUESTION: {question}
-            CONTEXT: {context[:15000]}
+            CONTEXT: {AIPoweredQuizGenerator._quiz_context(context, question, session)}
             
             Requirements for your answer:
             1. Keep it CONCISE (2-4 sentences maximum)
@@ -110,18 +333,9 @@ class AIPoweredQuizGenerator:
             Format: Provide only the answer itself, no additional text.
             """
             
-            response = AIProcessor._model.generate_content(prompt)
-            if response.text:
-                # Clean up the response
-                answer = response.text.strip()
-                # Remove any quotation marks or unwanted prefixes
-                answer = re.sub(r'^["\']|["\']$', '', answer)
-                # Ensure it's not too long
-                if len(answer.split()) > 100:
-                    # Truncate but maintain coherence
-                    sentences = answer.split('. ')
-                    if len(sentences) > 2:
-                        answer = '. '.join(sentences[:2]) + '.'
+            response = GeminiConfig.generate("answer", AIProcessor._model, prompt, session)
+            answer = AIPoweredQuizGenerator._clean_answer(response.text)
+            if answer:
                 return answer
                 
         except Exception as e:
@@ -135,6 +349,7 @@ class AIPoweredQuizGenerator:
         """
         Generate a structured fallback answer when AI fails
         """
+        LLMMetrics.fallback("answer")
         question_lower = question.lower()
         
         if any(word in question_lower for word in ['what is', 'define', 'meaning of']):
@@ -149,7 +364,7 @@ class AIPoweredQuizGenerator:
             return "This involves important concepts and principles that contribute to overall understanding and effective application in relevant contexts."
 
     @staticmethod
-    def _generate_ai_distractors(question, correct_answer, context, is_premium_user): 
+    def _generate_ai_distractors(question, correct_answer, context, is_premium_user, session=None):
         """
         Use AI to generate intelligent, plausible distractors
         """
@@ -162,7 +377,7 @@ class AIPoweredQuizGenerator:
             
             # Generate distractors using AI
             distractors = AIPoweredQuizGenerator._get_ai_distractors(
-                AIProcessor, question, correct_answer, context
+                AIProcessor, question, correct_answer, context, session
             )
             
             # Ensure we have exactly 3 good distractors
@@ -181,7 +396,7 @@ class AIPoweredQuizGenerator:
             return AIPoweredQuizGenerator._generate_fallback_distractors(question, correct_answer)
 
     @staticmethod
-    def _get_ai_distractors(ai_processor, question, correct_answer, context):
+    def _get_ai_distractors(ai_processor, question, correct_answer, context, session=None):
         """
         Use AI to generate plausible distractors
         """
@@ -190,7 +405,7 @@ class AIPoweredQuizGenerator:
         
         QUESTION: {question}
         CORRECT ANSWER: {correct_answer}
-        CONTEXT: {context[:15000]}
+        CONTEXT: {AIPoweredQuizGenerator._quiz_context(context, question, session)}
         
         Requirements:
         1. Generate exactly 3 distractors
@@ -212,7 +427,7 @@ class AIPoweredQuizGenerator:
         """
         
         try:
-            response = ai_processor._model.generate_content(prompt)
+            response = GeminiConfig.generate("distractors", ai_processor._model, prompt, session)
             if response.text:
                 # Robustly parse the response
                 distractors = []
@@ -275,6 +490,7 @@ class AIPoweredQuizGenerator:
         """
         Improved non-AI fallback distractor generation
         """
+        LLMMetrics.fallback("distractors")
         distractors = set()
         
         question_lower = question.lower()
@@ -321,7 +537,7 @@ class AIPoweredQuizGenerator:
         return options
     
     @staticmethod
-    def _generate_explanation(question, correct_answer, context, is_premium_user):
+    def _generate_explanation(question, correct_answer, context, is_premium_user, session=None):
         """
         Generate a brief explanation for the correct answer using AI
         """
@@ -337,7 +553,7 @@ class AIPoweredQuizGenerator:
             
             QUESTION: {question}
             CORRECT ANSWER: {correct_answer}
-            CONTEXT: {context[:15000]}
+            CONTEXT: {AIPoweredQuizGenerator._quiz_context(context, question, session)}
             
             Requirements:
             1. Keep it concise and to the point
@@ -347,7 +563,7 @@ class AIPoweredQuizGenerator:
             Format: Provide only the explanation itself, no additional text.
             """
             
-            response = AIProcessor._model.generate_content(prompt)
+            response = GeminiConfig.generate("explanation", AIProcessor._model, prompt, session)
             if response.text:
                 explanation = response.text.strip()
                 return explanation
@@ -355,7 +571,8 @@ class AIPoweredQuizGenerator:
         except Exception as e:
             print(f"AI explanation generation failed: {e}")
         
-        return "This answer is correct based on established knowledge and principles related to the topic."
+        LLMMetrics.fallback("explanation")
+        return _DEFAULT_EXPLANATION
 
 
 class AdvancedQuizGenerator(AIPoweredQuizGenerator):
@@ -386,17 +603,23 @@ class AdvancedQuizGenerator(AIPoweredQuizGenerator):
             
             categorized_questions = AdvancedQuizGenerator._categorize_questions(qa_pairs)
             
-            created_count = 0
+            selected = []
             for difficulty in ['easy', 'medium', 'hard']:
-                for qa_pair in categorized_questions.get(difficulty, [])[:QUESTIONS_PER_DIFFICULTY]:
-                    if created_count >= NEW_MAX_QUESTIONS:
-                        break
-                        
-                    AdvancedQuizGenerator._create_varied_question(
-                        quiz, qa_pair, summary, 
-                        processing_result.user.premium_user
-                    )
-                    created_count += 1
+                selected.extend(categorized_questions.get(difficulty, [])[:QUESTIONS_PER_DIFFICULTY])
+            questions = [qa_pair.get('question', '') for qa_pair in selected[:NEW_MAX_QUESTIONS]]
+            questions = [question_text for question_text in questions if question_text]
+            
+            # Always generate new concise answers (batched, see AIPoweredQuizGenerator.BATCH_MODE)
+            items = AIPoweredQuizGenerator._generate_quiz_items(
+                questions, PassageIndex.for_result(processing_result) or summary,
+                processing_result.user.premium_user, with_explanations=False,
+            )
+            
+            Question.objects.bulk_create([
+                AdvancedQuizGenerator._build_varied_question(quiz, question_text, item)
+                for question_text, item in zip(questions, items)
+            ])
+            created_count = len(questions)
             
             quiz.total_questions = created_count
             quiz.save()
@@ -435,39 +658,28 @@ class AdvancedQuizGenerator(AIPoweredQuizGenerator):
         return categorized
 
     @staticmethod
-    def _create_varied_question(quiz, qa_pair, context, is_premium_user):
+    def _build_varied_question(quiz, question_text, item):
         """
-        Create different types of questions with AI-generated answers
+        Unsaved Question of the best type for the generated answer
         """
-        question_text = qa_pair.get('question', '')
-        
-        # Always generate a new concise answer
-        concise_answer = AIPoweredQuizGenerator._generate_concise_answer(
-            question_text, context, is_premium_user
-        )
-        
-        if not concise_answer:
-            return
-            
+        concise_answer = item['answer']
         question_type = AdvancedQuizGenerator._determine_question_type(question_text, concise_answer)
         
         if question_type == "true_false" and len(concise_answer) < 100:
-            AdvancedQuizGenerator._create_true_false_question(quiz, question_text, concise_answer)
-        else:
-            # Use the AI-powered multiple choice
-            options = AIPoweredQuizGenerator._generate_ai_distractors(
-                question_text, concise_answer, context, is_premium_user
-            )
-            
-            Question.objects.create(
-                quiz=quiz,
-                text=question_text,
-                answer=concise_answer,
-                option_1=options[0],
-                option_2=options[1],
-                option_3=options[2],
-                option_4=options[3],
-            )
+            return AdvancedQuizGenerator._build_true_false_question(quiz, question_text, concise_answer)
+        
+        # Use the AI-powered multiple choice
+        options = item['options']
+        return Question(
+            quiz=quiz,
+            text=question_text,
+            answer=concise_answer,
+            explanation=item['explanation'],
+            option_1=options[0],
+            option_2=options[1],
+            option_3=options[2],
+            option_4=options[3],
+        )
 
     @staticmethod
     def _determine_question_type(question, answer):
@@ -485,14 +697,14 @@ class AdvancedQuizGenerator(AIPoweredQuizGenerator):
         return "multiple_choice"
 
     @staticmethod
-    def _create_true_false_question(quiz, question_text, correct_answer):
+    def _build_true_false_question(quiz, question_text, correct_answer):
         """
-        Create a True/False question with AI-generated content
+        Unsaved True/False question with AI-generated content
         """
         # For T/F questions, we need to frame them as statements
         statement = question_text
         
-        Question.objects.create(
+        return Question(
             quiz=quiz,
             text=f"True or False: {statement}",
             answer="True",  # Assuming the generated answer makes it true
@@ -0,0 +1,292 @@
+import asyncio
+import functools
+import math
+import random
+import threading
+import time
+
+from django.conf import settings
+from google.api_core import exceptions as google_exceptions
+
+from .fake_backends import prompt_text
+from .gemini_client import GeminiClient
+from .token_budget import TokenEstimator
+
+# Two token buckets per model, requests and tokens, each holding at most one minute of quota
+# and refilled continuously from the Redis clock. ARGV: rpm, tpm, requests, tokens, mode.
+#   acquire: take requests/tokens if both buckets have them, else take nothing
+#   settle:  give back tokens (negative: charge more) once the real usage is known
+#   peek:    refill only
+# Returns {ms to wait before acquire can succeed (0: taken), requests left, tokens left}.
+_BUCKET_SCRIPT = """
+local now = redis.call('TIME')
+local now_ms = tonumber(now[1]) * 1000 + math.floor(tonumber(now[2]) / 1000)
+local rpm, tpm = tonumber(ARGV[1]), tonumber(ARGV[2])
+local want_requests, want_tokens, mode = tonumber(ARGV[3]), tonumber(ARGV[4]), ARGV[5]
+
+local state = redis.call('HMGET', KEYS[1], 'requests', 'tokens', 'ts')
+local requests = tonumber(state[1]) or rpm
+local tokens = tonumber(state[2]) or tpm
+local elapsed = math.max(0, now_ms - (tonumber(state[3]) or now_ms))
+requests = math.min(rpm, requests + elapsed * rpm / 60000)
+tokens = math.min(tpm, tokens + elapsed * tpm / 60000)
+
+local wait = 0
+if mode == 'acquire' then
+  wait = math.max(0,
+    math.ceil((want_requests - requests) * 60000 / rpm),
+    math.ceil((want_tokens - tokens) * 60000 / tpm))
+  if wait == 0 then
+    requests = requests - want_requests
+    tokens = tokens - want_tokens
+  end
+elseif mode == 'settle' then
+  tokens = math.min(tpm, tokens + want_tokens)
+end
+
+redis.call('HSET', KEYS[1], 'requests', tostring(requests), 'tokens', tostring(tokens), 'ts', now_ms)
+redis.call('PEXPIRE', KEYS[1], 120000)
+return {wait, tostring(requests), tostring(tokens)}
+"""
+
+
+class RateLimiter:
+    """
+    Requests- and tokens-per-minute quota per Gemini model, shared by every worker process
+    through Redis (GEMINI_RATE_LIMITS['REDIS_URL']; without it, buckets are per process).
+    A call reserves one request and its estimated prompt plus OUTPUT_TOKENS tokens, waits
+    until both buckets have them (at most MAX_WAIT seconds, then ResourceExhausted so routing
+    moves to the next model), and gives back what the response's usage shows it did not use.
+
+    Only real Gemini models are wrapped (RateLimitedModel, below the response cache), so
+    cached answers and the fake and replay backends never spend quota.
+    """
+
+    _redis = None
+    _script = None
+    _local = {}  # bucket key -> (requests, tokens, monotonic ts), without Redis
+    _lock = threading.Lock()
+
+    # ── Config ────────────────────────────────────────────────────────────
+
+    @staticmethod
+    def _config():
+        return getattr(settings, "GEMINI_RATE_LIMITS", {})
+
+    @classmethod
+    def enabled(cls):
+        return cls._config().get("ENABLED", True)
+
+    @classmethod
+    def limits(cls, model_name):
+        """(rpm, tpm) of a model: MODELS entry, else DEFAULT"""
+        config = cls._config()
+        limits = config.get("MODELS", {}).get(cls._short_name(model_name)) or config.get("DEFAULT", {})
+        return max(1, limits.get("RPM", 1000)), max(1, limits.get("TPM", 1_000_000))
+
+    # ── Public API ────────────────────────────────────────────────────────
+
+    @classmethod
+    def wrap(cls, model):
+        return RateLimitedModel(model) if cls.enabled() else model
+
+    @classmethod
+    def reserve(cls, model_name, contents):
+        """Tokens to reserve for a call: its estimated prompt and OUTPUT_TOKENS of answer"""
+        tokens = TokenEstimator.estimate(prompt_text(contents)) + cls._config().get("OUTPUT_TOKENS", 1024)
+        # A prompt bigger than the whole minute's quota would never fit: it waits for a full bucket
+        return min(tokens, cls.limits(model_name)[1])
+
+    @classmethod
+    def try_acquire(cls, model_name, tokens):
+        """0 when the request and tokens were taken, else seconds until they may be"""
+        wait_ms, _, _ = cls._run(model_name, "acquire", 1, tokens)
+        return wait_ms / 1000
+
+    @classmethod
+    def acquire(cls, model_name, tokens):
+        """Block until the quota allows the call"""
+        deadline = time.monotonic() + cls._config().get("MAX_WAIT", 120)
+        while True:
+            wait = cls.try_acquire(model_name, tokens)
+            if not wait:
+                return
+            cls._check_deadline(model_name, deadline, wait)
+            time.sleep(cls._jittered(wait))
+
+    @classmethod
+    async def acquire_async(cls, model_name, tokens):
+        """acquire() for the GeminiClient loop: waiting leaves the loop free for other requests"""
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + cls._config().get("MAX_WAIT", 120)
+        while True:
+            wait = await loop.run_in_executor(None, cls.try_acquire, model_name, tokens)
+            if not wait:
+                return
+            cls._check_deadline(model_name, deadline, wait)
+            await asyncio.sleep(cls._jittered(wait))
+
+    @classmethod
+    def settle(cls, model_name, reserved, response):
+        """Return the reserved tokens the response did not use (or charge the ones it went over)"""
+        usage = getattr(response, "usage_metadata", None)
+        used = getattr(usage, "total_token_count", None)
+        if isinstance(used, int) and used != reserved:
+            cls._run(model_name, "settle", 0, reserved - used)
+
+    @classmethod
+    def headroom(cls):
+        """{model: {"requests", "tokens", "rpm", "tpm"}}: what is left of each configured model's quota now"""
+        routing = settings.MODEL_ROUTING
+        models = set(cls._config().get("MODELS", {})) | set(routing['DEFAULT'])
+        for rules in routing['ROUTES'].values():
+            models.update(name for rule in rules for name in rule['MODELS'])
+        with cls._lock:
+            models.update(key.rsplit(":", 1)[-1] for key in cls._local)
+        headroom = {}
+        for model_name in sorted(models):
+            rpm, tpm = cls.limits(model_name)
+            _, requests, tokens = cls._run(model_name, "peek", 0, 0)
+            headroom[model_name] = {"requests": int(requests), "tokens": int(tokens), "rpm": rpm, "tpm": tpm}
+        return headroom
+
+    # ── Private helpers ───────────────────────────────────────────────────
+
+    @staticmethod
+    def _short_name(model_name):
+        return (model_name or "model").split("/")[-1]
+
+    @classmethod
+    def _key(cls, model_name):
+        return f"{cls._config().get('KEY_PREFIX', 'socratic:quota')}:{cls._short_name(model_name)}"
+
+    @classmethod
+    def _run(cls, model_name, mode, requests, tokens):
+        rpm, tpm = cls.limits(model_name)
+        client = cls._client()
+        if client is None:
+            return cls._run_local(cls._key(model_name), rpm, tpm, requests, tokens, mode)
+        try:
+            wait_ms, left_requests, left_tokens = cls._script(
+                keys=[cls._key(model_name)], args=[rpm, tpm, requests, tokens, mode], client=client
+            )
+            return int(wait_ms), float(left_requests), float(left_tokens)
+        except Exception as e:
+            # Never hold up generation on the limiter itself: the call goes ahead unmetered
+            print(f"Rate limiter unavailable, not limiting {cls._short_name(model_name)}: {str(e)}")
+            return 0, float(rpm), float(tpm)
+
+    @classmethod
+    def _run_local(cls, key, rpm, tpm, want_requests, want_tokens, mode):
+        """_BUCKET_SCRIPT for one process"""
+        with cls._lock:
+            now = time.monotonic()
+            requests, tokens, last = cls._local.get(key, (rpm, tpm, now))
+            elapsed = max(0.0, now - last)
+            requests = min(rpm, requests + elapsed * rpm / 60)
+            tokens = min(tpm, tokens + elapsed * tpm / 60)
+
+            wait_ms = 0
+            if mode == "acquire":
+                wait_ms = max(
+                    0,
+                    math.ceil((want_requests - requests) * 60000 / rpm),
+                    math.ceil((want_tokens - tokens) * 60000 / tpm),
+                )
+                if wait_ms == 0:
+                    requests -= want_requests
+                    tokens -= want_tokens
+            elif mode == "settle":
+                tokens = min(tpm, tokens + want_tokens)
+
+            cls._local[key] = (requests, tokens, now)
+            return int(wait_ms), requests, tokens
+
+    @classmethod
+    def _client(cls):
+        url = cls._config().get("REDIS_URL")
+        if not url:
+            return None
+        with cls._lock:
+            if cls._redis is None:
+                import redis
+
+                cls._redis = redis.Redis.from_url(url, socket_timeout=2)
+                cls._script = cls._redis.register_script(_BUCKET_SCRIPT)
+            return cls._redis
+
+    @classmethod
+    def _check_deadline(cls, model_name, deadline, wait):
+        if time.monotonic() + wait > deadline:
+            raise google_exceptions.ResourceExhausted(
+                f"{cls._short_name(model_name)} quota not available within "
+                f"{cls._config().get('MAX_WAIT', 120)}s (rate limiter)"
+            )
+
+    @staticmethod
+    def _jittered(wait):
+        # Waiters woken together would otherwise all retry in the same millisecond
+        return wait * random.uniform(1.0, 1.1)
+
+
+class RateLimitedModel:
+    """
+    Wraps a genai.GenerativeModel so every generate_content() waits for RateLimiter quota.
+    Everything else (model_name, count_tokens, ...) is passed through to the wrapped model.
+    """
+
+    # On the async path the GeminiClient in-flight slot is taken here, after the quota wait
+    acquires_slot = True
+
+    def __init__(self, model):
+        self._wrapped = model
+
+    def __getattr__(self, name):
+        return getattr(self._wrapped, name)
+
+    def generate_content(self, contents, **kwargs):
+        model_name = getattr(self._wrapped, "model_name", "model")
+        reserved = RateLimiter.reserve(model_name, contents)
+        RateLimiter.acquire(model_name, reserved)
+        response = self._wrapped.generate_content(contents, **kwargs)
+        if not kwargs.get("stream"):
+            RateLimiter.settle(model_name, reserved, response)
+        return response
+
+    async def generate_content_async(self, contents, **kwargs):
+        """
+        Same as generate_content for the async client; sync-only models run in the default executor.
+        The in-flight slot is only taken once quota is granted, and a stream keeps it until its
+        last chunk.
+        """
+        model_name = getattr(self._wrapped, "model_name", "model")
+        reserved = RateLimiter.reserve(model_name, contents)
+        await RateLimiter.acquire_async(model_name, reserved)
+        if kwargs.get("stream"):
+            # Streams keep their reservation: usage is only known after the last chunk
+            return self._stream_in_slot(model_name, contents, kwargs)
+
+        loop = asyncio.get_running_loop()
+        async with GeminiClient.slot(model_name):
+            response = await self._call_async(contents, kwargs)
+        await loop.run_in_executor(None, RateLimiter.settle, model_name, reserved, response)
+        return response
+
+    async def _stream_in_slot(self, model_name, contents, kwargs):
+        async with GeminiClient.slot(model_name):
+            response = await self._call_async(contents, kwargs)
+            if hasattr(response, "__aiter__"):
+                async for chunk in response:
+                    yield chunk
+            else:
+                # Sync-only model: its chunks were read in the executor
+                for chunk in response:
+                    yield chunk
+
+    async def _call_async(self, contents, kwargs):
+        if hasattr(self._wrapped, "generate_content_async"):
+            return await self._wrapped.generate_content_async(contents, **kwargs)
+        call = functools.partial(self._wrapped.generate_content, contents, **kwargs)
+        if kwargs.get("stream"):
+            return await asyncio.get_running_loop().run_in_executor(None, lambda: list(call()))
+        return await asyncio.get_running_loop().run_in_executor(None, call)
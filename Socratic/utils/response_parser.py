@@ -0,0 +1,161 @@
+import re
+
+
+class StreamParser:
+    """
+    Line-oriented parser for model output. feed() takes any slice of the text (a chunk or the
+    whole response) and returns the items it completed; close() flushes the last line and the
+    item still open. Each line is looked at once, so parsing is linear in the response length.
+    """
+
+    def __init__(self):
+        self.items = []
+        self._partial = []  # pieces of the current, unfinished line
+
+    @classmethod
+    def parse(cls, text):
+        """Every item of a complete response"""
+        parser = cls()
+        parser.feed(text)
+        parser.close()
+        return parser.items
+
+    def feed(self, text):
+        if "\n" not in text:
+            self._partial.append(text)
+            return []
+
+        lines = text.split("\n")
+        lines[0] = "".join(self._partial) + lines[0]
+        self._partial = [lines.pop()]
+
+        completed = []
+        for line in lines:
+            completed.extend(self._line(self._clean(line)))
+        return self._emit(completed)
+
+    def close(self):
+        completed = self._line(self._clean("".join(self._partial)))
+        self._partial = []
+        completed.extend(self._finish())
+        return self._emit(completed)
+
+    # ── Subclass hooks ────────────────────────────────────────────────────
+
+    def _line(self, line):
+        """Advance the state machine by one line; returns the items it closed"""
+        raise NotImplementedError
+
+    def _finish(self):
+        """Items still open at the end of the response"""
+        raise NotImplementedError
+
+    # ── Private helpers ───────────────────────────────────────────────────
+
+    @staticmethod
+    def _clean(line):
+        # Bold/italic markers some models add (**Q1:** → Q1:) and Windows line ends
+        return line.replace("*", "").rstrip("\r")
+
+    def _emit(self, completed):
+        self.items.extend(completed)
+        return completed
+
+
+class QAStreamParser(StreamParser):
+    """
+    Q<n>: / A<n>: blocks (also Q<n>. and Q<n>)). A block runs until the next header line and
+    may span several lines; only headers at the start of a line count, so prose that happens
+    to start with Q or A is never taken for one. A pair is emitted when both its blocks have
+    closed, whatever their order; repeated numbers after that are ignored.
+    """
+
+    HEADER = re.compile(r"^([QA])(\d+)\s*[:\.\)]\s*(.*)$")
+
+    def __init__(self):
+        super().__init__()
+        self._block = None  # (kind, number, lines)
+        self._questions = {}
+        self._answers = {}
+        self._done = set()
+
+    def _line(self, line):
+        match = self.HEADER.match(line)
+        if not match:
+            if self._block:
+                self._block[2].append(line)
+            return []
+
+        completed = self._close_block()
+        self._block = (match.group(1), int(match.group(2)), [match.group(3)])
+        return completed
+
+    def _finish(self):
+        return self._close_block()
+
+    def _close_block(self):
+        if not self._block:
+            return []
+        kind, number, lines = self._block
+        self._block = None
+        text = "\n".join(lines).strip()
+        if not text or number in self._done:
+            return []
+
+        (self._questions if kind == "Q" else self._answers)[number] = text
+        if number not in self._questions or number not in self._answers:
+            return []
+        self._done.add(number)
+        return [{
+            "id":         number,
+            "question":   self._questions.pop(number),
+            "answer":     self._answers.pop(number),
+            "type":       "concept_based",
+            "difficulty": "medium",
+        }]
+
+
+class FlashcardStreamParser(StreamParser):
+    """
+    TERM: / DEFINITION: cards, case-insensitive. The term is the rest of its line, the
+    definition runs until the next TERM: line. Cards are paired as they are read, so a TERM
+    without a DEFINITION (or the reverse) is dropped on its own instead of shifting every
+    later card.
+    """
+
+    TERM = re.compile(r"^TERM\s*:\s*(.*)$", re.IGNORECASE)
+    DEFINITION = re.compile(r"^DEFINITION\s*:\s*(.*)$", re.IGNORECASE)
+
+    def __init__(self):
+        super().__init__()
+        self._term = None
+        self._definition = None  # lines, once DEFINITION: was seen
+
+    def _line(self, line):
+        match = self.TERM.match(line)
+        if match:
+            completed = self._close_card()
+            self._term = match.group(1).strip()
+            return completed
+
+        match = self.DEFINITION.match(line)
+        if match:
+            # A second DEFINITION: closes the card; the new one has no term and is dropped
+            completed = self._close_card() if self._definition is not None else []
+            self._definition = [match.group(1)]
+            return completed
+
+        if self._definition is not None:
+            self._definition.append(line)
+        return []
+
+    def _finish(self):
+        return self._close_card()
+
+    def _close_card(self):
+        term, definition = self._term, self._definition
+        self._term = self._definition = None
+        definition = "\n".join(definition).strip() if definition is not None else ""
+        if term and definition:
+            return [{"term": term, "definition": definition}]
+        return []
@@ -0,0 +1,103 @@
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+class SummaryStream:
+    """
+    Live summary text for the status SSE stream. The Celery worker publishes the summary as
+    Gemini streams it; processing_status_stream polls read() and forwards what is new as
+    `summary_delta` events. The shared cache (Redis in production) carries the text, so the
+    worker and the web process do not need a direct connection.
+    """
+
+    # ── Config ────────────────────────────────────────────────────────────
+
+    @staticmethod
+    def _config():
+        return getattr(settings, "SUMMARY_STREAM", {})
+
+    @classmethod
+    def enabled(cls):
+        return cls._config().get("ENABLED", True)
+
+    @classmethod
+    def _cache(cls):
+        return caches[cls._config().get("CACHE_ALIAS", "default")]
+
+    @staticmethod
+    def make_key(result_id):
+        return f"summary-stream:{result_id}"
+
+    # ── Public API ────────────────────────────────────────────────────────
+
+    @classmethod
+    def publisher(cls, result_id):
+        """Callable taking each text delta (pass as on_summary_delta); call .close() when done"""
+        return _Publisher(cls, result_id)
+
+    @classmethod
+    def publish(cls, result_id, text, done=False):
+        try:
+            cls._cache().set(cls.make_key(result_id), {"text": text, "done": done}, cls._config().get("TIMEOUT", 3600))
+        except Exception as e:
+            print(f"Summary stream publish failed: {str(e)}")
+
+    @classmethod
+    def read(cls, result_id):
+        """(text so far, done) — ("", False) when nothing was published"""
+        try:
+            entry = cls._cache().get(cls.make_key(result_id))
+        except Exception as e:
+            print(f"Summary stream read failed: {str(e)}")
+            entry = None
+        if not entry:
+            return "", False
+        return entry["text"], entry["done"]
+
+    @classmethod
+    def clear(cls, result_id):
+        cls._cache().delete(cls.make_key(result_id))
+
+
+class _Publisher:
+    """
+    Accumulates deltas and writes the text at most every PUBLISH_INTERVAL seconds. Deltas
+    after close() are ignored: a streamed call that overran its timeout keeps running on its
+    own and must not overwrite the final text.
+    """
+
+    def __init__(self, stream, result_id):
+        self.stream = stream
+        self.result_id = result_id
+        self.interval = stream._config().get("PUBLISH_INTERVAL", 0.25)
+        self.parts = []
+        self.last_publish = 0.0
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def __call__(self, delta):
+        if not delta:
+            return
+        # Published under the lock, so a write in progress cannot land after close()'s
+        with self.lock:
+            if self.closed:
+                return
+            self.parts.append(delta)
+            now = time.monotonic()
+            # The first delta goes out at once: that is the time-to-first-content users see
+            if self.last_publish and now - self.last_publish < self.interval:
+                return
+            self.last_publish = now
+            self.stream.publish(self.result_id, "".join(self.parts))
+
+    def close(self, final_text=None):
+        """Mark the stream done; final_text (the stored summary) replaces the streamed text if given"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            text = "".join(self.parts) if final_text is None else final_text
+            self.stream.publish(self.result_id, text, done=True)
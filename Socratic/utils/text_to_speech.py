@@ -7,6 +7,38 @@ from io import BytesIO
 from pydub import AudioSegment
 import tempfile
 import os
+from .fake_backends import FakeCalls, silent_mp3
+
+
+class GTTSBackend:
+    """Google Translate TTS via gTTS (free, network-bound)"""
+
+    name = 'gtts'
+
+    def write_to_fp(self, text, fp):
+        gTTS(text=text, lang='en', slow=False, lang_check=False).write_to_fp(fp)
+
+
+class FakeTTSBackend:
+    """Offline stand-in for load tests: silent MP3 as long as the text, after FAKE_BACKENDS['LATENCY']['tts']"""
+
+    name = 'fake'
+
+    def write_to_fp(self, text, fp):
+        FakeCalls.call('tts')
+        fp.write(silent_mp3(text))
+
+
+TTS_BACKENDS = {backend.name: backend for backend in (GTTSBackend, FakeTTSBackend)}
+
+
+def get_tts_backend(name=None):
+    """Return the TTS backend selected by TTS_CONFIG['BACKEND'] (or by name)"""
+    name = (name or settings.TTS_CONFIG['BACKEND']).lower()
+    if name not in TTS_BACKENDS:
+        raise Exception(f"Unknown TTS backend: {name} (expected one of {', '.join(TTS_BACKENDS)})")
+    return TTS_BACKENDS[name]()
+
 
 class TextToSpeech:
     """
@@ -38,16 +70,9 @@ class TextToSpeech:
             
             print(f"Generating audio for text length: {len(clean_text)} characters")
             
-            tts = gTTS(
-                text=clean_text, 
-                lang='en', 
-                slow=False, 
-                lang_check=False
-            )
-            
             # Save to in-memory buffer
             buffer = BytesIO()
-            tts.write_to_fp(buffer)
+            get_tts_backend().write_to_fp(clean_text, buffer)
             buffer.seek(0)
             
             # Save directly to R2 using Django's storage
@@ -126,17 +151,9 @@ class TextToSpeech:
             try:
                 for i, chunk in enumerate(chunks):
                     if chunk.strip():
-                        # Generate TTS for chunk
-                        tts = gTTS(
-                            text=TextToSpeech._prepare_text_for_tts(chunk), 
-                            lang='en', 
-                            slow=False, 
-                            lang_check=False
-                        )
-                        
-                        # Save to temporary file
+                        # Generate TTS for chunk and save to temporary file
                         temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.mp3')
-                        tts.write_to_fp(temp_file)
+                        get_tts_backend().write_to_fp(TextToSpeech._prepare_text_for_tts(chunk), temp_file)
                         temp_file.close()
                         temp_files.append(temp_file.name)
                         
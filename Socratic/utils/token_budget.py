@@ -0,0 +1,137 @@
+import math
+import re
+
+from django.conf import settings
+
+
+# Word pieces, single digits (Gemini tokenises digits one by one) and any other visible character
+_PIECE_RE = re.compile(r"[^\W\d_]+|\d|[^\w\s]|_")
+_HEADING_RE = re.compile(r"\n(?=#{1,6} )")
+_KEYWORD_RE = re.compile(r"[a-z][a-z\-]{3,}")
+
+_STOPWORDS = frozenset("""
+    about above after again against also among because been before being below between both could does
+    doing down during each explain from further have having here into itself just more most much must
+    other over same should some such than that their them then there these they this those through
+    under until very were what when where which while whom with within would your yours describe define
+    discuss list state give outline name briefly using used uses example examples marks question
+""".split())
+
+
+class TokenEstimator:
+    """
+    Offline token estimate for Gemini prompts, so prompts can be budgeted without a
+    count_tokens round trip. Words cost one token per ~CHARS_PER_WORD_TOKEN letters (at
+    least one), digits and punctuation one token each; the total is scaled by
+    PROMPT_TOKEN_BUDGETS['CALIBRATION'] (fit it with calibrate() against count_tokens results).
+    """
+
+    CHARS_PER_WORD_TOKEN = 4.5
+
+    @classmethod
+    def estimate(cls, text):
+        if not text:
+            return 0
+        tokens = 0
+        for piece in _PIECE_RE.findall(text):
+            if len(piece) > 1:
+                tokens += max(1, math.ceil(len(piece) / cls.CHARS_PER_WORD_TOKEN))
+            else:
+                tokens += 1
+        return math.ceil(tokens * settings.PROMPT_TOKEN_BUDGETS.get('CALIBRATION', 1.0))
+
+    @classmethod
+    def calibrate(cls, samples):
+        """
+        Calibration factor from (text, actual_tokens) pairs, e.g. model.count_tokens() of a few
+        real uploads; put the result in PROMPT_TOKEN_BUDGET_CALIBRATION.
+        """
+        estimated = sum(cls.estimate(text) for text, _ in samples) / settings.PROMPT_TOKEN_BUDGETS.get('CALIBRATION', 1.0)
+        actual = sum(tokens for _, tokens in samples)
+        return round(actual / estimated, 3) if estimated else 1.0
+
+
+class PromptPacker:
+    """
+    Fill a token budget with whole sections instead of cutting text at a character offset.
+    Sections that share keywords with the priority text (past exam questions, quiz questions)
+    are taken first; the packed text keeps the document order.
+    """
+
+    SEPARATOR = "\n\n"
+
+    @classmethod
+    def pack(cls, sections, budget, priority_text="", label="prompt"):
+        """
+        sections: list of strings (see split_sections). Returns a dict with 'text', 'tokens',
+        'sections' (packed / total) and 'prioritised' (packed sections that matched priority_text).
+        """
+        sections = [section.strip() for section in sections if section and section.strip()]
+        costs = [TokenEstimator.estimate(section) for section in sections]
+        separator_cost = TokenEstimator.estimate(cls.SEPARATOR)
+        scores = cls._scores(sections, priority_text)
+
+        order = sorted(range(len(sections)), key=lambda index: (-scores[index], index))
+        chosen, used = set(), 0
+        for index in order:
+            cost = costs[index] + (separator_cost if chosen else 0)
+            if used + cost <= budget:
+                chosen.add(index)
+                used += cost
+
+        packed = [sections[index] for index in sorted(chosen)]
+        if not packed and sections:
+            # Even the best section is over budget on its own: keep its first part
+            best = order[0]
+            ratio = len(sections[best]) / max(1, costs[best])
+            packed = [sections[best][:int(budget * ratio)]]
+            chosen = {best}
+            used = TokenEstimator.estimate(packed[0])
+
+        report = {
+            'text': cls.SEPARATOR.join(packed),
+            'tokens': used,
+            'sections': (len(chosen), len(sections)),
+            'prioritised': sum(1 for index in chosen if scores[index] > 0),
+        }
+        print(
+            f"Packed {label}: ~{used}/{budget} tokens, {len(chosen)}/{len(sections)} sections "
+            f"({report['prioritised']} matched priority text)"
+        )
+        return report
+
+    @classmethod
+    def split_sections(cls, text, budget=None):
+        """
+        Split text into packable sections: markdown headings start a section; plain text
+        (and any section larger than budget) is split into paragraphs.
+        """
+        if not text:
+            return []
+        sections = _HEADING_RE.split(text) if _HEADING_RE.search(text) else text.split(cls.SEPARATOR)
+        if budget is None:
+            return sections
+
+        split = []
+        for section in sections:
+            if TokenEstimator.estimate(section) > budget:
+                split.extend(section.split(cls.SEPARATOR))
+            else:
+                split.append(section)
+        return split
+
+    @staticmethod
+    def words(text):
+        """Content words of text in order, repeats kept (the terms keywords() and extractive ranking use)"""
+        return [word for word in _KEYWORD_RE.findall((text or "").lower()) if word not in _STOPWORDS]
+
+    @classmethod
+    def keywords(cls, text):
+        return set(cls.words(text))
+
+    @classmethod
+    def _scores(cls, sections, priority_text):
+        keywords = cls.keywords(priority_text)
+        if not keywords:
+            return [0] * len(sections)
+        return [len(keywords & cls.keywords(section)) for section in sections]
@@ -16,6 +16,7 @@ from .utils.free_ai_processor import AIProcessor
 from .utils.text_to_speech import TextToSpeech
 from .utils.pdf_generator import PDFGenerator, AdvancedPDFGenerator
 from .utils.quiz_generator import AdvancedQuizGenerator, AIPoweredQuizGenerator
+from .utils.summary_stream import SummaryStream
 from drf_yasg.utils import swagger_auto_schema
 from drf_yasg import openapi
 from rest_framework.decorators import api_view, permission_classes, parser_classes, throttle_classes
@@ -503,10 +504,29 @@ async def processing_status_stream(request, pk):
                     'timestamp': timezone.now().isoformat()
                 }
 
+            # Summary text streamed by the worker (SummaryStream), forwarded as summary_delta events
+            read_summary = sync_to_async(SummaryStream.read)
+            sent_summary = ""
+            summary_done_sent = False
+            
             while retry_count < max_retries:
                 try:
                     current_data = await check_updates(pk, user)
                     
+                    summary_text, summary_done = await read_summary(pk)
+                    if summary_text and not summary_text.startswith(sent_summary):
+                        # Task retried, or the stored summary differs from the streamed one: start over
+                        yield f"event: summary_reset\ndata: {json.dumps({'id': str(pk)})}\n\n"
+                        sent_summary = ""
+                    if len(summary_text) > len(sent_summary):
+                        summary_delta = {'delta': summary_text[len(sent_summary):], 'offset': len(sent_summary)}
+                        yield f"event: summary_delta\ndata: {json.dumps(summary_delta)}\n\n"
+                        sent_summary = summary_text
+                        retry_count = 0
+                    if summary_done and not summary_done_sent:
+                        yield f"event: summary_done\ndata: {json.dumps({'length': len(sent_summary)})}\n\n"
+                        summary_done_sent = True
+                    
                     current_status = current_data['status']
                     current_stage = current_data['processing_stage']
                     current_progress = current_data['stage_progress']
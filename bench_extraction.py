@@ -0,0 +1,55 @@
+"""
+Extraction benchmark: times DocumentProcessor stages on a synthetic (and optional real) corpus.
+
+    python bench_extraction.py --output bench.json
+    python bench_extraction.py --baseline bench.json --threshold 0.10 --only 'pdf-text-*'
+
+Exits with status 1 when any measurement is slower than the baseline by more than the threshold.
+"""
+import argparse
+import os
+import sys
+import tempfile
+
+import django
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Config.settings')
+django.setup()
+
+from Socratic.utils.extraction_benchmark import BenchmarkCorpus, ExtractionBenchmark
+
+
+parser = argparse.ArgumentParser(description="Benchmark document extraction")
+parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'socratic-bench-corpus'),
+                    help="where generated documents are cached")
+parser.add_argument('--real-dir', help="folder of real PDF/DOCX/image files to include")
+parser.add_argument('--only', nargs='*', help="run documents whose name matches any of these globs, e.g. 'pdf-*'")
+parser.add_argument('--repeat', type=int, default=3)
+parser.add_argument('--output', help="write the JSON report here")
+parser.add_argument('--baseline', help="JSON report to compare against")
+parser.add_argument('--threshold', type=float, default=0.15, help="allowed slowdown, 0.15 = 15%%")
+parser.add_argument('--min-seconds', type=float, default=0.005,
+                    help="skip measurements faster than this in both runs (timer noise)")
+args = parser.parse_args()
+
+documents = BenchmarkCorpus.build(args.workdir, only=args.only, real_dir=args.real_dir)
+report = ExtractionBenchmark.run(documents, repeat=args.repeat)
+
+if args.output:
+    ExtractionBenchmark.dump(report, args.output)
+    print(f"Report written to {args.output}")
+
+if args.baseline:
+    rows = ExtractionBenchmark.compare(
+        report, ExtractionBenchmark.load(args.baseline), args.threshold, args.min_seconds
+    )
+    for row in rows:
+        flag = "REGRESSED" if row['regressed'] else ""
+        print(f"{row['key']:<50} {row['baseline_seconds']:>9.4f}s -> {row['current_seconds']:>9.4f}s "
+              f"{row['change']:>+8.1%} {flag}")
+    regressions = [row for row in rows if row['regressed']]
+    if regressions:
+        print(f"{len(regressions)} of {len(rows)} measurements regressed by more than {args.threshold:.0%}")
+        sys.exit(1)
+    print(f"No regressions beyond {args.threshold:.0%} ({len(rows)} measurements compared)")
@@ -0,0 +1,56 @@
+"""
+Pipeline load test: pushes N documents through process_document_task and reports throughput
+and latency percentiles per stage.
+
+    LLM_BACKEND=fake OCR_BACKEND=fake TTS_BACKEND=fake python bench_pipeline.py -n 20 --concurrency 4
+    LLM_BACKEND=fake FAKE_ERROR_RATE=0.05 FAKE_LLM_LATENCY=4 python bench_pipeline.py -n 50 --mode celery
+
+Record real responses once with LLM_BACKEND=record (needs GEMINI_API_KEY), then rerun the same
+documents with LLM_BACKEND=replay. Set LLM_CACHE_ENABLED=false and EXTRACTION_CACHE_ENABLED=false
+to measure cold documents (the corpus is reused round-robin).
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+
+import django
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'Config.settings')
+django.setup()
+
+from Socratic.utils.extraction_benchmark import BenchmarkCorpus
+from Socratic.utils.pipeline_benchmark import PipelineLoadTest
+
+
+parser = argparse.ArgumentParser(description="Load test the document processing pipeline")
+parser.add_argument('-n', '--documents', type=int, default=10, help="documents to process")
+parser.add_argument('--mode', choices=('eager', 'celery'), default='eager',
+                    help="eager: run the task in this process; celery: dispatch to running workers")
+parser.add_argument('--concurrency', type=int, default=1, help="eager mode: documents processed at once")
+parser.add_argument('--premium', action='store_true', help="premium generation (map-reduce, flashcards)")
+parser.add_argument('--workdir', default=os.path.join(tempfile.gettempdir(), 'socratic-bench-corpus'),
+                    help="where generated documents are cached")
+parser.add_argument('--real-dir', help="folder of real PDF/DOCX/image files to include")
+parser.add_argument('--only', nargs='*', default=['pdf-text-10', 'docx-text-10'],
+                    help="corpus documents to use (globs, see bench_extraction.py)")
+parser.add_argument('--timeout', type=int, default=3600, help="celery mode: seconds to wait for the workers")
+parser.add_argument('--keep', action='store_true', help="keep the ProcessingResult rows that were created")
+parser.add_argument('--output', help="write the JSON report here")
+args = parser.parse_args()
+
+documents = BenchmarkCorpus.build(args.workdir, only=args.only, real_dir=args.real_dir)
+if not documents:
+    sys.exit("No documents matched --only")
+
+report = PipelineLoadTest.run(
+    documents, args.documents, mode=args.mode, concurrency=args.concurrency,
+    premium=args.premium, timeout=args.timeout, keep=args.keep,
+)
+
+if args.output:
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True)
+    print(f"Report written to {args.output}")
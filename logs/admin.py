@@ -1,5 +1,6 @@
 from django.contrib import admin
-from .models import LogEntry
+from .models import LLMCall, LogEntry
 admin.site.register(LogEntry)
+admin.site.register(LLMCall)
 
 
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.7 on 2026-10-17 07:45
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('logs', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LLMCall',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('call_type', models.CharField(max_length=32)),
+                ('model', models.CharField(blank=True, default='', max_length=64)),
+                ('outcome', models.CharField(choices=[('ok', 'OK'), ('error', 'Error'), ('timeout', 'Timeout'), ('rate_limited', 'Rate limited'), ('fallback', 'Fallback used')], default='ok', max_length=16)),
+                ('error', models.CharField(blank=True, default='', max_length=255)),
+                ('latency_ms', models.PositiveIntegerField(default=0)),
+                ('attempts', models.PositiveSmallIntegerField(default=1)),
+                ('prompt_chars', models.PositiveIntegerField(default=0)),
+                ('response_chars', models.PositiveIntegerField(default=0)),
+                ('prompt_tokens', models.PositiveIntegerField(default=0)),
+                ('response_tokens', models.PositiveIntegerField(default=0)),
+                ('tokens_estimated', models.BooleanField(default=False)),
+                ('cached', models.BooleanField(default=False)),
+                ('document_id', models.UUIDField(blank=True, null=True)),
+                ('user', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='llm_calls', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'db_table': 'llm_calls',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['created_at', 'call_type'], name='llm_calls_created_fee34e_idx'), models.Index(fields=['document_id'], name='llm_calls_documen_7106d3_idx')],
+            },
+        ),
+    ]
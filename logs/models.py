@@ -12,4 +12,43 @@ class LogEntry(models.Model):
         ordering = ['-timestamp']
 
     def __str__(self):
-        return f"[{self.timestamp}] {self.level}: {self.message[:50]}..."
\ No newline at end of file
+        return f"[{self.timestamp}] {self.level}: {self.message[:50]}..."
+
+class LLMCall(models.Model):
+    """One model call (or a non-AI fallback standing in for one), appended by LLMMetrics"""
+
+    OUTCOME_CHOICES = [
+        ('ok', 'OK'),
+        ('error', 'Error'),
+        ('timeout', 'Timeout'),
+        ('rate_limited', 'Rate limited'),
+        ('fallback', 'Fallback used'),
+    ]
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    call_type = models.CharField(max_length=32)
+    model = models.CharField(max_length=64, blank=True, default='')
+    outcome = models.CharField(max_length=16, choices=OUTCOME_CHOICES, default='ok')
+    error = models.CharField(max_length=255, blank=True, default='')
+    latency_ms = models.PositiveIntegerField(default=0)
+    attempts = models.PositiveSmallIntegerField(default=1)
+    prompt_chars = models.PositiveIntegerField(default=0)
+    response_chars = models.PositiveIntegerField(default=0)
+    prompt_tokens = models.PositiveIntegerField(default=0)
+    response_tokens = models.PositiveIntegerField(default=0)
+    tokens_estimated = models.BooleanField(default=False)
+    cached = models.BooleanField(default=False)
+    # ProcessingResult id; not a foreign key so the accounting outlives deleted documents
+    document_id = models.UUIDField(null=True, blank=True)
+    user = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='llm_calls')
+
+    class Meta:
+        db_table = 'llm_calls'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['created_at', 'call_type']),
+            models.Index(fields=['document_id']),
+        ]
+
+    def __str__(self):
+        return f"[{self.created_at}] {self.call_type} on {self.model or '-'}: {self.outcome} in {self.latency_ms}ms"
@@ -6,4 +6,6 @@ urlpatterns = [
     path('get_log_entry/<int:pk>/', views.get_log_entry),
     path('filter_log_entry_by_status_code/<str:status>/', views.filter_log_entry_by_status_code),
     path('filter_by_time_range/', views.filter_by_time_range),
+    path('llm_call_stats/', views.llm_call_stats),
+    path('llm_quota_headroom/', views.llm_quota_headroom),
 ]
\ No newline at end of file
@@ -5,6 +5,8 @@ from rest_framework.permissions import IsAuthenticated
 from .models import LogEntry
 from .serializers import LogEntrySerializer, DateFilterSerializer
 from drf_yasg.utils import swagger_auto_schema
+from Socratic.utils.llm_metrics import LLMMetrics
+from Socratic.utils.rate_limiter import RateLimiter
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -66,3 +68,26 @@ def filter_by_time_range(request):
         return Response({'Log entries for given dates not found'}, status=status.HTTP_404_NOT_FOUND)
 
 
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def llm_call_stats(request):
+    user = request.user
+    """Latency percentiles per LLM call type and the users with the most tokens, over the last ?days= (default 7, at most 365)"""
+    if user.is_admin == False:
+        return Response({"error": "You do not have permission to view logs."}, status=status.HTTP_403_FORBIDDEN)
+    try:
+        days = int(request.query_params.get('days', 7))
+    except ValueError:
+        return Response({"error": "days must be a whole number."}, status=status.HTTP_400_BAD_REQUEST)
+    LLMMetrics.flush()
+    return Response(LLMMetrics.summary(days=days))
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def llm_quota_headroom(request):
+    user = request.user
+    """Requests and tokens left in each Gemini model's per-minute quota right now"""
+    if user.is_admin == False:
+        return Response({"error": "You do not have permission to view logs."}, status=status.HTTP_403_FORBIDDEN)
+    return Response(RateLimiter.headroom())